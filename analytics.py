@@ -0,0 +1,116 @@
+from datetime import date
+
+import numpy as np
+
+from database import get_monthly_category_expenses
+
+ROLLING_MONTHS = 3    # окно скользящего среднего
+ANOMALY_MONTHS = 6    # сколько прошлых месяцев берется для поиска аномалий
+ANOMALY_Z = 2.0       # отклонение в стандартных отклонениях, считающееся аномалией
+TOTAL_CATEGORY = 'Всего'
+
+# ========== ПОСТРОЕНИЕ МАТРИЦЫ МЕСЯЦ × КАТЕГОРИЯ ==========
+
+def _month_index(month):
+    """'ГГГГ-ММ' -> порядковый номер месяца"""
+    year, month_num = month.split('-')
+    return int(year) * 12 + int(month_num) - 1
+
+def _month_name(index):
+    """Порядковый номер месяца -> 'ГГГГ-ММ'"""
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def build_month_matrix(rows, last_month):
+    """Матрица расходов без пропусков месяцев: (месяцы, категории, значения)"""
+    rows = [row for row in rows if row[0] and row[0] <= last_month]
+    if not rows:
+        return [], [], np.zeros((0, 0))
+
+    first = _month_index(rows[0][0])
+    last = _month_index(last_month)
+    months = [_month_name(i) for i in range(first, last + 1)]
+    categories = sorted({category for _, category, _ in rows})
+    category_index = {category: i for i, category in enumerate(categories)}
+
+    matrix = np.zeros((len(months), len(categories) + 1))
+    month_pos = np.fromiter((_month_index(month) - first for month, _, _ in rows), dtype=np.int64)
+    cat_pos = np.fromiter((category_index[category] for _, category, _ in rows), dtype=np.int64)
+    values = np.fromiter((total or 0 for _, _, total in rows), dtype=np.float64)
+    np.add.at(matrix, (month_pos, cat_pos), values)
+    matrix[:, -1] = matrix[:, :-1].sum(axis=1)
+
+    return months, categories + [TOTAL_CATEGORY], matrix
+
+# ========== РАСЧЕТ ТРЕНДОВ ==========
+
+def _lag_change(matrix, lag):
+    """Относительное изменение к значению lag месяцев назад (nan, если сравнивать не с чем)"""
+    change = np.full(matrix.shape, np.nan)
+    if matrix.shape[0] > lag:
+        previous = matrix[:-lag]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change[lag:] = np.where(previous > 0, (matrix[lag:] - previous) / previous, np.nan)
+    return change
+
+def _window_sums(matrix, window):
+    """Суммы по скользящему окну из window предыдущих строк (включая текущую)"""
+    cumulative = np.vstack([np.zeros((1, matrix.shape[1])), np.cumsum(matrix, axis=0)])
+    sums = np.full(matrix.shape, np.nan)
+    if matrix.shape[0] >= window:
+        sums[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return sums
+
+def compute_trends(matrix):
+    """Изменения м/м и г/г, скользящее среднее и флаги аномалий для всех месяцев сразу"""
+    mom = _lag_change(matrix, 1)
+    yoy = _lag_change(matrix, 12)
+    rolling = _window_sums(matrix, ROLLING_MONTHS) / ROLLING_MONTHS
+
+    # Среднее и разброс по ANOMALY_MONTHS месяцам до текущего (сам месяц не входит)
+    anomaly = np.zeros(matrix.shape, dtype=bool)
+    if matrix.shape[0] > ANOMALY_MONTHS:
+        history = _window_sums(matrix, ANOMALY_MONTHS)[ANOMALY_MONTHS - 1:-1]
+        history_sq = _window_sums(matrix ** 2, ANOMALY_MONTHS)[ANOMALY_MONTHS - 1:-1]
+        mean = history / ANOMALY_MONTHS
+        std = np.sqrt(np.maximum(history_sq / ANOMALY_MONTHS - mean ** 2, 0))
+        current = matrix[ANOMALY_MONTHS:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(std > 0, (current - mean) / std, 0)
+        anomaly[ANOMALY_MONTHS:] = np.abs(z) > ANOMALY_Z
+
+    return {'mom': mom, 'yoy': yoy, 'rolling': rolling, 'anomaly': anomaly}
+
+def _nan_to_none(value):
+    return None if np.isnan(value) else float(value)
+
+def get_trend_report(month=None):
+    """Тренды по категориям за месяц (по умолчанию за последний завершенный)"""
+    if month is None:
+        today = date.today()
+        month = _month_name(today.year * 12 + today.month - 2)
+
+    months, categories, matrix = build_month_matrix(get_monthly_category_expenses(), month)
+    if not months:
+        return None
+
+    trends = compute_trends(matrix)
+    row = len(months) - 1
+
+    items = []
+    for col, category in enumerate(categories):
+        current = float(matrix[row, col])
+        rolling = _nan_to_none(trends['rolling'][row, col])
+        if current == 0 and not rolling:
+            continue
+        items.append({
+            'category': category,
+            'total': current,
+            'mom': _nan_to_none(trends['mom'][row, col]),
+            'yoy': _nan_to_none(trends['yoy'][row, col]),
+            'rolling': rolling,
+            'anomaly': bool(trends['anomaly'][row, col]),
+        })
+
+    # Итог по всем категориям выводится последним
+    items.sort(key=lambda item: (item['category'] == TOTAL_CATEGORY, -item['total']))
+    return {'month': month, 'items': items}
@@ -0,0 +1,128 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from config import DB_PATH, BACKUP_DIR, BACKUP_KEEP
+
+BACKUP_PAGES = 4096      # страниц базы за один шаг копирования (16 МБ при страницах 4 КБ)
+BACKUP_PAUSE = 0.005     # пауза между шагами (сек), чтобы запросы бота не ждали копирования
+BACKUP_MAX_RESTARTS = 3  # после стольких перезапусков база докопируется одним шагом
+BACKUP_PREFIX = 'finance_planner-'
+BACKUP_SUFFIX = '.db.gz'
+
+class BackupError(Exception):
+    """Снимок базы поврежден или не найден"""
+
+class _TooManyRestarts(Exception):
+    pass
+
+# ========== СНИМКИ ==========
+
+def _copy_database(source_path, target_path, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Копирование работающей базы через online backup API небольшими шагами.
+    
+    Между шагами блокировка базы снимается, и обработчики бота выполняют свои
+    запросы. Запись в базу во время копирования заставляет SQLite начать его
+    заново; если бот пишет слишком часто, остаток копируется одним шагом -
+    в режиме WAL это одна читающая транзакция, запись она не блокирует.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    progress = {'remaining': None, 'restarts': 0}
+    
+    def on_step(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress['remaining'] = remaining
+        time.sleep(pause)
+    
+    try:
+        try:
+            source.backup(target, pages=pages, progress=on_step)
+        except _TooManyRestarts:
+            source.backup(target, pages=-1)
+    finally:
+        target.close()
+        source.close()
+
+def check_integrity(path):
+    """Проверить несжатую копию базы; BackupError, если она повреждена"""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"{path}: {e}")
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f"{path}: {result}")
+
+def create_backup(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Снять сжатый снимок базы, проверить его и удалить лишние старые снимки"""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{BACKUP_SUFFIX}"
+    path = os.path.join(backup_dir, name)
+    
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work_dir:
+        copy_path = os.path.join(work_dir, 'snapshot.db')
+        _copy_database(DB_PATH, copy_path)
+        check_integrity(copy_path)
+        
+        # Снимок появляется под своим именем только целиком
+        with open(copy_path, 'rb') as source, gzip.open(os.path.join(work_dir, name), 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target)
+        os.replace(os.path.join(work_dir, name), path)
+    
+    for old_path in list_backups(backup_dir)[:-max(keep, 1)]:
+        os.remove(old_path)
+    return path
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Снимки от старых к новым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(name for name in os.listdir(backup_dir)
+                   if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX))
+    return [os.path.join(backup_dir, name) for name in names]
+
+# ========== ВОССТАНОВЛЕНИЕ ==========
+
+def restore_backup(path):
+    """Восстановить базу из снимка; текущая база сначала сохраняется новым снимком.
+    
+    Выполняется при остановленном боте: кэши работающего процесса о замене не узнают.
+    """
+    if not os.path.exists(path):
+        raise BackupError(f"{path}: файл не найден")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        copy_path = os.path.join(work_dir, 'restore.db')
+        with gzip.open(path, 'rb') as source, open(copy_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        check_integrity(copy_path)
+        
+        # Без ротации: иначе восстанавливаемый снимок, если он самый старый,
+        # удалился бы, и повторить восстановление из него было бы нельзя
+        safety_path = create_backup(keep=len(list_backups()) + 1)
+        # Копирование поверх живого файла через backup API корректно обновляет и WAL
+        _copy_database(copy_path, DB_PATH, pages=-1, pause=0)
+    return safety_path
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'create'
+    if command == 'create':
+        print(f"✅ Снимок: {create_backup()}")
+    elif command == 'list':
+        for path in list_backups():
+            print(f"{path}  {os.path.getsize(path) / 1024:.0f} KB")
+    elif command == 'restore' and len(sys.argv) > 2:
+        print(f"✅ База восстановлена, прежняя сохранена в {restore_backup(sys.argv[2])}")
+    else:
+        print("Использование: python backup.py [create | list | restore <снимок>]")
@@ -0,0 +1,57 @@
+"""Запросы бота до и после переноса старой истории и удаленных строк в архив.
+
+База: операции за пять лет, часть из них мягко удалена. Замеряются запросы
+текущего периода, главного экрана и статистики за все время, затем
+database.archive_old_rows и те же запросы после архивации.
+
+Запуск: python benchmarks/bench_archive.py [количество строк]
+"""
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+YEARS = 5
+DELETED_SHARE = 0.15
+RUNS = 10
+
+QUERIES = [
+    ('period month', lambda: database.get_period_statistics(USER_1, 'month')),
+    ('period all', lambda: database.get_period_statistics(USER_1, 'all')),
+    ('dashboard', lambda: database.get_dashboard_snapshot(USER_1)),
+    ('monthly categories', database.get_monthly_category_expenses),
+]
+
+def measure(label):
+    results = []
+    for name, query in QUERIES:
+        results.append(query())  # прогрев кэша страниц
+        report(f'{name}, {label}', [timed(query)[1] for _ in range(RUNS)])
+    return results
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, days=YEARS * 365)
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        UPDATE transactions SET is_deleted = 1, updated_at = DATETIME(date, '+1 day')
+        WHERE abs(random()) % 1000 < ?
+    ''', (int(DELETED_SHARE * 1000),))
+    conn.commit()
+
+    before = measure('live only')
+    moved, elapsed = timed(database.archive_old_rows)
+    live = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+    print(f'archive_old_rows: {moved} in {elapsed / 1000:.1f} s, {live} rows stay live')
+    after = measure('archived')
+    conn.close()
+
+    # Итоги за все время не меняются; суммы за месяц сравниваются с точностью до копейки
+    assert before[1] == after[1], (before[1], after[1])
+    assert before[3] == after[3]
+
+if __name__ == '__main__':
+    main()
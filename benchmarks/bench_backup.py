@@ -0,0 +1,62 @@
+"""Задержка обработчиков бота во время резервного копирования базы.
+
+Нагрузка - цикл запросов главного экрана, статистики и записи новой операции.
+Сравниваются работа без копирования, копирование базы одним шагом и шагами
+разного размера, а также полный снимок backup.create_backup со сжатием.
+
+Запуск: python benchmarks/bench_backup.py [количество строк]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from common import USER_1, report, seed_transactions, setup_database, timed
+
+import backup
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+IDLE_SECONDS = 3
+
+def handle_update(step):
+    """Примерно то, что делает обработчик: читает экран и иногда пишет"""
+    database.get_dashboard_snapshot(USER_1)
+    database.get_period_statistics(USER_1, 'today')
+    if step % 10 == 0:
+        database.add_transaction(USER_1, 'expense', 100.0, 'Еда')
+
+def load_while(is_running):
+    samples = []
+    while is_running():
+        samples.append(timed(handle_update, len(samples))[1])
+    return samples
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+    backup_dir = tempfile.mkdtemp(prefix='finance_backups_')
+    print(f'database {os.path.getsize(database.DB_PATH) / 2 ** 20:.0f} MB')
+
+    deadline = time.perf_counter() + IDLE_SECONDS
+    report('handlers, no backup', load_while(lambda: time.perf_counter() < deadline))
+
+    copy_path = os.path.join(backup_dir, 'copy.db')
+    cases = [
+        ('copy in one step', lambda: backup._copy_database(database.DB_PATH, copy_path, pages=-1, pause=0)),
+        ('copy by 256 pages', lambda: backup._copy_database(database.DB_PATH, copy_path, pages=256)),
+        (f'copy by {backup.BACKUP_PAGES} pages', lambda: backup._copy_database(database.DB_PATH, copy_path)),
+        ('create_backup with gzip', lambda: backup.create_backup(backup_dir)),
+    ]
+    for name, run_backup in cases:
+        elapsed = {}
+        worker = threading.Thread(target=lambda: elapsed.update(ms=timed(run_backup)[1]))
+        worker.start()
+        samples = load_while(worker.is_alive)
+        worker.join()
+        report(f'handlers, {name}', samples)
+        print(f'{"":<40} max {max(samples):8.2f} ms   backup {elapsed["ms"] / 1000:.1f} s')
+
+if __name__ == '__main__':
+    main()
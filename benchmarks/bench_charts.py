@@ -0,0 +1,64 @@
+"""Задержка построения графиков и доля попаданий в кэш.
+
+Запуск: python benchmarks/bench_charts.py
+"""
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+import common
+
+import charts
+import database
+
+OPENS = 200
+PURCHASES = 20
+WRITE_EVERY = 10  # одна новая запись на каждые 10 открытий графиков
+
+async def main():
+    common.setup_database()
+    common.seed_transactions(20000, days=60)
+
+    miss_ms = {kind: [] for kind in charts.CHART_TITLES}
+    hit_ms = []
+    rng = random.Random(1)
+
+    # Купленные покупки за те же 60 дней - без них графику плана и факта нечего рисовать
+    for i in range(PURCHASES):
+        purchase_id = database.add_planned_purchase(common.USER_1, f'покупка {i}', rng.uniform(500, 5000), 'medium',
+                                                    (date.today() - timedelta(days=rng.randrange(60))).isoformat())
+        database.update_purchase(purchase_id, status='bought')
+    database.reconcile_purchases()
+
+    # Первое открытие каждого графика включает запуск пула процессов
+    for kind in charts.CHART_TITLES:
+        await charts.get_chart(kind)
+
+    for i in range(OPENS):
+        if i % WRITE_EVERY == 0:
+            database.add_transaction(common.USER_1, 'expense', 100, 'Еда', 'бенчмарк')
+
+        kind = rng.choice(list(charts.CHART_TITLES))
+        hits_before = charts.chart_cache.hits
+        start = time.perf_counter()
+        png = await charts.get_chart(kind)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert png.startswith(b'\x89PNG')
+
+        if charts.chart_cache.hits > hits_before:
+            hit_ms.append(elapsed)
+        else:
+            miss_ms[kind].append(elapsed)
+
+    for kind, samples in miss_ms.items():
+        if samples:
+            common.report(f'render {kind} (cache miss)', samples)
+    common.report('cache hit', hit_ms)
+    print(f'cache hit rate: {charts.chart_cache.hit_rate:.1%} '
+          f'({charts.chart_cache.hits} hits / {charts.chart_cache.misses} misses)')
+
+    charts.shutdown_chart_pool()
+
+if __name__ == '__main__':
+    asyncio.run(main())
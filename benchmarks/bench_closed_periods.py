@@ -0,0 +1,96 @@
+"""Статистика "за все время" и тренды с замороженными итогами закрытых месяцев.
+
+Прежние запросы суммировали все операции рабочей таблицы. Сейчас операциями
+читается только текущий месяц, а прошлые берутся из period_totals. Отдельно
+измеряется чтение после записи задним числом, когда один месяц пересчитывается.
+
+Запуск: python benchmarks/bench_closed_periods.py [количество строк]
+"""
+import sqlite3
+import sys
+from datetime import date
+
+from common import DB_PATH, USER_1, USER_2, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+RUNS = 50
+
+def legacy_all_time(user_id):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT SUM(income) / 100.0, SUM(expense) / 100.0, SUM(count)
+        FROM (
+            SELECT SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) as income,
+                   SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) as expense,
+                   COUNT(*) as count
+            FROM transactions_base WHERE user_id = ? AND is_deleted = 0
+            UNION ALL
+            SELECT SUM(CASE WHEN type = 'income' THEN total_minor ELSE 0 END),
+                   SUM(CASE WHEN type = 'expense' THEN total_minor ELSE 0 END), SUM(count)
+            FROM transaction_rollups WHERE user_id = ?
+        )
+    ''', (user_id, user_id))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+def legacy_monthly_categories():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT month, category, SUM(total) / 100.0
+        FROM (
+            SELECT strftime('%Y-%m', date) as month, category, SUM(base_minor) as total
+            FROM transactions_base
+            WHERE type = 'expense' AND user_id IN (?, ?) AND is_deleted = 0
+            GROUP BY month, category
+            UNION ALL
+            SELECT month, category, SUM(total_minor) FROM transaction_rollups
+            WHERE type = 'expense' AND user_id IN (?, ?)
+            GROUP BY month, category
+        )
+        GROUP BY month, category
+        ORDER BY month
+    ''', (USER_1, USER_2, USER_1, USER_2))
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+def back_dated_write():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("UPDATE transactions SET amount_minor = amount_minor + 1 WHERE id = "
+                 "(SELECT MIN(id) FROM transactions WHERE date < date('now', 'start of month', '-2 months'))")
+    conn.commit()
+    conn.close()
+
+def timed_after_write(run):
+    back_dated_write()
+    return timed(run)[1]
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, days=730, foreign_share=0.1)
+
+    cases = [
+        ('all time: full scan', lambda: legacy_all_time(USER_1)),
+        ('all time: frozen months', lambda: database.get_period_statistics(USER_1, 'all')),
+        ('trends: full scan', legacy_monthly_categories),
+        ('trends: frozen months', database.get_monthly_category_expenses),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+    report('all time: after back-dated edit',
+           [timed_after_write(lambda: database.get_period_statistics(USER_1, 'all')) for _ in range(RUNS)])
+
+    assert [round(value, 2) for value in legacy_all_time(USER_1)] == \
+        [round(value, 2) for value in database.get_period_statistics(USER_1, 'all')]
+    legacy = {(month, category): round(total, 2) for month, category, total in legacy_monthly_categories()}
+    frozen = {(month, category): round(total, 2) for month, category, total in database.get_monthly_category_expenses()}
+    assert legacy == frozen
+
+if __name__ == '__main__':
+    main()
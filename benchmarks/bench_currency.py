@@ -0,0 +1,74 @@
+"""Общая статистика пары при операциях в нескольких валютах.
+
+Пересчет в рубли внутри агрегатного запроса (представление transactions_base)
+сравнивается с пересчетом каждой строки в Python по курсам из памяти.
+
+Запуск: python benchmarks/bench_currency.py [количество строк]
+"""
+import sqlite3
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import (DB_PATH, FOREIGN_CURRENCIES, USER_1, USER_2, report, seed_transactions,
+                    setup_database, timed)
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+FOREIGN_SHARE = 0.2
+RUNS = 5
+
+def seed_rates(days=365):
+    """Ежедневные курсы валют за период тестовых операций"""
+    today = date.today()
+    rows = [(currency, (today - timedelta(days=day)).isoformat(), base + day % 7)
+            for currency, base in zip(FOREIGN_CURRENCIES, (90.0, 100.0))
+            for day in range(days)]
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('INSERT INTO exchange_rates (currency, date, rate) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+def combined_sql(conn):
+    """Доходы и расходы каждого партнера одним запросом"""
+    return conn.execute('''
+        SELECT user_id,
+               SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) / 100.0,
+               SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0
+        FROM transactions_base
+        WHERE user_id IN (?, ?) AND is_deleted = 0
+        GROUP BY user_id
+    ''', (USER_1, USER_2)).fetchall()
+
+def combined_python(conn):
+    """То же с пересчетом каждой строки в Python"""
+    totals = defaultdict(lambda: [0, 0])
+    for user_id in (USER_1, USER_2):
+        rows = conn.execute('''
+            SELECT type, amount_minor, currency, date FROM transactions
+            WHERE user_id = ? AND is_deleted = 0
+        ''', (user_id,))
+        for trans_type, amount_minor, currency, trans_date in rows:
+            minor = round(amount_minor * database.get_exchange_rate(currency, trans_date))
+            totals[user_id][trans_type == 'expense'] += minor
+    return sorted((user_id, income / 100, expense / 100) for user_id, (income, expense) in totals.items())
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, foreign_share=FOREIGN_SHARE)
+    seed_rates()
+    database.get_exchange_rate('USD')  # прогрев кэша курсов
+
+    conn = sqlite3.connect(DB_PATH)
+    sql_result = combined_sql(conn)
+    python_result = combined_python(conn)
+    assert sql_result == python_result, (sql_result, python_result)
+
+    print(f'{ROWS} rows, {FOREIGN_SHARE:.0%} in {", ".join(FOREIGN_CURRENCIES)}')
+    report('combined totals, SQL conversion', [timed(combined_sql, conn)[1] for _ in range(RUNS)])
+    report('combined totals, Python per row', [timed(combined_python, conn)[1] for _ in range(RUNS)])
+    conn.close()
+
+if __name__ == '__main__':
+    main()
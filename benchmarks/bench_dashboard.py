@@ -0,0 +1,43 @@
+"""Сборка главного экрана «Последние записи».
+
+Сравниваются прежние четыре запроса (по 50 строк транзакций, все планы и покупки
+через отдельные подключения), один снимок get_dashboard_snapshot и кэшированный текст.
+
+Запуск: python benchmarks/bench_dashboard.py
+"""
+from common import USER_1, report, seed_transactions, setup_database, timed
+
+import database
+
+TRANSACTIONS = 50000
+PLANS = 2000
+PURCHASES = 500
+RUNS = 100
+
+def seed_plans_and_purchases():
+    for i in range(PLANS):
+        database.add_plan(USER_1, f'план {i}', None, f'20{25 + i % 5}-{i % 12 + 1:02d}-{i % 28 + 1:02d}')
+    for i in range(PURCHASES):
+        database.add_planned_purchase(USER_1, f'покупка {i}', 100 + i, ('high', 'medium', 'low')[i % 3])
+
+def legacy_snapshot(user_id):
+    return {
+        'expenses': database.get_user_transactions(user_id, 'all', 'expense')[:5],
+        'incomes': database.get_user_transactions(user_id, 'all', 'income')[:5],
+        'plans': database.get_user_plans(user_id),
+        'purchases': database.get_user_purchases(user_id),
+    }
+
+def main():
+    setup_database()
+    seed_transactions(TRANSACTIONS)
+    seed_plans_and_purchases()
+
+    import bot
+
+    report('legacy 4 queries', [timed(legacy_snapshot, USER_1)[1] for _ in range(RUNS)])
+    report('get_dashboard_snapshot', [timed(database.get_dashboard_snapshot, USER_1)[1] for _ in range(RUNS)])
+    report('cached home screen', [timed(bot.get_dashboard_text, USER_1)[1] for _ in range(RUNS)])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Расчет долгов домохозяйства из нескольких участников.
+
+Прямой способ - пройти по каждой разделенной операции, начислить долг каждого
+участника плательщику и перевести по каждой паре, у которой остался долг:
+время растет с историей, а переводов - до n(n-1)/2. Сейчас балансы считаются
+одним агрегатом по частичным индексам, а жадный алгоритм дает не больше n - 1
+переводов.
+
+Запуск: python benchmarks/bench_debts.py [участников] [количество строк]
+"""
+import random
+import sqlite3
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import DB_PATH, EXPENSE_CATEGORIES, report, setup_database, timed
+
+from database import get_split_flows
+from settlement import net_balances, simplify_debts
+
+MEMBERS = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+RUNS = 20
+
+def seed_household(seed=42):
+    # Участники, три года операций (треть из них разделена) и редкие переводы
+    rng = random.Random(seed)
+    today = date.today()
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('INSERT OR IGNORE INTO users (id, username, full_name) VALUES (?, ?, ?)',
+                     [(member, f'member{member}', f'Участник {member}') for member in range(1, MEMBERS + 1)])
+    rows = []
+    for _ in range(ROWS):
+        amount_minor = rng.randrange(5000, 500000)
+        rows.append((rng.randint(1, MEMBERS), amount_minor / 100, amount_minor, rng.choice(EXPENSE_CATEGORIES),
+                     (today - timedelta(days=rng.randrange(3 * 365))).isoformat(),
+                     rng.choice((50, 100)) if rng.random() < 1 / 3 else 0))
+    conn.executemany('''
+        INSERT INTO transactions (user_id, type, amount, amount_minor, category, date, split_share)
+        VALUES (?, 'expense', ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.executemany('INSERT INTO settlements (from_user, to_user, amount_minor) VALUES (?, ?, ?)',
+                     [rng.sample(range(1, MEMBERS + 1), 2) + [rng.randrange(10000, 1000000)] for _ in range(ROWS // 200)])
+    conn.commit()
+    conn.close()
+
+def pairwise_plan():
+    conn = sqlite3.connect(DB_PATH)
+    members = [row[0] for row in conn.execute('SELECT id FROM users')]
+    owed = defaultdict(int)  # (должник, кредитор) -> копейки * (n - 1)
+    for payer, split_minor in conn.execute(
+            'SELECT user_id, split_minor FROM transactions WHERE is_deleted = 0 AND split_minor != 0'):
+        for member in members:
+            if member != payer:
+                owed[member, payer] += split_minor
+    for from_user, to_user, amount_minor in conn.execute('SELECT from_user, to_user, amount_minor FROM settlements'):
+        owed[from_user, to_user] -= amount_minor * (len(members) - 1)
+    conn.close()
+
+    transfers = []
+    for (debtor, creditor), amount in owed.items():
+        net = amount - owed.get((creditor, debtor), 0)
+        if net > 0:
+            transfers.append((debtor, creditor, net / (len(members) - 1)))
+    return transfers
+
+def engine_plan():
+    return simplify_debts(net_balances(get_split_flows()))
+
+def main():
+    setup_database()
+    seed_household()
+
+    for name, run in (('pairwise over history', pairwise_plan), ('aggregate + greedy', engine_plan)):
+        transfers = run()
+        report(f'{name} ({MEMBERS} members, {ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+        print(f'{"":<40} {len(transfers)} transfers')
+
+    # Оба плана закрывают одни и те же балансы
+    totals = defaultdict(float)
+    for debtor, creditor, amount in pairwise_plan():
+        totals[debtor] += amount
+        totals[creditor] -= amount
+    for debtor, creditor, amount in engine_plan():
+        totals[debtor] -= amount
+        totals[creditor] += amount
+    assert all(abs(total) < MEMBERS for total in totals.values())
+
+if __name__ == '__main__':
+    main()
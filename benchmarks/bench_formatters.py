@@ -0,0 +1,90 @@
+"""Рендеринг длинных списков операций в тексты статистики.
+
+Сравнивается прежний способ (конкатенация += и html.escape на каждой строке)
+с рендерерами из formatters.py на списках в тысячу строк.
+
+Запуск: python benchmarks/bench_formatters.py
+"""
+import html
+import random
+from datetime import date, timedelta
+
+from common import EXPENSE_CATEGORIES, INCOME_CATEGORIES, report, timed
+
+import formatters
+from models import Transaction
+
+ROWS = 1000
+RUNS = 50
+
+def make_transactions(count, seed=42):
+    """Строки в прежнем позиционном формате get_user_transactions за период"""
+    rng = random.Random(seed)
+    today = date.today()
+    rows = []
+    for trans_id in range(count):
+        trans_type = 'income' if rng.random() < 0.1 else 'expense'
+        categories = INCOME_CATEGORIES if trans_type == 'income' else EXPENSE_CATEGORIES
+        rows.append((trans_id, trans_type, round(rng.uniform(50, 5000), 2), rng.choice(categories),
+                     f'запись {rng.randint(1, 1000)} <b>', (today - timedelta(days=trans_id // 30)).isoformat(),
+                     f'{rng.randrange(24):02d}:{rng.randrange(60):02d}'))
+    return rows
+
+def legacy_format_transaction(trans):
+    trans_id, trans_type, amount, category, description, date_str, time = trans[:7]
+    emoji = "💵" if trans_type == 'income' else "💸"
+    type_text = "Доход" if trans_type == 'income' else "Расход"
+    time_str = f" ({time})" if time else ""
+    category_escaped = html.escape(category)
+    description_escaped = html.escape(description) if description else ""
+    result = f"{emoji} <b>{type_text}:</b> {amount:.2f} руб.\n"
+    result += f"   📂 Категория: {category_escaped}\n"
+    result += f"   📅 Дата: {date_str}{time_str}\n"
+    if description_escaped:
+        result += f"   📝 Описание: {description_escaped}\n"
+    return result
+
+def legacy_period_statistics(stats, transactions):
+    response = f"📊 <b>Статистика за месяц:</b>\n\n📈 <b>Доходы:</b> {stats[0]:.2f} руб.\n"
+    response += "\n\n📝 <b>Детали операций:</b>\n\n"
+    current_date = None
+    for trans in transactions:
+        if trans[5] != current_date:
+            current_date = trans[5]
+            response += f"\n📅 <b>{current_date}:</b>\n"
+        response += "  " + legacy_format_transaction(trans)
+    return response
+
+def legacy_partner_transactions(transactions):
+    response = "💸 <b>Расходы партнера за месяц:</b>\n\n"
+    total = 0
+    for trans_id, trans_type, amount, category, description, trans_date, time in transactions:
+        total += amount
+        time_str = f" ({time})" if time else ""
+        response += f"• {html.escape(category)}: {amount:.2f} руб. ({trans_date}{time_str})\n"
+        if description:
+            response += f"  {html.escape(description)}\n"
+    response += f"\n<b>Всего: {total:.2f} руб.</b>"
+    return response
+
+def main():
+    transactions = make_transactions(ROWS)
+    typed = [Transaction(trans[0], 1, *trans[1:], 'RUB', trans[2], 0) for trans in transactions]
+    stats = (100000.0, 90000.0, ROWS)
+
+    cases = [
+        ('period legacy', lambda: legacy_period_statistics(stats, transactions)),
+        ('period renderers', lambda: formatters.render_period_statistics('месяц', stats, typed)),
+        ('partner legacy', lambda: legacy_partner_transactions(transactions)),
+        ('partner renderers', lambda: formatters.render_partner_transactions('💸 <b>Расходы:</b>\n\n',
+                                                                             typed)),
+    ]
+    for name, render in cases:
+        render()  # прогрев кэша экранирования
+        report(f'{name} ({ROWS} rows)', [timed(render)[1] for _ in range(RUNS)])
+
+    info = formatters.escape_name.cache_info()
+    print(f'escape cache: hits {info.hits}, misses {info.misses}, size {info.currsize}')
+
+if __name__ == '__main__':
+    main()
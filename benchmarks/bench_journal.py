@@ -0,0 +1,68 @@
+"""Цена журнала изменений на пути записи.
+
+Сравнивается прежний update_transaction (один UPDATE) с текущим, который
+той же транзакцией читает прежние значения и дописывает строку в change_journal,
+а также удаление и отмена последнего изменения.
+
+Запуск: python benchmarks/bench_journal.py [количество строк]
+"""
+import random
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+RUNS = 500
+
+def legacy_update_transaction(transaction_id, amount=None, category=None, description=None):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    updates = []
+    params = []
+    if amount is not None:
+        updates += ['amount = ?', 'amount_minor = ?']
+        params += [amount, database.to_minor(amount)]
+    if category is not None:
+        updates.append('category = ?')
+        params.append(category)
+    if description is not None:
+        updates.append('description = ?')
+        params.append(description)
+    if updates:
+        updates.append('updated_at = CURRENT_TIMESTAMP')
+        params.append(transaction_id)
+        cursor.execute(f"UPDATE transactions SET {', '.join(updates)} WHERE id = ?", params)
+    conn.commit()
+    conn.close()
+    database._bump_data_version()
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+    conn = sqlite3.connect(DB_PATH)
+    ids = [row[0] for row in conn.execute('SELECT id FROM transactions WHERE user_id = ?', (USER_1,))]
+    conn.close()
+    rng = random.Random(42)
+
+    def update(func):
+        return lambda: func(rng.choice(ids), amount=round(rng.uniform(50, 5000), 2), description='правка')
+
+    cases = [
+        ('update legacy', update(legacy_update_transaction)),
+        ('update journaled', update(database.update_transaction)),
+        ('delete journaled', lambda: database.delete_transaction(rng.choice(ids))),
+        ('undo last change', lambda: database.undo_last_change(USER_1)),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+
+    conn = sqlite3.connect(DB_PATH)
+    print(f"journal rows: {conn.execute('SELECT COUNT(*) FROM change_journal').fetchone()[0]}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
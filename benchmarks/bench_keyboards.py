@@ -0,0 +1,59 @@
+"""Память и время на получение клавиатуры для одного апдейта.
+
+Сравниваются сборка клавиатуры с нуля (как раньше) и готовый JSON из кэша.
+В замер входит prepare_arg - сериализация, которую aiogram выполняет при отправке.
+
+Запуск: python benchmarks/bench_keyboards.py
+"""
+import inspect
+import time
+import tracemalloc
+
+import common  # noqa: F401
+
+from aiogram.utils.payload import prepare_arg
+
+import keyboards
+
+CALLS = 2000
+
+CASES = [
+    ('get_main_keyboard', ()),
+    ('get_statistics_menu_keyboard', ()),
+    ('get_expense_categories_keyboard', ()),
+    ('get_management_keyboard', ()),
+    ('get_edit_transaction_keyboard', (42, 'expense')),
+    ('get_delete_confirmation_keyboard', ('plan', 42)),
+]
+
+def measure(func, args):
+    """Средние байты пиковой памяти и микросекунды на вызов"""
+    prepare_arg(func(*args))  # прогрев кэшей
+
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(200):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        prepare_arg(func(*args))
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        prepare_arg(func(*args))
+    elapsed_us = (time.perf_counter() - start) / CALLS * 1e6
+
+    return peak_total / 200, elapsed_us
+
+def main():
+    print(f'{"keyboard":<36}{"build bytes":>12}{"cached bytes":>14}{"build us":>10}{"cached us":>11}')
+    for name, args in CASES:
+        cached = getattr(keyboards, name)
+        build = inspect.unwrap(cached)
+        build_bytes, build_us = measure(build, args)
+        cached_bytes, cached_us = measure(cached, args)
+        print(f'{name:<36}{build_bytes:>12.0f}{cached_bytes:>14.0f}{build_us:>10.1f}{cached_us:>11.2f}')
+
+if __name__ == '__main__':
+    main()
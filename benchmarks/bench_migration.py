@@ -0,0 +1,64 @@
+"""Задержка записей бота во время заполнения новой колонки миграцией.
+
+Пока в отдельном потоке идет backfill_minor_units, основной поток добавляет
+операции так же, как add_transaction, и замеряет время каждой записи.
+Сравнивается заполнение одним UPDATE и по кускам BACKFILL_CHUNK строк.
+
+Запуск: python benchmarks/bench_migration.py [количество строк]
+"""
+import sqlite3
+import sys
+import threading
+import time
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import migration
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+WRITE_INTERVAL = 0.01  # бот записывает операцию раз в 10 мс
+
+def add_transaction():
+    # Как database.add_transaction, но с долгим ожиданием блокировки вместо ошибки
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    conn.execute('''
+        INSERT INTO transactions (user_id, type, amount, amount_minor, category, date)
+        VALUES (?, 'expense', 100.0, 10000, 'Еда', DATE('now'))
+    ''', (USER_1,))
+    conn.commit()
+    conn.close()
+
+def measure_writes(chunk):
+    """Замеры записей (мс) и длительность заполнения (с)"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('UPDATE transactions SET amount_minor = NULL')
+    conn.commit()
+    conn.close()
+
+    elapsed = {}
+    def backfill():
+        conn = sqlite3.connect(DB_PATH, timeout=60)
+        _, elapsed['ms'] = timed(migration.backfill_minor_units, conn, 'transactions',
+                                 'amount_minor', 'amount', chunk=chunk)
+        conn.close()
+
+    worker = threading.Thread(target=backfill)
+    worker.start()
+    samples = []
+    while worker.is_alive():
+        samples.append(timed(add_transaction)[1])
+        time.sleep(WRITE_INTERVAL)
+    worker.join()
+    return samples, elapsed['ms'] / 1000
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+
+    for name, chunk in (('single UPDATE', ROWS), (f'chunks of {migration.BACKFILL_CHUNK}', migration.BACKFILL_CHUNK)):
+        samples, seconds = measure_writes(chunk)
+        report(f'writes during backfill, {name}', samples)
+        print(f'{"":<40} max {max(samples):8.2f} ms   backfill {seconds:.1f} s')
+
+if __name__ == '__main__':
+    main()
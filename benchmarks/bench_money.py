@@ -0,0 +1,61 @@
+"""Агрегация сумм в копейках (INTEGER) против прежних REAL на миллионах строк.
+
+Также замеряется заполнение amount_minor миграцией по кускам.
+
+Запуск: python benchmarks/bench_money.py [количество строк]
+"""
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import migration
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+RUNS = 5
+
+QUERIES = {
+    'period REAL': '''
+        SELECT SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+               SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+        FROM transactions WHERE user_id = ? AND is_deleted = 0
+    ''',
+    'period INTEGER': '''
+        SELECT SUM(CASE WHEN type = 'income' THEN amount_minor ELSE 0 END) / 100.0,
+               SUM(CASE WHEN type = 'expense' THEN amount_minor ELSE 0 END) / 100.0
+        FROM transactions WHERE user_id = ? AND is_deleted = 0
+    ''',
+    'by category REAL': '''
+        SELECT category, SUM(amount) FROM transactions
+        WHERE user_id = ? AND type = 'expense' AND is_deleted = 0 GROUP BY category
+    ''',
+    'by category INTEGER': '''
+        SELECT category, SUM(amount_minor) / 100.0 FROM transactions
+        WHERE user_id = ? AND type = 'expense' AND is_deleted = 0 GROUP BY category
+    ''',
+}
+
+def run_query(conn, sql):
+    return conn.execute(sql, (USER_1,)).fetchall()
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+
+    conn = sqlite3.connect(DB_PATH)
+    run_query(conn, QUERIES['period REAL'])  # прогрев кэша страниц
+    for name, sql in QUERIES.items():
+        report(f'{name} ({ROWS} rows)', [timed(run_query, conn, sql)[1] for _ in range(RUNS)])
+
+    real_sum = conn.execute('SELECT SUM(amount) FROM transactions').fetchone()[0]
+    exact_sum = conn.execute('SELECT SUM(amount_minor) FROM transactions').fetchone()[0]
+    print(f'REAL sum {real_sum!r}, exact {exact_sum // 100}.{exact_sum % 100:02d}')
+
+    conn.execute('UPDATE transactions SET amount_minor = NULL')
+    conn.commit()
+    updated, elapsed = timed(migration.backfill_minor_units, conn, 'transactions', 'amount_minor', 'amount')
+    print(f'backfill: {updated} rows in {elapsed / 1000:.1f} s, chunks of {migration.BACKFILL_CHUNK}')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
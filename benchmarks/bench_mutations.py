@@ -0,0 +1,49 @@
+"""Действия управления записями: проверка владельца, изменение и ответ.
+
+Прежний путь обработчика - get_* для проверки владельца, update_*/delete_*
+отдельным подключением и еще один get_* для ответа. Сейчас update_* с user_id
+проверяет владельца в самом UPDATE и возвращает новую строку через RETURNING.
+
+Запуск: python benchmarks/bench_mutations.py [количество строк]
+"""
+import random
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+RUNS = 500
+
+def legacy_edit(transaction_id, user_id, description):
+    transaction = database.get_transaction(transaction_id)
+    if transaction and transaction.user_id == user_id:
+        database.update_transaction(transaction_id, description=description)
+        return database.get_transaction(transaction_id)
+    return None
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, foreign_share=0.1)
+    conn = sqlite3.connect(DB_PATH)
+    ids = [row[0] for row in conn.execute('SELECT id FROM transactions WHERE user_id = ?', (USER_1,))]
+    conn.close()
+    rng = random.Random(42)
+
+    cases = [
+        ('edit: get + update + get', lambda: legacy_edit(rng.choice(ids), USER_1, 'правка')),
+        ('edit: scoped update RETURNING', lambda: database.update_transaction(rng.choice(ids), description='правка',
+                                                                             user_id=USER_1)),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+
+    transaction_id = rng.choice(ids)
+    assert legacy_edit(transaction_id, USER_1, 'x') == database.update_transaction(transaction_id, description='x',
+                                                                                   user_id=USER_1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""План и факт по покупкам за полгода.
+
+Сравнивается пересчет всех месяцев на каждый запрос с get_plan_report, где
+закрытые месяцы считаются один раз, а одна группирующая выборка после
+изменения данных захватывает только текущий месяц.
+
+Запуск: python benchmarks/bench_plan_report.py [количество строк]
+"""
+import random
+import sys
+from datetime import date, timedelta
+
+from common import USER_1, USER_2, report, seed_transactions, setup_database, timed
+
+import database
+import planning
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PURCHASES = 2000
+RUNS = 100
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+    rng = random.Random(42)
+    today = date.today()
+    for i in range(PURCHASES):
+        target = (today - timedelta(days=rng.randrange(180))).isoformat()
+        purchase_id = database.add_planned_purchase(rng.choice((USER_1, USER_2)), f'покупка {i}',
+                                                    rng.uniform(500, 50000), 'medium', target)
+        if rng.random() < 0.7:
+            database.update_purchase(purchase_id, status='bought')
+    print(f'linked: {database.reconcile_purchases()}')
+
+    def full():
+        planning._closed_months.clear()
+        planning._open_month.clear()
+        return planning.get_plan_report()
+
+    def after_write():
+        database._bump_data_version()
+        return planning.get_plan_report()
+
+    cases = [
+        ('all months every time', full),
+        ('closed months cached', after_write),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({PURCHASES} purchases, {ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+
+    assert full() == after_write()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Календарь планов при десятках тысяч записей.
+
+Сравниваются прежние запросы с "(user_id = ? OR is_shared = 1)" и общие планы
+без ограничения с UNION ALL двух выборок по частичным индексам
+(database.get_user_plans, get_shared_plans, планы главного экрана), а также
+просмотр месяца по дням: запрос на каждый день против одного запроса на месяц
+и календарной клавиатуры из кэша.
+
+Запуск: python benchmarks/bench_plans.py [количество планов]
+"""
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+from common import DB_PATH, USER_1, USER_2, report, setup_database, timed
+
+import database
+import keyboards
+from models import PLAN_COLUMNS, PLAN_ROW
+
+PLANS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+DAYS = 730
+SHARED_SHARE = 0.3
+DELETED_SHARE = 0.05
+RUNS = 50
+
+def seed_plans(count, seed=42):
+    """Планы обоих пользователей на год назад и год вперед"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=DAYS // 2)
+    rows = [(rng.choice((USER_1, USER_2)), f'план {i}', (start + timedelta(days=rng.randrange(DAYS))).isoformat(),
+             f'{rng.randrange(24):02d}:00' if rng.random() < 0.7 else None,
+             int(rng.random() < SHARED_SHARE), int(rng.random() < DELETED_SHARE))
+            for i in range(count)]
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('''
+        INSERT INTO plans (user_id, title, date, time, is_shared, is_deleted)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+def legacy_query(sql, params):
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PLAN_ROW
+    results = conn.execute(sql, params).fetchall()
+    conn.close()
+    return results
+
+def legacy_user_plans(user_id, target_date):
+    return legacy_query(f'''
+        SELECT {PLAN_COLUMNS} FROM plans
+        WHERE (user_id = ? OR is_shared = 1) AND date = ? AND is_deleted = 0
+        ORDER BY time NULLS FIRST, created_at
+    ''', (user_id, target_date))
+
+def legacy_window_plans(user_id, date_from, date_to):
+    return legacy_query(f'''
+        SELECT {PLAN_COLUMNS} FROM plans
+        WHERE (user_id = ? OR is_shared = 1) AND date BETWEEN ? AND ? AND is_deleted = 0
+        ORDER BY date, time NULLS FIRST, created_at
+    ''', (user_id, date_from, date_to))
+
+def legacy_upcoming_plans(user_id, limit=3):
+    return legacy_query(f'''
+        SELECT {PLAN_COLUMNS} FROM plans
+        WHERE (user_id = ? OR is_shared = 1) AND date >= ? AND is_deleted = 0
+        ORDER BY date, time NULLS FIRST, created_at
+        LIMIT ?
+    ''', (user_id, date.today().isoformat(), limit))
+
+def legacy_shared_plans():
+    return legacy_query(f'''
+        SELECT {PLAN_COLUMNS} FROM plans
+        WHERE is_shared = 1 AND is_deleted = 0 AND date >= DATE('now')
+        ORDER BY date, time NULLS FIRST
+    ''', ())
+
+def month_by_days(user_id, month_start):
+    """Прежний способ: запрос планов на каждый просмотренный день"""
+    return [database.get_user_plans(user_id, (month_start + timedelta(days=day)).isoformat())
+            for day in range(30)]
+
+def month_range(user_id, month_start):
+    """Один запрос на месяц, дни группируются в памяти, клавиатура - из кэша"""
+    plans_by_date = {}
+    month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    for plan in database.get_visible_plans(user_id, month_start.isoformat(), month_end.isoformat()):
+        plans_by_date.setdefault(plan.date, []).append(plan)
+    busy_days = tuple(sorted(int(plan_date[8:]) for plan_date in plans_by_date))
+    return keyboards.get_calendar_keyboard(month_start.year, month_start.month, busy_days)
+
+def main():
+    setup_database()
+    seed_plans(PLANS)
+    today = date.today().isoformat()
+    week_end = (date.today() + timedelta(days=6)).isoformat()
+
+    assert [p.id for p in legacy_user_plans(USER_1, today)] == [p.id for p in database.get_user_plans(USER_1)]
+    assert legacy_upcoming_plans(USER_1) == database.get_visible_plans(USER_1, today, limit=3)
+
+    cases = [
+        ('day legacy OR', lambda: legacy_user_plans(USER_1, today)),
+        ('day UNION ALL', lambda: database.get_user_plans(USER_1)),
+        ('week legacy OR', lambda: legacy_window_plans(USER_1, today, week_end)),
+        ('week UNION ALL', lambda: database.get_visible_plans(USER_1, today, week_end)),
+        ('next 3 legacy OR', lambda: legacy_upcoming_plans(USER_1)),
+        ('next 3 UNION ALL', lambda: database.get_visible_plans(USER_1, today, limit=3)),
+        ('shared legacy (no limit)', legacy_shared_plans),
+        ('shared limit 30', database.get_shared_plans),
+        ('month, query per day', lambda: month_by_days(USER_1, date.today().replace(day=1))),
+        ('month, one range query', lambda: month_range(USER_1, date.today().replace(day=1))),
+    ]
+    for name, query in cases:
+        query()
+        report(f'{name} ({PLANS} plans)', [timed(query)[1] for _ in range(RUNS)])
+
+    conn = sqlite3.connect(DB_PATH)
+    legacy_plan = conn.execute(f'''
+        EXPLAIN QUERY PLAN SELECT {PLAN_COLUMNS} FROM plans
+        WHERE (user_id = ? OR is_shared = 1) AND date BETWEEN ? AND ? AND is_deleted = 0
+        ORDER BY date, time NULLS FIRST, created_at
+    ''', (USER_1, today, week_end)).fetchall()
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {database.VISIBLE_PLANS_SQL}',
+                        {'user_id': USER_1, 'date_from': today, 'date_to': week_end, 'limit': -1}).fetchall()
+    conn.close()
+    print('\nlegacy OR:\n' + '\n'.join(row[-1] for row in legacy_plan))
+    print('\nUNION ALL:\n' + '\n'.join(row[-1] for row in plan))
+
+if __name__ == '__main__':
+    main()
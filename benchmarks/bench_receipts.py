@@ -0,0 +1,98 @@
+"""Распознавание чеков с фото.
+
+Разбор текста чека измеряется всегда. Если установлены pytesseract, Pillow и
+tesseract-ocr, распознается пачка сгенерированных чеков: прямо в цикле событий
+(так бот не отвечает никому, пока идет OCR) и через пул процессов с разным
+числом процессов. Для каждого случая печатаются пропускная способность и
+наибольшая задержка цикла событий.
+
+Запуск: python benchmarks/bench_receipts.py [количество чеков]
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import report, timed
+
+from receipts import OCR_AVAILABLE, parse_receipt, recognize_receipt
+
+RECEIPTS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+RUNS = 200
+
+SAMPLE = '''ООО "Ромашка"
+КАССОВЫЙ ЧЕК / ПРИХОД
+12.10.2025 18:45
+Хлеб 1 x 45,00 =45.00
+Молоко 2 x 89.90 =179.80
+Сыр 1 x 1 250,00 =1 250,00
+ИТОГ =1 474,80
+НДС 20% =245.80
+НАЛИЧНЫМИ =5000.00
+СДАЧА =3525.20
+'''
+
+def receipt_image(index):
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new('L', (900, 1400), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=36)
+    for row, line in enumerate(SAMPLE.replace('1 474,80', f'{1000 + index},00').splitlines()):
+        draw.text((40, 40 + row * 60), line, fill=0, font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+async def measure_lag(work):
+    """Выполнить work и вернуть (секунды, наибольшая задержка цикла событий в мс)"""
+    lags = []
+    stop = False
+
+    async def ticker():
+        while not stop:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((time.perf_counter() - start - 0.005) * 1000)
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    stop = True
+    await task
+    return elapsed, max(lags, default=0.0)
+
+def inline(images):
+    async def run():
+        for image in images:
+            recognize_receipt(image)
+    return run
+
+def pooled(images, workers):
+    async def run():
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            await asyncio.gather(*(loop.run_in_executor(pool, recognize_receipt, image) for image in images))
+    return run
+
+def main():
+    report('parse receipt text', [timed(parse_receipt, SAMPLE)[1] for _ in range(RUNS)])
+    assert parse_receipt(SAMPLE).total == 1474.8
+
+    if not OCR_AVAILABLE:
+        print('pytesseract/Pillow не установлены - распознавание не измеряется')
+        return
+
+    images = [receipt_image(index) for index in range(RECEIPTS)]
+    cases = [('OCR in event loop', inline(images))]
+    cases += [(f'OCR pool, {workers} workers', pooled(images, workers))
+              for workers in sorted({1, 2, os.cpu_count() or 1})]
+    for name, work in cases:
+        elapsed, lag = asyncio.run(measure_lag(work))
+        print(f'{name:<40} {RECEIPTS / elapsed:8.2f} receipts/s   max loop lag {lag:8.2f} ms')
+    assert recognize_receipt(images[0]).total is not None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Сверка купленных покупок с расходами.
+
+Наивная сверка перебирает в Python все расходы пользователя для каждой
+покупки. _find_purchase_match берет кандидатов из окна дат вокруг покупки
+по покрывающему индексу и сверяет в Python только их.
+
+Запуск: python benchmarks/bench_reconcile.py [количество строк]
+"""
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PURCHASES = 50
+RUNS = 3
+
+def naive_match(cursor, user_id, item_name, cost_minor, bought_on):
+    cursor.execute('''
+        SELECT id, description, base_minor, date FROM transactions_base
+        WHERE user_id = ? AND type = 'expense' AND is_deleted = 0
+    ''', (user_id,))
+    tokens = database._name_tokens(item_name)
+    bought = date.fromisoformat(bought_on)
+    best, best_score = None, None
+    for transaction_id, description, base_minor, trans_date in cursor.fetchall():
+        if base_minor is None:
+            continue
+        days = abs((date.fromisoformat(trans_date) - bought).days)
+        amount_gap = abs(base_minor - cost_minor) / cost_minor
+        named = bool(tokens & database._name_tokens(description))
+        if days > database.PURCHASE_MATCH_DAYS or amount_gap > database.PURCHASE_MATCH_TOLERANCE or \
+                (not named and amount_gap > database.PURCHASE_MATCH_EXACT):
+            continue
+        score = (not named, amount_gap, days)
+        if best_score is None or score < best_score:
+            best, best_score = transaction_id, score
+    return best
+
+def match_all(match, purchases):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    matched = [match(cursor, USER_1, *purchase) for purchase in purchases]
+    conn.close()
+    return matched
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, foreign_share=0.1)
+    rng = random.Random(42)
+    today = date.today()
+    purchases = [(f'запись {rng.randint(1, 1000)}', rng.randrange(5000, 500000),
+                  (today - timedelta(days=rng.randrange(365))).isoformat()) for _ in range(PURCHASES)]
+
+    cases = [
+        ('naive: all expenses', lambda: match_all(naive_match, purchases)),
+        ('indexed date window', lambda: match_all(database._find_purchase_match, purchases)),
+    ]
+    for name, run in cases:
+        report(f'{name} ({PURCHASES} purchases, {ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+
+    assert match_all(naive_match, purchases) == match_all(database._find_purchase_match, purchases)
+
+if __name__ == '__main__':
+    main()
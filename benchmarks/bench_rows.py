@@ -0,0 +1,53 @@
+"""Память и время выборки большого списка транзакций с разными фабриками строк.
+
+Сравниваются обычные кортежи, sqlite3.Row, словари и models.Transaction.
+
+Запуск: python benchmarks/bench_rows.py
+"""
+import sqlite3
+import time
+import tracemalloc
+
+from common import DB_PATH, seed_transactions, setup_database
+
+from models import TRANSACTION_COLUMNS, TRANSACTION_ROW
+
+ROWS = 200000
+
+def dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+FACTORIES = [
+    ('tuple', None),
+    ('sqlite3.Row', sqlite3.Row),
+    ('dict', dict_row),
+    ('Transaction', TRANSACTION_ROW),
+]
+
+def fetch(row_factory):
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = row_factory
+    rows = conn.execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions_base WHERE is_deleted = 0').fetchall()
+    conn.close()
+    return rows
+
+def main():
+    setup_database()
+    seed_transactions(ROWS)
+    fetch(None)  # прогрев кэша страниц
+
+    print(f'{"row type":<14}{"rows":>8}{"MB":>8}{"bytes/row":>11}{"ms":>8}')
+    for name, row_factory in FACTORIES:
+        start = time.perf_counter()
+        fetch(row_factory)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        tracemalloc.start()
+        rows = fetch(row_factory)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'{name:<14}{len(rows):>8}{size / 2**20:>8.1f}{size / len(rows):>11.0f}{elapsed_ms:>8.0f}')
+        del rows
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Экран "📋 Мои покупки" с накоплениями и прогнозом.
+
+Без поддерживаемых сумм экрану пришлось бы на каждый показ считать накопленное
+по взносам каждой покупки и денежный поток за прошлые месяцы по всей истории
+операций. Сейчас оба значения обновляют триггеры при записи, и экран только
+читает их по индексам. Цена - триггеры на каждой вставке операции, она
+измеряется отдельно.
+
+Запуск: python benchmarks/bench_savings.py [количество строк]
+"""
+import random
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, report, seed_transactions, setup_database, timed
+
+import database
+from migration import _cash_flow_change
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PURCHASES = 20
+CONTRIBUTIONS = 500
+RUNS = 200
+
+def legacy_goals(user_id, months=database.NET_FLOW_MONTHS):
+    """Накопленное и поток считаются из операций на каждый показ"""
+    purchases = database.get_user_purchases(user_id)
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    saved = {}
+    for purchase in purchases:
+        cursor.execute('SELECT COALESCE(SUM(base_minor), 0) / 100.0 FROM savings_contributions WHERE purchase_id = ?',
+                       (purchase.id,))
+        saved[purchase.id] = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN base_minor ELSE -base_minor END), 0) / 100.0 / ?
+        FROM transactions_history
+        WHERE user_id = ? AND is_deleted = 0
+          AND date >= date('now', 'start of month', ?) AND date < date('now', 'start of month')
+    ''', (months, user_id, f'-{months} months'))
+    monthly_net = cursor.fetchone()[0]
+    conn.close()
+    return [purchase._replace(saved=saved[purchase.id]) for purchase in purchases], monthly_net
+
+def insert_cost(label, rng):
+    def add():
+        database.add_transaction(USER_1, 'expense', round(rng.uniform(50, 5000), 2), 'Еда', 'бенчмарк')
+    add()
+    report(label, [timed(add)[1] for _ in range(RUNS)])
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, foreign_share=0.1)
+    rng = random.Random(42)
+    purchase_ids = [database.add_planned_purchase(USER_1, f'покупка {i}', rng.uniform(5000, 200000),
+                                                  rng.choice(('high', 'medium', 'low')))
+                    for i in range(PURCHASES)]
+    for _ in range(CONTRIBUTIONS):
+        database.add_savings_contribution(USER_1, rng.choice(purchase_ids), round(rng.uniform(100, 3000), 2))
+
+    cases = [
+        ('screen: sums from history', lambda: legacy_goals(USER_1)),
+        ('screen: maintained sums', lambda: database.get_savings_goals(USER_1)),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+
+    legacy, maintained = legacy_goals(USER_1), database.get_savings_goals(USER_1)
+    assert [round(p.saved, 2) for p in legacy[0]] == [round(p.saved, 2) for p in maintained[0]]
+    assert round(legacy[1], 2) == round(maintained[1], 2)
+
+    insert_cost('insert with triggers', rng)
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('DROP TRIGGER trg_transactions_flow_insert')
+    conn.commit()
+    insert_cost('insert without triggers', rng)
+    conn.execute(f"CREATE TRIGGER trg_transactions_flow_insert AFTER INSERT ON transactions "
+                 f"BEGIN {_cash_flow_change('NEW', '+')} END")
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Баланс "кто кому должен" по разделенным расходам.
+
+Баланс можно считать агрегатом по всей истории операций и расчетов - так он
+дорожает с каждой записью. Сейчас его ведут триггеры в split_ledger, и чтение
+сводится к двум строкам. Отдельно измеряется цена триггеров при записи расхода.
+
+Запуск: python benchmarks/bench_settle.py [количество строк]
+"""
+import sqlite3
+import sys
+
+from common import DB_PATH, USER_1, USER_2, report, seed_transactions, setup_database, timed
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+RUNS = 50
+
+def aggregate_balance(user_id, partner_id):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COALESCE(SUM(CASE WHEN user_id = ? THEN credit ELSE -credit END), 0) / 100.0
+        FROM (
+            SELECT user_id, split_minor AS credit FROM transactions
+            WHERE is_deleted = 0 AND split_minor != 0 AND user_id IN (?, ?)
+            UNION ALL
+            SELECT from_user, amount_minor FROM settlements WHERE from_user IN (?, ?)
+        )
+    ''', (user_id, user_id, partner_id, user_id, partner_id))
+    balance = cursor.fetchone()[0]
+    conn.close()
+    return balance
+
+def seed_splits():
+    # Половина расходов делится пополам, раз в сто записей - расчет
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("UPDATE transactions SET split_share = 50 WHERE type = 'expense' AND id % 2 = 0")
+    conn.executemany('INSERT INTO settlements (from_user, to_user, amount_minor) VALUES (?, ?, ?)',
+                     [(USER_2, USER_1, 10000 + i) for i in range(ROWS // 100)])
+    conn.commit()
+    conn.close()
+
+def insert_expense(split_share):
+    return database.add_transaction(USER_1, 'expense', 1234.5, 'Другое', split_share=split_share)
+
+def main():
+    setup_database()
+    seed_transactions(ROWS, days=730, foreign_share=0.1)
+    seed_splits()
+
+    cases = [
+        ('balance: aggregate over history', lambda: aggregate_balance(USER_1, USER_2)),
+        ('balance: ledger rows', lambda: database.get_settle_balance(USER_1, USER_2)),
+    ]
+    for name, run in cases:
+        run()
+        report(f'{name} ({ROWS} rows)', [timed(run)[1] for _ in range(RUNS)])
+    report('insert expense: not split', [timed(insert_expense, 0)[1] for _ in range(RUNS)])
+    report('insert expense: split 50%', [timed(insert_expense, 50)[1] for _ in range(RUNS)])
+
+    assert round(aggregate_balance(USER_1, USER_2), 2) == round(database.get_settle_balance(USER_1, USER_2), 2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Бенчмарки работают на временной базе с тестовыми пользователями
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_1 = 1
+USER_2 = 2
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('MY_USER_ID', str(USER_1))
+os.environ.setdefault('GIRLFRIEND_USER_ID', str(USER_2))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='finance_bench_'), 'bench.db'))
+
+DB_PATH = os.environ['DB_PATH']
+
+EXPENSE_CATEGORIES = ['Еда', 'Транспорт', 'Развлечения', 'Одежда', 'Жилье', 'Здоровье', 'Подарки', 'Другое']
+INCOME_CATEGORIES = ['Зарплата', 'Подработка', 'Инвестиции', 'Подарок', 'Возврат долга', 'Прочее']
+
+def setup_database():
+    """Создать схему во временной базе"""
+    import database
+    database.init_db()
+    database.add_user(USER_1, 'user1', 'Пользователь 1')
+    database.add_user(USER_2, 'user2', 'Пользователь 2')
+
+FOREIGN_CURRENCIES = ['USD', 'EUR']
+
+def seed_transactions(count, days=365, seed=42, foreign_share=0.0):
+    """Заполнить базу случайными транзакциями за последние дни.
+    
+    foreign_share - доля операций в валютах FOREIGN_CURRENCIES.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    rows = []
+    for _ in range(count):
+        trans_type = 'income' if rng.random() < 0.1 else 'expense'
+        categories = INCOME_CATEGORIES if trans_type == 'income' else EXPENSE_CATEGORIES
+        amount = round(rng.uniform(50, 50000 if trans_type == 'income' else 5000), 2)
+        rows.append((
+            rng.choice((USER_1, USER_2)),
+            trans_type,
+            amount,
+            round(amount * 100),
+            rng.choice(FOREIGN_CURRENCIES) if rng.random() < foreign_share else 'RUB',
+            rng.choice(categories),
+            f'запись {rng.randint(1, 1000)}',
+            (today - timedelta(days=rng.randrange(days))).isoformat(),
+        ))
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('''
+        INSERT INTO transactions (user_id, type, amount, amount_minor, currency, category, description, date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+def timed(func, *args, **kwargs):
+    """Выполнить функцию и вернуть (результат, миллисекунды)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def report(name, samples_ms):
+    """Напечатать медиану и p95 по замерам"""
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f'{name:<40} median {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms   n={len(samples)}')
@@ -1,18 +1,31 @@
 import asyncio
 import logging
-import sqlite3
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.utils import executor
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime, date, timedelta
 import html
+import io
 
-from config import BOT_TOKEN, MY_USER_ID, GIRLFRIEND_USER_ID
+from config import BOT_TOKEN, MY_USER_ID, GIRLFRIEND_USER_ID, NOTIFY_WINDOW_MINUTES
 from database import *
 from keyboards import *
+from formatters import *
+from currency import parse_amount, format_money
 from states import *
-from reminders import schedule_reminders
+from reminders import schedule_reminders, scheduler
+from charts import CHART_TITLES, get_chart, shutdown_chart_pool
+from receipts import OCR_AVAILABLE, read_receipt, shutdown_receipt_pool
+from analytics import get_trend_report
+from forecast import get_month_forecast, project_affordable
+from planning import get_plan_report
+from settlement import get_settle_plan
+from backup import create_backup
+from notifications import get_partner_id, queue_partner_event, send_due_digests
+from models import Transaction, Plan
 
 # Настройка логирования
 logging.basicConfig(
@@ -29,89 +42,43 @@ dp = Dispatcher(bot, storage=storage)
 # Инициализация базы данных
 init_db()
 
+# Готовые главные экраны: (user_id, день, версия данных) -> текст
+_dashboard_cache = {}
+
+# Планы месяца по датам: (user_id, первое число месяца, версия данных) -> {дата: [планы]}
+_agenda_cache = {}
+
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
 def is_authorized_user(user_id):
     """Проверка авторизации пользователя"""
     return user_id in [MY_USER_ID, GIRLFRIEND_USER_ID]
 
-def format_transaction(trans, include_id=False):
-    """Форматирование транзакции для отображения"""
-    if len(trans) == 6:  # Сегодняшние транзакции
-        trans_id, trans_type, amount, category, description, time = trans
-        date_str = "сегодня"
-    else:  # Транзакции за период
-        trans_id, trans_type, amount, category, description, date_str, time = trans[:7]
-    
-    emoji = "💵" if trans_type == 'income' else "💸"
-    type_text = "Доход" if trans_type == 'income' else "Расход"
-    time_str = f" ({time})" if time else ""
-    
-    # Экранируем специальные символы
-    category_escaped = html.escape(category)
-    description_escaped = html.escape(description) if description else ""
-    
-    result = f"{emoji} <b>{type_text}:</b> {amount:.2f} руб.\n"
-    result += f"   📂 Категория: {category_escaped}\n"
-    result += f"   📅 Дата: {date_str}{time_str}\n"
-    
-    if description_escaped:
-        result += f"   📝 Описание: {description_escaped}\n"
-    
-    if include_id:
-        result += f"   🆔 ID: {trans_id}\n"
-    
-    return result
-
-def format_plan(plan, include_id=False):
-    """Форматирование плана для отображения"""
-    plan_id, title, description, plan_date, time, category, is_shared = plan[:7]
-    
-    # Экранируем специальные символы
-    title_escaped = html.escape(title)
-    category_escaped = html.escape(category)
-    description_escaped = html.escape(description) if description else ""
-    
-    shared_icon = " 👥" if is_shared else ""
-    time_str = f" в {time}" if time else ""
-    
-    result = f"📅 <b>{title_escaped}</b>{shared_icon}\n"
-    result += f"   📅 Дата: {plan_date}{time_str}\n"
-    result += f"   🏷️ Категория: {category_escaped}\n"
-    
-    if description_escaped:
-        result += f"   📋 Описание: {description_escaped}\n"
-    
-    if include_id:
-        result += f"   🆔 ID: {plan_id}\n"
-    
-    return result
-
-def format_purchase(purchase, include_id=False):
-    """Форматирование покупки для отображения"""
-    purchase_id, item_name, cost, priority, target_date, notes, status = purchase[:7]
-    
-    # Экранируем специальные символы
-    item_name_escaped = html.escape(item_name)
-    notes_escaped = html.escape(notes) if notes else ""
-    
-    emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[priority]
-    date_str = f"до {target_date}" if target_date else ""
-    status_emoji = "✅" if status == 'bought' else "📋"
-    
-    result = f"{emoji} <b>{item_name_escaped}</b> {status_emoji}\n"
-    result += f"   💰 Стоимость: {cost:.2f} руб.\n"
-    
-    if date_str:
-        result += f"   📅 {date_str}\n"
-    
-    if notes_escaped:
-        result += f"   📝 Заметки: {notes_escaped}\n"
-    
-    if include_id:
-        result += f"   🆔 ID: {purchase_id}\n"
-    
-    return result
+def get_dashboard_text(user_id):
+    """Главный экран из кэша; пересобирается при изменении данных или смене дня"""
+    key = (user_id, date.today(), get_data_version())
+    text = _dashboard_cache.get(key)
+    if text is None:
+        # Старые версии экрана больше не понадобятся
+        for stale in [k for k in _dashboard_cache if k[0] == user_id]:
+            del _dashboard_cache[stale]
+        text = _dashboard_cache[key] = render_dashboard(get_dashboard_snapshot(user_id))
+    return text
+
+def get_month_plans(user_id, month_start):
+    """Планы месяца по датам: один запрос на месяц, дни календаря читаются из кэша"""
+    key = (user_id, month_start, get_data_version())
+    plans_by_date = _agenda_cache.get(key)
+    if plans_by_date is None:
+        # Месяцы, собранные до изменения данных, устарели
+        for stale in [k for k in _agenda_cache if k[0] == user_id and k[2] != key[2]]:
+            del _agenda_cache[stale]
+        month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        plans_by_date = {}
+        for plan in get_visible_plans(user_id, month_start.isoformat(), month_end.isoformat()):
+            plans_by_date.setdefault(plan.date, []).append(plan)
+        _agenda_cache[key] = plans_by_date
+    return plans_by_date
 
 async def cancel_operation(message: types.Message, state: FSMContext, operation_name: str):
     """Отмена текущей операции"""
@@ -185,6 +152,9 @@ async def cmd_help(message: types.Message):
 /shared - общие расходы сегодня
 /last - последние 10 транзакций
 /weekly - недельная сводка
+/undo, /redo - отменить или вернуть последнее изменение
+/history - журнал изменений
+/split - доли партнера в расходах по категориям
 
 <b>Управление записями:</b>
 ✏️ Редактировать - изменить запись
@@ -215,24 +185,107 @@ async def cmd_last(message: types.Message):
     response = "📊 <b>Последние 10 транзакций:</b>\n\n"
     
     for trans in transactions:
-        trans_type, amount, category, description, datetime_str = trans
-        
-        # Экранируем специальные символы
-        category_escaped = html.escape(category)
-        description_escaped = html.escape(description) if description else ""
-        
-        emoji = "💵" if trans_type == 'income' else "💸"
-        type_text = "Доход" if trans_type == 'income' else "Расход"
-        
-        response += f"{emoji} <b>{type_text}: {amount:.2f} руб.</b>\n"
-        response += f"   📂 Категория: {category_escaped}\n"
-        response += f"   📅 Дата: {datetime_str}\n"
-        if description_escaped:
-            response += f"   📝 Описание: {description_escaped}\n"
-        response += "\n"
+        response += format_transaction(trans) + "\n"
     
     await message.answer(response, parse_mode='HTML')
 
+# ========== ОТМЕНА ИЗМЕНЕНИЙ ==========
+
+async def send_undo_result(user_id, action):
+    """Отменить или вернуть последнее изменение и сообщить о результате"""
+    if action == 'undo':
+        entry = undo_last_change(user_id)
+        text, keyboard = "↩️ <b>Отменено:</b> ", get_redo_keyboard()
+    else:
+        entry = redo_last_change(user_id)
+        text, keyboard = "↪️ <b>Возвращено:</b> ", get_undo_keyboard()
+    
+    if entry is None:
+        await bot.send_message(user_id, "🤷 Нечего отменять" if action == 'undo' else "🤷 Нечего возвращать")
+    else:
+        await bot.send_message(user_id, text + describe_change(entry), parse_mode='HTML', reply_markup=keyboard)
+
+@dp.message_handler(commands=['undo', 'redo'])
+async def cmd_undo(message: types.Message):
+    """Отмена и возврат последнего изменения"""
+    if not is_authorized_user(message.from_user.id):
+        return
+    await send_undo_result(message.from_user.id, message.get_command(pure=True))
+
+@dp.callback_query_handler(lambda c: c.data in ('undo_last', 'redo_last'))
+async def undo_callback(callback_query: types.CallbackQuery):
+    """Кнопки ↩️ Отменить / ↪️ Вернуть"""
+    await send_undo_result(callback_query.from_user.id, callback_query.data[:4])
+    await callback_query.answer()
+
+@dp.message_handler(commands=['history'])
+async def cmd_history(message: types.Message):
+    """Журнал изменений"""
+    if not is_authorized_user(message.from_user.id):
+        return
+    
+    entries = get_change_history(message.from_user.id)
+    if not entries:
+        await message.answer("📭 Изменений пока не было")
+        return
+    await message.answer(render_change_history(entries), parse_mode='HTML')
+
+# ========== РАЗДЕЛ РАСХОДОВ ==========
+
+async def send_settle_balance(user_id):
+    """Баланс по разделенным расходам с кнопкой расчета, если кто-то должен"""
+    partner_id = get_partner_id(user_id)
+    balance = get_settle_balance(user_id, partner_id)
+    partner_name = get_user_names().get(partner_id, "Партнер")
+    await bot.send_message(user_id, render_settle_balance(balance, partner_name, get_split_defaults()),
+                          parse_mode='HTML', reply_markup=get_settle_keyboard() if balance else None)
+
+@dp.message_handler(commands=['split'])
+async def cmd_split(message: types.Message):
+    """/split - баланс и доли по умолчанию, /split Категория 50 - доля партнера для категории"""
+    if not is_authorized_user(message.from_user.id):
+        return
+    
+    args = message.get_args().rsplit(maxsplit=1)
+    if not args:
+        await send_settle_balance(message.from_user.id)
+        return
+    
+    if len(args) != 2 or not args[1].rstrip('%').isdigit() or int(args[1].rstrip('%')) > 100:
+        await message.answer("❌ Формат: /split Категория 50 (доля партнера в процентах, 0 - не делить)")
+        return
+    
+    category, share = args[0], int(args[1].rstrip('%'))
+    set_split_default(category, share)
+    if share:
+        await message.answer(f"👫 Новые расходы «{html.escape(category)}» делятся: партнер платит {share}%")
+    else:
+        await message.answer(f"👤 Новые расходы «{html.escape(category)}» больше не делятся")
+
+@dp.callback_query_handler(lambda c: c.data.startswith('split_'))
+async def toggle_transaction_split(callback_query: types.CallbackQuery):
+    """Переключить долю партнера в расходе: 0 -> 50 -> 100 -> 0"""
+    user_id = callback_query.from_user.id
+    record = cycle_transaction_split(int(callback_query.data[6:]), user_id)
+    await send_edit_result(user_id, "✅ Доля партнера изменена!", record)
+    await callback_query.answer()
+
+@dp.callback_query_handler(lambda c: c.data == 'settle_up')
+async def settle_up(callback_query: types.CallbackQuery):
+    """Записать расчет: переводы из плана, закрывающие все долги"""
+    user_id = callback_query.from_user.id
+    transfers = get_settle_plan((user_id, get_partner_id(user_id)))
+    
+    if transfers:
+        record_settlements(transfers)
+        total = sum(amount for _, _, amount in transfers)
+        await bot.send_message(user_id, f"🤝 Расчет на {format_money(total)} записан - вы в расчете!",
+                              reply_markup=get_main_keyboard())
+    else:
+        await bot.send_message(user_id, "🤝 Вы уже в расчете")
+    
+    await callback_query.answer()
+
 @dp.message_handler(commands=['weekly'])
 async def cmd_weekly(message: types.Message):
     """Недельная сводка"""
@@ -304,7 +357,8 @@ async def add_expense_start(message: types.Message):
         return
     
     await AddExpense.waiting_for_amount.set()
-    await message.answer("💸 Введите сумму расхода:\n\nДля отмены отправьте 'отмена' или 'cancel'")
+    await message.answer("💸 Введите сумму расхода:\n"
+                         "Валюту можно указать после суммы: 20 usd, 15€\n\nДля отмены отправьте 'отмена' или 'cancel'")
 
 @dp.message_handler(state=AddExpense.waiting_for_amount)
 async def process_expense_amount(message: types.Message, state: FSMContext):
@@ -315,23 +369,31 @@ async def process_expense_amount(message: types.Message, state: FSMContext):
         return
     
     try:
-        amount = float(message.text.replace(',', '.'))
+        amount, currency = parse_amount(message.text)
         if amount <= 0:
             await message.answer("❌ Сумма должна быть больше 0")
             return
+        if currency and get_exchange_rate(currency) is None:
+            await message.answer(f"❌ Нет курса для {currency} - укажите сумму в рублях")
+            return
         
-        await state.update_data(amount=amount)
+        await state.update_data(amount=amount, currency=currency)
         await AddExpense.next()
         await message.answer("📂 Выберите категорию:", reply_markup=get_expense_categories_keyboard())
     
     except ValueError:
-        await message.answer("❌ Пожалуйста, введите корректную сумму (например: 1500.50)")
+        await message.answer("❌ Пожалуйста, введите корректную сумму (например: 1500.50 или 20 usd)")
 
 @dp.callback_query_handler(lambda c: c.data.startswith('expense_cat_'), state=AddExpense.waiting_for_category)
 async def process_expense_category(callback_query: types.CallbackQuery, state: FSMContext):
     """Обработка категории расхода"""
     category = callback_query.data[11:]  # Убираем 'expense_cat_'
     await state.update_data(category=category)
+    if (await state.get_data()).get('receipt'):
+        # Описание и дату уже дал чек
+        await save_expense(callback_query.from_user.id, state)
+        await callback_query.answer()
+        return
     await AddExpense.next()
     await bot.send_message(callback_query.from_user.id, 
                           "📝 Добавьте описание (или отправьте '-' если не нужно):\n\nДля отмены отправьте 'отмена' или 'cancel'")
@@ -354,32 +416,103 @@ async def process_expense_description(message: types.Message, state: FSMContext)
         await cancel_operation(message, state, "Добавление расхода")
         return
     
+    await state.update_data(description=message.text if message.text != '-' else None)
+    await save_expense(message.from_user.id, state)
+
+async def save_expense(user_id, state):
+    """Записать расход из собранных данных состояния и завершить добавление"""
     data = await state.get_data()
-    description = message.text if message.text != '-' else None
+    description = data.get('description')
     
     transaction_id = add_transaction(
-        user_id=message.from_user.id,
+        user_id=user_id,
         trans_type='expense',
         amount=data['amount'],
         category=data['category'],
-        description=description
+        description=description,
+        currency=data['currency'],
+        trans_date=data.get('date')
     )
+    queue_partner_event(user_id, 'expense', get_transaction(transaction_id))
+    amount_text = format_money(data['amount'], data['currency'],
+                               convert_to_base(data['amount'], data['currency']))
     
     await state.finish()
     
     response = f"""
 ✅ <b>Расход успешно добавлен!</b>
 
-💰 Сумма: {data['amount']:.2f} руб.
+💰 Сумма: {amount_text}
 📂 Категория: {html.escape(data['category'])}
-📅 Дата: {date.today().strftime('%Y-%m-%d')}
+📅 Дата: {data.get('date') or date.today().strftime('%Y-%m-%d')}
 """
     if description:
         response += f"📝 Описание: {html.escape(description)}\n"
     
     response += f"🆔 ID: {transaction_id}"
     
-    await message.answer(response, parse_mode='HTML', reply_markup=get_main_keyboard())
+    await bot.send_message(user_id, response, parse_mode='HTML', reply_markup=get_main_keyboard())
+
+# ========== РАСХОДЫ ПО ФОТО ЧЕКА ==========
+
+@dp.message_handler(content_types=types.ContentType.PHOTO, state=[None, AddExpense.waiting_for_amount])
+async def process_receipt_photo(message: types.Message, state: FSMContext):
+    """Фото чека: распознавание в пуле процессов и предложение готового расхода"""
+    if not is_authorized_user(message.from_user.id):
+        return
+    
+    if not OCR_AVAILABLE:
+        await AddExpense.waiting_for_amount.set()
+        await message.answer("📷 Распознавание чеков не настроено - введите сумму расхода:")
+        return
+    
+    await message.answer("🧾 Распознаю чек...")
+    photo = await bot.download_file_by_id(message.photo[-1].file_id)
+    try:
+        receipt = await read_receipt(photo.getvalue())
+    except Exception as e:
+        logger.error(f"❌ Ошибка распознавания чека: {e}")
+        receipt = None
+    
+    # Пока чек распознавался, пользователь мог начать другое действие
+    if await state.get_state() not in (None, AddExpense.waiting_for_amount.state):
+        return
+    
+    if receipt is None or not receipt.total:
+        await AddExpense.waiting_for_amount.set()
+        await message.answer("❌ Не удалось найти сумму на чеке - введите ее вручную:")
+        return
+    
+    await state.set_data({'receipt': True, 'amount': receipt.total, 'currency': BASE_CURRENCY,
+                          'date': receipt.date, 'description': receipt.merchant})
+    await ReceiptExpense.waiting_for_confirmation.set()
+    await message.answer(format_receipt(receipt), parse_mode='HTML', reply_markup=get_receipt_keyboard())
+
+@dp.callback_query_handler(lambda c: c.data in ('receipt_accept', 'receipt_amount', 'receipt_cancel'),
+                           state=ReceiptExpense.waiting_for_confirmation)
+async def process_receipt_choice(callback_query: types.CallbackQuery, state: FSMContext):
+    """Подтверждение расхода по чеку: выбор категории, своя сумма или отмена"""
+    user_id = callback_query.from_user.id
+    if callback_query.data == 'receipt_accept':
+        await AddExpense.waiting_for_category.set()
+        await bot.send_message(user_id, "📂 Выберите категорию:", reply_markup=get_expense_categories_keyboard())
+    elif callback_query.data == 'receipt_amount':
+        # Дата и продавец с чека сохраняются, меняется только сумма
+        await AddExpense.waiting_for_amount.set()
+        await bot.send_message(user_id, "💸 Введите сумму расхода:")
+    else:
+        await state.finish()
+        await bot.send_message(user_id, "❌ Добавление расхода отменено", reply_markup=get_main_keyboard())
+    await callback_query.answer()
+
+@dp.message_handler(state=ReceiptExpense.waiting_for_confirmation)
+async def cancel_receipt_confirmation(message: types.Message, state: FSMContext):
+    """Текст вместо кнопок при подтверждении чека"""
+    text = message.text.lower()
+    if text in ['отмена', 'cancel', 'стоп', 'отменить']:
+        await cancel_operation(message, state, "Добавление расхода")
+    else:
+        await message.answer("Пожалуйста, выберите действие кнопками под чеком.")
 
 # ========== ОБРАБОТЧИКИ ДОБАВЛЕНИЯ ДОХОДОВ ==========
 
@@ -390,7 +523,8 @@ async def add_income_start(message: types.Message):
         return
     
     await AddIncome.waiting_for_amount.set()
-    await message.answer("💰 Введите сумму дохода:\n\nДля отмены отправьте 'отмена' или 'cancel'")
+    await message.answer("💰 Введите сумму дохода:\n"
+                         "Валюту можно указать после суммы: 20 usd, 15€\n\nДля отмены отправьте 'отмена' или 'cancel'")
 
 @dp.message_handler(state=AddIncome.waiting_for_amount)
 async def process_income_amount(message: types.Message, state: FSMContext):
@@ -401,17 +535,20 @@ async def process_income_amount(message: types.Message, state: FSMContext):
         return
     
     try:
-        amount = float(message.text.replace(',', '.'))
+        amount, currency = parse_amount(message.text)
         if amount <= 0:
             await message.answer("❌ Сумма должна быть больше 0")
             return
+        if currency and get_exchange_rate(currency) is None:
+            await message.answer(f"❌ Нет курса для {currency} - укажите сумму в рублях")
+            return
         
-        await state.update_data(amount=amount)
+        await state.update_data(amount=amount, currency=currency)
         await AddIncome.next()
         await message.answer("📂 Выберите категорию:", reply_markup=get_income_categories_keyboard())
     
     except ValueError:
-        await message.answer("❌ Пожалуйста, введите корректную сумму (например: 1500.50)")
+        await message.answer("❌ Пожалуйста, введите корректную сумму (например: 1500.50 или 20 usd)")
 
 @dp.callback_query_handler(lambda c: c.data.startswith('income_cat_'), state=AddIncome.waiting_for_category)
 async def process_income_category(callback_query: types.CallbackQuery, state: FSMContext):
@@ -448,15 +585,18 @@ async def process_income_description(message: types.Message, state: FSMContext):
         trans_type='income',
         amount=data['amount'],
         category=data['category'],
-        description=description
+        description=description,
+        currency=data['currency']
     )
+    amount_text = format_money(data['amount'], data['currency'],
+                               convert_to_base(data['amount'], data['currency']))
     
     await state.finish()
     
     response = f"""
 ✅ <b>Доход успешно добавлен!</b>
 
-💰 Сумма: {data['amount']:.2f} руб.
+💰 Сумма: {amount_text}
 📂 Категория: {html.escape(data['category'])}
 📅 Дата: {date.today().strftime('%Y-%m-%d')}
 """
@@ -592,6 +732,8 @@ async def process_plan_shared(message: types.Message, state: FSMContext):
         category=data['category'],
         is_shared=is_shared
     )
+    if is_shared:
+        queue_partner_event(message.from_user.id, 'shared_plan', get_plan(plan_id))
     
     await state.finish()
     
@@ -750,7 +892,7 @@ async def show_plans(message: types.Message):
     plans = get_user_plans(message.from_user.id)
     
     if not plans:
-        await message.answer("📭 На сегодня планов нет!")
+        await message.answer("📭 На сегодня планов нет!", reply_markup=get_agenda_keyboard())
         return
     
     response = "📅 <b>Ваши планы на сегодня:</b>\n\n"
@@ -758,7 +900,41 @@ async def show_plans(message: types.Message):
     for plan in plans:
         response += format_plan(plan, include_id=True) + "\n"
     
-    await message.answer(response, parse_mode='HTML')
+    await message.answer(response, parse_mode='HTML', reply_markup=get_agenda_keyboard())
+
+@dp.callback_query_handler(lambda c: c.data.startswith('agenda_'))
+async def show_agenda(callback_query: types.CallbackQuery):
+    """Планы на неделю, календарь месяца и планы выбранного дня"""
+    action = callback_query.data[7:]  # Убираем 'agenda_'
+    user_id = callback_query.from_user.id
+    today = date.today()
+    
+    if action == 'week':
+        week_end = today + timedelta(days=6)
+        plans = get_visible_plans(user_id, today.isoformat(), week_end.isoformat())
+        await bot.send_message(user_id, render_agenda(f"📆 <b>Планы на неделю до {week_end}:</b>", plans),
+                              parse_mode='HTML', reply_markup=get_agenda_keyboard())
+    
+    elif action.startswith('month'):
+        month_start = date.fromisoformat(f"{action[6:]}-01") if action != 'month' else today.replace(day=1)
+        plans_by_date = get_month_plans(user_id, month_start)
+        busy_days = tuple(sorted(int(plan_date[8:]) for plan_date in plans_by_date))
+        count = sum(len(plans) for plans in plans_by_date.values())
+        text = (f"🗓️ <b>Планов в месяце: {count}</b>\n"
+                f"Дни с планами отмечены точкой - нажмите на день, чтобы их увидеть")
+        keyboard = get_calendar_keyboard(month_start.year, month_start.month, busy_days)
+        if action == 'month':
+            await bot.send_message(user_id, text, parse_mode='HTML', reply_markup=keyboard)
+        else:
+            # Листание месяцев меняет календарь на месте
+            await callback_query.message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+    
+    elif action.startswith('day_'):
+        day = action[4:]
+        plans = get_month_plans(user_id, date.fromisoformat(day).replace(day=1)).get(day, [])
+        await bot.send_message(user_id, render_agenda(f"📅 <b>Планы на {day}:</b>", plans), parse_mode='HTML')
+    
+    await callback_query.answer()
 
 @dp.message_handler(lambda message: message.text == '📋 Мои покупки')
 async def show_purchases(message: types.Message):
@@ -766,22 +942,15 @@ async def show_purchases(message: types.Message):
     if not is_authorized_user(message.from_user.id):
         return
     
-    purchases = get_user_purchases(message.from_user.id)
+    purchases, monthly_net = get_savings_goals(message.from_user.id)
     
     if not purchases:
         await message.answer("🛍️ Список планируемых покупок пуст!")
         return
     
-    response = "📋 <b>Ваши планируемые покупки:</b>\n\n"
-    total = 0
-    
-    for purchase in purchases:
-        response += format_purchase(purchase, include_id=True) + "\n"
-        total += purchase[2]  # estimated_cost
-    
-    response += f"\n💰 <b>Общая сумма: {total:.2f} руб.</b>"
-    
-    await message.answer(response, parse_mode='HTML')
+    projection = project_affordable(purchases, monthly_net)
+    await message.answer(render_purchases(purchases, projection, monthly_net), parse_mode='HTML',
+                         reply_markup=create_purchases_keyboard(purchases))
 
 # ========== ОБРАБОТЧИКИ СТАТИСТИКИ ==========
 
@@ -820,30 +989,7 @@ async def process_stats_menu(callback_query: types.CallbackQuery):
         comparison = get_monthly_comparison()
         
         if comparison:
-            response = "📊 <b>Сравнение за месяц:</b>\n\n"
-            total_combined_income = 0
-            total_combined_expense = 0
-            
-            for user_data in comparison:
-                username = user_data[0]
-                income = user_data[1] or 0
-                expense = user_data[2] or 0
-                balance = user_data[3] or 0
-                
-                response += f"<b>{username}:</b>\n"
-                response += f"  💵 Доходы: {income:.2f} руб.\n"
-                response += f"  💸 Расходы: {expense:.2f} руб.\n"
-                response += f"  ⚖️ Баланс: {balance:.2f} руб.\n\n"
-                
-                total_combined_income += income
-                total_combined_expense += expense
-            
-            total_balance = total_combined_income - total_combined_expense
-            response += f"<b>Общие итоги:</b>\n"
-            response += f"  📈 Общий доход: {total_combined_income:.2f} руб.\n"
-            response += f"  📉 Общий расход: {total_combined_expense:.2f} руб.\n"
-            response += f"  ⚖️ Общий баланс: {total_balance:.2f} руб."
-        
+            response = render_monthly_comparison(comparison, "📊 <b>Сравнение за месяц:</b>")
         else:
             response = "📊 Данных для сравнения нет"
         
@@ -853,16 +999,7 @@ async def process_stats_menu(callback_query: types.CallbackQuery):
         categories_stats = get_common_categories_statistics()
         
         if categories_stats:
-            response = "📂 <b>Топ категорий по расходам за месяц:</b>\n\n"
-            total_expenses = 0
-            
-            for i, (category, expense, count) in enumerate(categories_stats, 1):
-                if expense > 0:
-                    total_expenses += expense
-                    response += f"{i}. <b>{html.escape(category)}:</b> {expense:.2f} руб. ({count} записей)\n"
-            
-            response += f"\n💸 <b>Всего расходов:</b> {total_expenses:.2f} руб."
-        
+            response = render_top_categories(categories_stats)
         else:
             response = "📊 Данных по категориям нет"
         
@@ -872,38 +1009,68 @@ async def process_stats_menu(callback_query: types.CallbackQuery):
         today_expenses = get_daily_combined_expenses()
         
         if today_expenses:
-            response = "📅 <b>Расходы за сегодня:</b>\n\n"
-            current_user = None
-            user_total = 0
-            overall_total = 0
-            
-            for expense in today_expenses:
-                username, category, amount, description = expense
-                
-                if username != current_user:
-                    if current_user:
-                        response += f"<b>Итого: {user_total:.2f} руб.</b>\n\n"
-                        user_total = 0
-                    
-                    current_user = username
-                    response += f"<b>👤 {username}:</b>\n"
-                
-                user_total += amount
-                overall_total += amount
-                
-                desc = f" - {html.escape(description)}" if description else ""
-                response += f"  • {html.escape(category)}: {amount:.2f} руб.{desc}\n"
-            
-            if current_user:
-                response += f"\n<b>Итого: {user_total:.2f} руб.</b>"
-            
-            response += f"\n\n💰 <b>Общая сумма: {overall_total:.2f} руб.</b>"
-        
+            response = render_daily_expenses(today_expenses)
         else:
             response = "💸 <b>Сегодня еще не было расходов</b>"
         
         await bot.send_message(user_id, response, parse_mode='HTML')
     
+    elif action == 'charts':
+        await bot.send_message(user_id,
+                              "🖼️ Выберите график:",
+                              reply_markup=get_charts_keyboard())
+    
+    elif action == 'trends':
+        report = get_trend_report()
+        
+        if report and report['items']:
+            response = render_trends(report)
+        else:
+            response = "📉 Недостаточно данных для анализа трендов"
+        
+        await bot.send_message(user_id, response, parse_mode='HTML')
+    
+    elif action == 'forecast':
+        forecast = get_month_forecast()
+        
+        if forecast['categories'] or forecast['income_forecast']:
+            response = render_forecast(forecast)
+        else:
+            response = "🔮 Недостаточно данных для прогноза"
+        
+        await bot.send_message(user_id, response, parse_mode='HTML')
+    
+    elif action == 'plan':
+        await bot.send_message(user_id, render_plan_report(get_plan_report()), parse_mode='HTML')
+    
+    elif action == 'settle':
+        await send_settle_balance(user_id)
+    
+    await callback_query.answer()
+
+# ========== ОБРАБОТЧИКИ ГРАФИКОВ ==========
+
+@dp.callback_query_handler(lambda c: c.data.startswith('chart_'))
+async def process_charts(callback_query: types.CallbackQuery):
+    """Отправка графика статистики"""
+    kind = callback_query.data[6:]  # Убираем 'chart_'
+    user_id = callback_query.from_user.id
+    
+    try:
+        png = await get_chart(kind)
+    except Exception as e:
+        logger.error(f"❌ Ошибка построения графика {kind}: {e}")
+        await bot.send_message(user_id, "❌ Не удалось построить график")
+        await callback_query.answer()
+        return
+    
+    if png is None:
+        await bot.send_message(user_id, "📊 Нет данных для графика")
+    else:
+        await bot.send_photo(user_id,
+                            types.InputFile(io.BytesIO(png), filename=f'{kind}.png'),
+                            caption=CHART_TITLES[kind])
+    
     await callback_query.answer()
 
 # ========== ОБРАБОТЧИКИ ПЕРИОДОВ СТАТИСТИКИ ==========
@@ -925,40 +1092,9 @@ async def process_period_statistics(callback_query: types.CallbackQuery):
     stats = get_period_statistics(user_id, action)
     
     if stats and (stats[0] or stats[1]):
-        total_income = stats[0] or 0
-        total_expense = stats[1] or 0
-        count = stats[2] or 0
-        balance = total_income - total_expense
-        
-        response = f"""
-📊 <b>Статистика за {period_text}:</b>
-
-📈 <b>Доходы:</b> {total_income:.2f} руб.
-📉 <b>Расходы:</b> {total_expense:.2f} руб.
-💰 <b>Баланс:</b> {balance:.2f} руб.
-📋 <b>Количество операций:</b> {count}
-        """
-        
         transactions = get_user_transactions(user_id, action)
-        
-        if transactions:
-            response += "\n\n📝 <b>Детали операций:</b>\n\n"
-            
-            if action == 'today':
-                for trans in transactions:
-                    response += format_transaction(trans) + "\n"
-            
-            else:
-                current_date = None
-                for trans in transactions:
-                    trans_date = trans[5] if len(trans) > 5 else "Сегодня"
-                    
-                    if trans_date != current_date:
-                        current_date = trans_date
-                        response += f"\n📅 <b>{trans_date}:</b>\n"
-                    
-                    response += "  " + format_transaction(trans)
-    
+        response = render_period_statistics(period_text, stats, transactions,
+                                            group_by_date=action != 'today')
     else:
         response = f"📊 <b>Нет данных за {period_text}</b>"
     
@@ -991,26 +1127,7 @@ async def process_combined_finances(callback_query: types.CallbackQuery):
         shared_expenses = get_shared_expenses_by_category()
         
         if shared_expenses:
-            response = "📊 <b>Общие расходы по категориям за месяц:</b>\n\n"
-            total_expenses = 0
-            user1_total = 0
-            user2_total = 0
-            
-            for category, user1_exp, user2_exp, total in shared_expenses:
-                if total > 0:
-                    total_expenses += total
-                    user1_total += user1_exp or 0
-                    user2_total += user2_exp or 0
-                    
-                    response += f"<b>{html.escape(category)}:</b>\n"
-                    response += f"  • Ты: {user1_exp:.2f} руб.\n"
-                    response += f"  • Партнер: {user2_exp:.2f} руб.\n"
-                    response += f"  • <b>Всего: {total:.2f} руб.</b>\n\n"
-            
-            response += f"<b>Итоги:</b>\n"
-            response += f"  • Твои расходы: {user1_total:.2f} руб.\n"
-            response += f"  • Расходы партнера: {user2_total:.2f} руб.\n"
-            response += f"  • <b>Общие расходы: {total_expenses:.2f} руб.</b>"
+            response = render_shared_expenses(shared_expenses)
         else:
             response = "📊 Нет данных об общих расходах за месяц"
         
@@ -1021,43 +1138,8 @@ async def process_combined_finances(callback_query: types.CallbackQuery):
         combined_stats = get_combined_statistics('month')
         
         if combined_stats:
-            response = "💰 <b>Общие доходы за месяц:</b>\n\n"
-            total_combined_income = 0
-            total_combined_expense = 0
-            
-            for user_data in combined_stats:
-                total_income, total_expense, user_id_db = user_data
-                total_combined_income += total_income or 0
-                total_combined_expense += total_expense or 0
-            
-            # Получаем имена пользователей
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('SELECT full_name FROM users WHERE id IN (?, ?)', 
-                         (MY_USER_ID, GIRLFRIEND_USER_ID))
-            users = cursor.fetchall()
-            conn.close()
-            
-            if len(users) >= 2:
-                user1_name = users[0][0] if users[0] else "Пользователь 1"
-                user2_name = users[1][0] if users[1] else "Пользователь 2"
-                
-                # Получаем доходы по каждому пользователю
-                user1_income = 0
-                user2_income = 0
-                
-                for user_data in combined_stats:
-                    total_income, total_expense, user_id_db = user_data
-                    if user_id_db == MY_USER_ID:
-                        user1_income = total_income or 0
-                    elif user_id_db == GIRLFRIEND_USER_ID:
-                        user2_income = total_income or 0
-                
-                response += f"<b>{user1_name}:</b> {user1_income:.2f} руб.\n"
-                response += f"<b>{user2_name}:</b> {user2_income:.2f} руб.\n"
-                response += f"\n<b>Общие доходы:</b> {total_combined_income:.2f} руб."
-            else:
-                response += f"<b>Общие доходы:</b> {total_combined_income:.2f} руб."
+            response = render_combined_incomes(combined_stats, get_user_names(),
+                                               (MY_USER_ID, GIRLFRIEND_USER_ID))
         else:
             response = "💰 Нет данных об общих доходах за месяц"
         
@@ -1068,16 +1150,7 @@ async def process_combined_finances(callback_query: types.CallbackQuery):
         categories_stats = get_shared_expenses_by_category()
         
         if categories_stats:
-            response = "📊 <b>Сравнение расходов по категориям за месяц:</b>\n\n"
-            
-            for category, user1_exp, user2_exp, total in categories_stats:
-                if total > 0:
-                    user1_percent = (user1_exp / total * 100) if total > 0 else 0
-                    user2_percent = (user2_exp / total * 100) if total > 0 else 0
-                    
-                    response += f"<b>{html.escape(category)}</b> - {total:.2f} руб.\n"
-                    response += f"  • Ты: {user1_exp:.2f} руб. ({user1_percent:.1f}%)\n"
-                    response += f"  • Партнер: {user2_exp:.2f} руб. ({user2_percent:.1f}%)\n\n"
+            response = render_category_comparison(categories_stats)
         else:
             response = "📊 Нет данных для сравнения по категориям"
         
@@ -1088,30 +1161,7 @@ async def process_combined_finances(callback_query: types.CallbackQuery):
         comparison = get_monthly_comparison()
         
         if comparison:
-            response = "📈 <b>Итоги за месяц:</b>\n\n"
-            total_combined_income = 0
-            total_combined_expense = 0
-            
-            for user_data in comparison:
-                username = user_data[0]
-                income = user_data[1] or 0
-                expense = user_data[2] or 0
-                balance = user_data[3] or 0
-                
-                response += f"<b>{username}:</b>\n"
-                response += f"  💵 Доходы: {income:.2f} руб.\n"
-                response += f"  💸 Расходы: {expense:.2f} руб.\n"
-                response += f"  ⚖️ Баланс: {balance:.2f} руб.\n\n"
-                
-                total_combined_income += income
-                total_combined_expense += expense
-            
-            total_balance = total_combined_income - total_combined_expense
-            
-            response += f"<b>Общие итоги:</b>\n"
-            response += f"  📈 Общий доход: {total_combined_income:.2f} руб.\n"
-            response += f"  📉 Общий расход: {total_combined_expense:.2f} руб.\n"
-            response += f"  ⚖️ Общий баланс: {total_balance:.2f} руб."
+            response = render_monthly_comparison(comparison)
         else:
             response = "📈 Нет данных за месяц"
         
@@ -1122,35 +1172,7 @@ async def process_combined_finances(callback_query: types.CallbackQuery):
         shared_plans = get_shared_plans()
         
         if shared_plans:
-            response = "📅 <b>Совместные планы:</b>\n\n"
-            
-            current_date = None
-            for plan in shared_plans:
-                # Структура данных из get_shared_plans():
-                # id, user_id, title, description, date, time, category, is_shared, 
-                # notification_enabled, notification_time, is_deleted, created_at, updated_at, username, full_name
-                
-                if len(plan) >= 14:
-                    plan_date = plan[4]
-                    title = plan[2]
-                    description = plan[3]
-                    time = plan[5]
-                    category = plan[6]
-                    username = plan[13] or plan[12]  # full_name или username
-                    
-                    if plan_date != current_date:
-                        current_date = plan_date
-                        response += f"\n<b>📅 {plan_date}:</b>\n"
-                    
-                    time_str = f" в {time}" if time else ""
-                    response += f"  • <b>{html.escape(title)}</b>{time_str}\n"
-                    response += f"    👤 {username} | 🏷️ {html.escape(category)}\n"
-                    
-                    if description:
-                        desc_short = description[:50] + "..." if len(description) > 50 else description
-                        response += f"    📝 {html.escape(desc_short)}\n"
-                    
-                    response += "\n"
+            response = render_shared_plans(shared_plans)
         else:
             response = "📅 Нет совместных планов"
         
@@ -1181,20 +1203,7 @@ async def process_partner_data(callback_query: types.CallbackQuery):
         partner_expenses = get_user_transactions(partner_id, 'month', 'expense')
         
         if partner_expenses:
-            response = f"💸 <b>Расходы партнера за месяц:</b>\n\n"
-            total = 0
-            
-            for expense in partner_expenses:
-                if len(expense) >= 6:
-                    trans_id, trans_type, amount, category, description, trans_date, time = expense[:7]
-                    total += amount
-                    
-                    time_str = f" ({time})" if time else ""
-                    response += f"• {category}: {amount:.2f} руб. ({trans_date}{time_str})\n"
-                    if description:
-                        response += f"  {description}\n"
-            
-            response += f"\n<b>Всего: {total:.2f} руб.</b>"
+            response = render_partner_transactions("💸 <b>Расходы партнера за месяц:</b>\n\n", partner_expenses)
         else:
             response = "💸 У партнера нет расходов за месяц"
         
@@ -1205,20 +1214,7 @@ async def process_partner_data(callback_query: types.CallbackQuery):
         partner_incomes = get_user_transactions(partner_id, 'month', 'income')
         
         if partner_incomes:
-            response = f"💵 <b>Доходы партнера за месяц:</b>\n\n"
-            total = 0
-            
-            for income in partner_incomes:
-                if len(income) >= 6:
-                    trans_id, trans_type, amount, category, description, trans_date, time = income[:7]
-                    total += amount
-                    
-                    time_str = f" ({time})" if time else ""
-                    response += f"• {category}: {amount:.2f} руб. ({trans_date}{time_str})\n"
-                    if description:
-                        response += f"  {description}\n"
-            
-            response += f"\n<b>Всего: {total:.2f} руб.</b>"
+            response = render_partner_transactions("💵 <b>Доходы партнера за месяц:</b>\n\n", partner_incomes)
         else:
             response = "💵 У партнера нет доходов за месяц"
         
@@ -1229,18 +1225,7 @@ async def process_partner_data(callback_query: types.CallbackQuery):
         partner_plans = get_user_plans(partner_id)
         
         if partner_plans:
-            response = f"📅 <b>Планы партнера на сегодня:</b>\n\n"
-            
-            for plan in partner_plans:
-                if len(plan) >= 7:
-                    plan_id, title, description, plan_date, time, category, is_shared = plan[:7]
-                    
-                    time_str = f" в {time}" if time else ""
-                    response += f"• <b>{html.escape(title)}</b>{time_str}\n"
-                    response += f"  🏷️ {html.escape(category)}\n"
-                    if description:
-                        response += f"  📝 {html.escape(description)}\n"
-                    response += "\n"
+            response = render_partner_plans(partner_plans)
         else:
             response = "📅 У партнера нет планов на сегодня"
         
@@ -1251,23 +1236,7 @@ async def process_partner_data(callback_query: types.CallbackQuery):
         partner_purchases = get_user_purchases(partner_id)
         
         if partner_purchases:
-            response = f"🛍️ <b>Планируемые покупки партнера:</b>\n\n"
-            total = 0
-            
-            for purchase in partner_purchases:
-                if len(purchase) >= 7:
-                    purchase_id, item_name, cost, priority, target_date, notes, status = purchase[:7]
-                    total += cost
-                    
-                    emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[priority]
-                    date_str = f"до {target_date}" if target_date else ""
-                    
-                    response += f"{emoji} <b>{html.escape(item_name)}</b> - {cost:.2f} руб. {date_str}\n"
-                    if notes:
-                        response += f"  📝 {html.escape(notes)}\n"
-                    response += "\n"
-            
-            response += f"<b>Общая сумма: {total:.2f} руб.</b>"
+            response = render_partner_purchases(partner_purchases)
         else:
             response = "🛍️ У партнера нет планируемых покупок"
         
@@ -1278,29 +1247,7 @@ async def process_partner_data(callback_query: types.CallbackQuery):
         partner_stats = get_period_statistics(partner_id, 'month')
         
         if partner_stats:
-            total_income = partner_stats[0] or 0
-            total_expense = partner_stats[1] or 0
-            count = partner_stats[2] or 0
-            balance = total_income - total_expense
-            
-            response = f"📊 <b>Полная статистика партнера за месяц:</b>\n\n"
-            response += f"📈 <b>Доходы:</b> {total_income:.2f} руб.\n"
-            response += f"📉 <b>Расходы:</b> {total_expense:.2f} руб.\n"
-            response += f"💰 <b>Баланс:</b> {balance:.2f} руб.\n"
-            response += f"📋 <b>Количество операций:</b> {count}\n"
-            
-            # Последние 5 транзакций
-            recent = get_recent_transactions(partner_id, 5)
-            if recent:
-                response += f"\n<b>Последние операции:</b>\n"
-                for trans in recent:
-                    trans_type, amount, category, description, datetime_str = trans
-                    emoji = "💵" if trans_type == 'income' else "💸"
-                    type_text = "Доход" if trans_type == 'income' else "Расход"
-                    
-                    response += f"{emoji} {type_text}: {amount:.2f} руб. - {category}\n"
-                    if description:
-                        response += f"  {description}\n"
+            response = render_partner_stats(partner_stats, get_recent_transactions(partner_id, 5))
         else:
             response = "📊 Нет статистики по партнеру"
         
@@ -1459,7 +1406,7 @@ async def select_for_edit(callback_query: types.CallbackQuery):
         trans_id = int(data[8:])
         transaction = get_transaction(trans_id)
         
-        if transaction and transaction[1] == user_id:  # Проверка владельца
+        if transaction and transaction.user_id == user_id:  # Проверка владельца
             await bot.send_message(user_id,
                                   f"✏️ <b>Редактирование расхода:</b>\n\n"
                                   f"{format_transaction(transaction, include_id=True)}",
@@ -1472,7 +1419,7 @@ async def select_for_edit(callback_query: types.CallbackQuery):
         trans_id = int(data[7:])
         transaction = get_transaction(trans_id)
         
-        if transaction and transaction[1] == user_id:
+        if transaction and transaction.user_id == user_id:
             await bot.send_message(user_id,
                                   f"✏️ <b>Редактирование дохода:</b>\n\n"
                                   f"{format_transaction(transaction, include_id=True)}",
@@ -1485,7 +1432,7 @@ async def select_for_edit(callback_query: types.CallbackQuery):
         plan_id = int(data[5:])
         plan = get_plan(plan_id)
         
-        if plan and plan[1] == user_id:  # plan[1] = user_id
+        if plan and plan.user_id == user_id:
             await bot.send_message(user_id,
                                   f"✏️ <b>Редактирование плана:</b>\n\n"
                                   f"{format_plan(plan, include_id=True)}",
@@ -1498,7 +1445,7 @@ async def select_for_edit(callback_query: types.CallbackQuery):
         purchase_id = int(data[9:])
         purchase = get_purchase(purchase_id)
         
-        if purchase and purchase[1] == user_id:  # purchase[1] = user_id
+        if purchase and purchase.user_id == user_id:
             await bot.send_message(user_id,
                                   f"✏️ <b>Редактирование покупки:</b>\n\n"
                                   f"{format_purchase(purchase, include_id=True)}",
@@ -1520,108 +1467,125 @@ async def edit_record(callback_query: types.CallbackQuery, state: FSMContext):
     if data.startswith('amount_expense_'):
         trans_id = int(data[15:])
         await EditExpense.waiting_for_amount.set()
-        await state.update_data(trans_id=trans_id, trans_type='expense')
+        await state.update_data(trans_id=trans_id, trans_type='expense',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "💰 Введите новую сумму расхода:")
     
     elif data.startswith('category_expense_'):
         trans_id = int(data[17:])
         await EditExpense.waiting_for_category.set()
-        await state.update_data(trans_id=trans_id, trans_type='expense')
+        await state.update_data(trans_id=trans_id, trans_type='expense',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "📂 Выберите новую категорию:",
                               reply_markup=get_expense_categories_keyboard())
     
     elif data.startswith('desc_expense_'):
         trans_id = int(data[13:])
         await EditExpense.waiting_for_description.set()
-        await state.update_data(trans_id=trans_id, trans_type='expense')
+        await state.update_data(trans_id=trans_id, trans_type='expense',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "📝 Введите новое описание (или '-' для удаления):")
     
     elif data.startswith('amount_income_'):
         trans_id = int(data[14:])
         await EditIncome.waiting_for_amount.set()
-        await state.update_data(trans_id=trans_id, trans_type='income')
+        await state.update_data(trans_id=trans_id, trans_type='income',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "💰 Введите новую сумму дохода:")
     
     elif data.startswith('category_income_'):
         trans_id = int(data[16:])
         await EditIncome.waiting_for_category.set()
-        await state.update_data(trans_id=trans_id, trans_type='income')
+        await state.update_data(trans_id=trans_id, trans_type='income',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "📂 Выберите новую категорию:",
                               reply_markup=get_income_categories_keyboard())
     
     elif data.startswith('desc_income_'):
         trans_id = int(data[12:])
         await EditIncome.waiting_for_description.set()
-        await state.update_data(trans_id=trans_id, trans_type='income')
+        await state.update_data(trans_id=trans_id, trans_type='income',
+                                version=get_record_version('transactions', trans_id))
         await bot.send_message(user_id, "📝 Введите новое описание (или '-' для удаления):")
     
     elif data.startswith('plan_title_'):
         plan_id = int(data[11:])
         await EditPlan.waiting_for_title.set()
-        await state.update_data(plan_id=plan_id)
+        await state.update_data(plan_id=plan_id,
+                                version=get_record_version('plans', plan_id))
         await bot.send_message(user_id, "📝 Введите новое название плана:")
     
     elif data.startswith('plan_desc_'):
         plan_id = int(data[10:])
         await EditPlan.waiting_for_description.set()
-        await state.update_data(plan_id=plan_id)
+        await state.update_data(plan_id=plan_id,
+                                version=get_record_version('plans', plan_id))
         await bot.send_message(user_id, "📋 Введите новое описание (или '-' для удаления):")
     
     elif data.startswith('plan_date_'):
         plan_id = int(data[10:])
         await EditPlan.waiting_for_date.set()
-        await state.update_data(plan_id=plan_id)
+        await state.update_data(plan_id=plan_id,
+                                version=get_record_version('plans', plan_id))
         await bot.send_message(user_id, "📅 Введите новую дату (ГГГГ-ММ-ДД, 'сегодня', 'завтра'):")
     
     elif data.startswith('plan_time_'):
         plan_id = int(data[10:])
         await EditPlan.waiting_for_time.set()
-        await state.update_data(plan_id=plan_id)
+        await state.update_data(plan_id=plan_id,
+                                version=get_record_version('plans', plan_id))
         await bot.send_message(user_id, "⏰ Введите новое время (ЧЧ:ММ или '-'):")
     
     elif data.startswith('plan_cat_'):
         plan_id = int(data[9:])
         await EditPlan.waiting_for_category.set()
-        await state.update_data(plan_id=plan_id)
+        await state.update_data(plan_id=plan_id,
+                                version=get_record_version('plans', plan_id))
         await bot.send_message(user_id, "🏷️ Выберите новую категорию:",
                               reply_markup=get_plan_categories_keyboard())
     
     elif data.startswith('purchase_name_'):
         purchase_id = int(data[14:])
         await EditPurchase.waiting_for_name.set()
-        await state.update_data(purchase_id=purchase_id)
+        await state.update_data(purchase_id=purchase_id,
+                                version=get_record_version('planned_purchases', purchase_id))
         await bot.send_message(user_id, "🛍️ Введите новое название покупки:")
     
     elif data.startswith('purchase_cost_'):
         purchase_id = int(data[14:])
         await EditPurchase.waiting_for_cost.set()
-        await state.update_data(purchase_id=purchase_id)
+        await state.update_data(purchase_id=purchase_id,
+                                version=get_record_version('planned_purchases', purchase_id))
         await bot.send_message(user_id, "💰 Введите новую стоимость:")
     
     elif data.startswith('purchase_priority_'):
         purchase_id = int(data[18:])
         await EditPurchase.waiting_for_priority.set()
-        await state.update_data(purchase_id=purchase_id)
+        await state.update_data(purchase_id=purchase_id,
+                                version=get_record_version('planned_purchases', purchase_id))
         await bot.send_message(user_id, "🎯 Выберите новый приоритет:",
                               reply_markup=get_priority_keyboard())
     
     elif data.startswith('purchase_date_'):
         purchase_id = int(data[14:])
         await EditPurchase.waiting_for_date.set()
-        await state.update_data(purchase_id=purchase_id)
+        await state.update_data(purchase_id=purchase_id,
+                                version=get_record_version('planned_purchases', purchase_id))
         await bot.send_message(user_id, "📅 Введите новую дату (ГГГГ-ММ-ДД или '-'):")
     
     elif data.startswith('purchase_notes_'):
         purchase_id = int(data[15:])
         await EditPurchase.waiting_for_notes.set()
-        await state.update_data(purchase_id=purchase_id)
+        await state.update_data(purchase_id=purchase_id,
+                                version=get_record_version('planned_purchases', purchase_id))
         await bot.send_message(user_id, "📝 Введите новые заметки (или '-' для удаления):")
     
     await callback_query.answer()
 
 # ========== ОБРАБОТЧИКИ УДАЛЕНИЯ ==========
 
-@dp.callback_query_handler(lambda c: c.data.startswith('delete_'))
+@dp.callback_query_handler(lambda c: c.data.startswith(('delete_confirm_', 'delete_plan_confirm_',
+                                                        'delete_purchase_confirm_')))
 async def delete_record(callback_query: types.CallbackQuery):
     """Удаление записи"""
     data = callback_query.data[7:]  # Убираем 'delete_'
@@ -1631,7 +1595,7 @@ async def delete_record(callback_query: types.CallbackQuery):
         trans_id = int(data[16:])
         transaction = get_transaction(trans_id)
         
-        if transaction and transaction[1] == user_id:
+        if transaction and transaction.user_id == user_id:
             await bot.send_message(user_id,
                                   f"🗑️ <b>Подтвердите удаление расхода:</b>\n\n"
                                   f"{format_transaction(transaction, include_id=True)}\n\n"
@@ -1645,7 +1609,7 @@ async def delete_record(callback_query: types.CallbackQuery):
         trans_id = int(data[15:])
         transaction = get_transaction(trans_id)
         
-        if transaction and transaction[1] == user_id:
+        if transaction and transaction.user_id == user_id:
             await bot.send_message(user_id,
                                   f"🗑️ <b>Подтвердите удаление дохода:</b>\n\n"
                                   f"{format_transaction(transaction, include_id=True)}\n\n"
@@ -1659,7 +1623,7 @@ async def delete_record(callback_query: types.CallbackQuery):
         plan_id = int(data[13:])
         plan = get_plan(plan_id)
         
-        if plan and plan[1] == user_id:
+        if plan and plan.user_id == user_id:
             await bot.send_message(user_id,
                                   f"🗑️ <b>Подтвердите удаление плана:</b>\n\n"
                                   f"{format_plan(plan, include_id=True)}\n\n"
@@ -1673,7 +1637,7 @@ async def delete_record(callback_query: types.CallbackQuery):
         purchase_id = int(data[17:])
         purchase = get_purchase(purchase_id)
         
-        if purchase and purchase[1] == user_id:
+        if purchase and purchase.user_id == user_id:
             await bot.send_message(user_id,
                                   f"🗑️ <b>Подтвердите удаление покупки:</b>\n\n"
                                   f"{format_purchase(purchase, include_id=True)}\n\n"
@@ -1688,11 +1652,13 @@ async def delete_record(callback_query: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_expense_yes_'))
 async def confirm_delete_expense(callback_query: types.CallbackQuery):
     """Подтверждение удаления расхода"""
-    trans_id = int(callback_query.data[20:])
-    delete_transaction(trans_id)
-    await bot.send_message(callback_query.from_user.id,
-                          "✅ Расход успешно удален!",
-                          reply_markup=get_main_keyboard())
+    trans_id = int(callback_query.data[19:])
+    if delete_transaction(trans_id, user_id=callback_query.from_user.id):
+        await bot.send_message(callback_query.from_user.id,
+                              "✅ Расход успешно удален!",
+                              reply_markup=get_undo_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id, "❌ Запись не найдена или нет доступа")
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_expense_no_'))
@@ -1706,11 +1672,13 @@ async def cancel_delete_expense(callback_query: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_income_yes_'))
 async def confirm_delete_income(callback_query: types.CallbackQuery):
     """Подтверждение удаления дохода"""
-    trans_id = int(callback_query.data[19:])
-    delete_transaction(trans_id)
-    await bot.send_message(callback_query.from_user.id,
-                          "✅ Доход успешно удален!",
-                          reply_markup=get_main_keyboard())
+    trans_id = int(callback_query.data[18:])
+    if delete_transaction(trans_id, user_id=callback_query.from_user.id):
+        await bot.send_message(callback_query.from_user.id,
+                              "✅ Доход успешно удален!",
+                              reply_markup=get_undo_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id, "❌ Запись не найдена или нет доступа")
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_income_no_'))
@@ -1724,11 +1692,13 @@ async def cancel_delete_income(callback_query: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_plan_yes_'))
 async def confirm_delete_plan(callback_query: types.CallbackQuery):
     """Подтверждение удаления плана"""
-    plan_id = int(callback_query.data[17:])
-    delete_plan(plan_id)
-    await bot.send_message(callback_query.from_user.id,
-                          "✅ План успешно удален!",
-                          reply_markup=get_main_keyboard())
+    plan_id = int(callback_query.data[16:])
+    if delete_plan(plan_id, user_id=callback_query.from_user.id):
+        await bot.send_message(callback_query.from_user.id,
+                              "✅ План успешно удален!",
+                              reply_markup=get_undo_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id, "❌ План не найден или нет доступа")
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_plan_no_'))
@@ -1742,11 +1712,13 @@ async def cancel_delete_plan(callback_query: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_purchase_yes_'))
 async def confirm_delete_purchase(callback_query: types.CallbackQuery):
     """Подтверждение удаления покупки"""
-    purchase_id = int(callback_query.data[21:])
-    delete_purchase(purchase_id)
-    await bot.send_message(callback_query.from_user.id,
-                          "✅ Покупка успешно удалена!",
-                          reply_markup=get_main_keyboard())
+    purchase_id = int(callback_query.data[20:])
+    if delete_purchase(purchase_id, user_id=callback_query.from_user.id):
+        await bot.send_message(callback_query.from_user.id,
+                              "✅ Покупка успешно удалена!",
+                              reply_markup=get_undo_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id, "❌ Покупка не найдена или нет доступа")
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_purchase_no_'))
@@ -1763,35 +1735,104 @@ async def cancel_delete_purchase(callback_query: types.CallbackQuery):
 async def mark_purchase_done(callback_query: types.CallbackQuery):
     """Отметить покупку как купленную"""
     purchase_id = int(callback_query.data[14:])
+    result = complete_purchase(purchase_id, callback_query.from_user.id)
+    
+    if result:
+        purchase, transaction, created = result
+        queue_partner_event(callback_query.from_user.id, 'purchase_done', purchase)
+        link_text = "💸 Записан расход:" if created else "🔗 Связана с расходом:"
+        await bot.send_message(callback_query.from_user.id,
+                              f"✅ Покупка отмечена как купленная!\n\n{link_text}\n"
+                              f"{format_transaction(transaction, include_id=True)}",
+                              parse_mode='HTML',
+                              reply_markup=get_undo_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id,
+                              "❌ Покупка не найдена, уже куплена или нет доступа")
+    
+    await callback_query.answer()
+
+@dp.callback_query_handler(lambda c: c.data.startswith('save_purchase_'))
+async def start_savings_contribution(callback_query: types.CallbackQuery, state: FSMContext):
+    """Отложить деньги на покупку: запрос суммы"""
+    purchase_id = int(callback_query.data[14:])
     purchase = get_purchase(purchase_id)
     
-    if purchase and purchase[1] == callback_query.from_user.id:
-        update_purchase(purchase_id, status='bought')
+    if purchase and purchase.user_id == callback_query.from_user.id and purchase.status == 'planned':
+        await state.update_data(purchase_id=purchase_id)
+        await SavePurchase.waiting_for_amount.set()
         await bot.send_message(callback_query.from_user.id,
-                              "✅ Покупка отмечена как купленная!",
-                              reply_markup=get_main_keyboard())
+                              f"🐷 Сколько отложить на «{html.escape(purchase.item_name)}»?\n"
+                              "Валюту можно указать после суммы: 20 usd, 15€\n\n"
+                              "Для отмены отправьте 'отмена' или 'cancel'")
     else:
         await bot.send_message(callback_query.from_user.id,
                               "❌ Покупка не найдена или нет доступа")
     
     await callback_query.answer()
 
+@dp.message_handler(state=SavePurchase.waiting_for_amount)
+async def process_savings_contribution(message: types.Message, state: FSMContext):
+    """Обработка суммы взноса на покупку"""
+    text = message.text.lower()
+    if text in ['отмена', 'cancel', 'стоп', 'отменить']:
+        await cancel_operation(message, state, "Пополнение накоплений")
+        return
+    
+    try:
+        amount, currency = parse_amount(message.text)
+    except ValueError:
+        await message.answer("❌ Пожалуйста, введите корректную сумму (например: 1500.50 или 20 usd)")
+        return
+    if amount <= 0:
+        await message.answer("❌ Сумма должна быть больше 0")
+        return
+    if get_exchange_rate(currency) is None:
+        await message.answer(f"❌ Нет курса для {currency} - укажите сумму в рублях")
+        return
+    
+    data = await state.get_data()
+    await state.finish()
+    result = add_savings_contribution(message.from_user.id, data['purchase_id'], amount, currency)
+    
+    if result:
+        purchase, contribution_id = result
+        await message.answer(f"🐷 <b>Отложено {format_money(amount, currency)}</b>\n\n"
+                             f"{format_purchase(purchase)}",
+                             parse_mode='HTML', reply_markup=get_contribution_keyboard(contribution_id))
+    else:
+        await message.answer("❌ Покупка не найдена или нет доступа", reply_markup=get_main_keyboard())
+
+@dp.callback_query_handler(lambda c: c.data.startswith('unsave_'))
+async def cancel_savings_contribution(callback_query: types.CallbackQuery):
+    """Отмена взноса на покупку"""
+    purchase = remove_savings_contribution(int(callback_query.data[7:]), callback_query.from_user.id)
+    
+    if purchase:
+        await bot.send_message(callback_query.from_user.id,
+                              f"↩️ <b>Взнос отменен</b>\n\n{format_purchase(purchase)}",
+                              parse_mode='HTML', reply_markup=get_main_keyboard())
+    else:
+        await bot.send_message(callback_query.from_user.id,
+                              "❌ Взнос уже отменен, покупка куплена или нет доступа")
+    
+    await callback_query.answer()
+
 @dp.callback_query_handler(lambda c: c.data.startswith('toggle_shared_'))
 async def toggle_shared_plan(callback_query: types.CallbackQuery):
     """Переключение общего статуса плана"""
     plan_id = int(callback_query.data[14:])
-    plan = get_plan(plan_id)
+    plan = toggle_plan_shared(plan_id, callback_query.from_user.id)
     
-    if plan and plan[1] == callback_query.from_user.id:
-        current_shared = bool(plan[7])  # plan[7] = is_shared
-        new_shared = not current_shared
-        
-        update_plan(plan_id, is_shared=new_shared)
+    if plan:
+        new_shared = bool(plan.is_shared)
+        if new_shared:
+            queue_partner_event(callback_query.from_user.id, 'shared_plan', plan)
         
         status = "общим" if new_shared else "личным"
         await bot.send_message(callback_query.from_user.id,
                               f"✅ План теперь {status}!",
-                              reply_markup=get_main_keyboard())
+                              reply_markup=get_undo_keyboard())
     else:
         await bot.send_message(callback_query.from_user.id,
                               "❌ План не найден или нет доступа")
@@ -1825,27 +1866,19 @@ async def show_all_shared_plans(callback_query: types.CallbackQuery):
     current_date = None
     
     for plan in shared_plans:
-        if len(plan) >= 14:
-            plan_date = plan[4]  # date
-            title = plan[2]      # title
-            description = plan[3] # description
-            time = plan[5]       # time
-            category = plan[6]   # category
-            username = plan[13] or plan[12]  # full_name или username
-            
-            if plan_date != current_date:
-                current_date = plan_date
-                response += f"\n<b>📅 {plan_date}:</b>\n"
-            
-            time_str = f" в {time}" if time else ""
-            response += f"  • <b>{html.escape(title)}</b>{time_str}\n"
-            response += f"    👤 {username} | 🏷️ {html.escape(category)}\n"
-            
-            if description:
-                desc_short = description[:50] + "..." if len(description) > 50 else description
-                response += f"    📝 {html.escape(desc_short)}\n"
-            
-            response += "\n"
+        if plan.date != current_date:
+            current_date = plan.date
+            response += f"\n<b>📅 {current_date}:</b>\n"
+        
+        time_str = f" в {plan.time}" if plan.time else ""
+        response += f"  • <b>{escape_name(plan.title)}</b>{time_str}\n"
+        response += f"    👤 {escape_name(plan.author)} | 🏷️ {escape_name(plan.category)}\n"
+        
+        if plan.description:
+            desc_short = plan.description[:50] + "..." if len(plan.description) > 50 else plan.description
+            response += f"    📝 {escape_text(desc_short)}\n"
+        
+        response += "\n"
     
     await bot.send_message(callback_query.from_user.id, response, parse_mode='HTML')
     await callback_query.answer()
@@ -1933,65 +1966,7 @@ async def process_search_menu(callback_query: types.CallbackQuery, state: FSMCon
 
 async def show_recent_all(user_id):
     """Показать последние записи всех типов"""
-    # Последние 5 расходов
-    recent_expenses = get_user_transactions(user_id, 'all', 'expense')[:5]
-    # Последние 5 доходов
-    recent_incomes = get_user_transactions(user_id, 'all', 'income')[:5]
-    # Последние 5 планов
-    recent_plans = get_user_plans(user_id)
-    # Последние 5 покупок
-    recent_purchases = get_user_purchases(user_id)
-    
-    response = "📋 <b>Последние записи:</b>\n\n"
-    
-    if recent_expenses:
-        response += "💸 <b>Последние расходы:</b>\n"
-        for trans in recent_expenses[:3]:  # Показываем только 3
-            if len(trans) >= 6:
-                amount = trans[2]
-                category = trans[3]
-                description = trans[4]
-                date_str = trans[5] if len(trans) > 5 else "сегодня"
-                
-                desc = f" - {description}" if description else ""
-                response += f"  • {amount:.2f} руб. - {category}{desc} ({date_str})\n"
-        response += "\n"
-    
-    if recent_incomes:
-        response += "💵 <b>Последние доходы:</b>\n"
-        for trans in recent_incomes[:3]:
-            if len(trans) >= 6:
-                amount = trans[2]
-                category = trans[3]
-                description = trans[4]
-                date_str = trans[5] if len(trans) > 5 else "сегодня"
-                
-                desc = f" - {description}" if description else ""
-                response += f"  • {amount:.2f} руб. - {category}{desc} ({date_str})\n"
-        response += "\n"
-    
-    if recent_plans:
-        response += "📅 <b>Ближайшие планы:</b>\n"
-        for plan in recent_plans[:3]:
-            if len(plan) >= 7:
-                title = plan[1]
-                date = plan[3]
-                time = plan[4]
-                time_str = f" в {time}" if time else ""
-                response += f"  • {title} ({date}{time_str})\n"
-        response += "\n"
-    
-    if recent_purchases:
-        response += "🛍️ <b>Планируемые покупки:</b>\n"
-        for purchase in recent_purchases[:3]:
-            if len(purchase) >= 7:
-                item_name = purchase[1]
-                cost = purchase[2]
-                priority = purchase[3]
-                emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[priority]
-                response += f"  • {emoji} {item_name} - {cost:.2f} руб.\n"
-    
-    await bot.send_message(user_id, response, parse_mode='HTML')
+    await bot.send_message(user_id, get_dashboard_text(user_id), parse_mode='HTML')
 
 # ========== ПОИСК РАСХОДОВ/ДОХОДОВ ==========
 
@@ -2339,14 +2314,8 @@ async def start_search_purchases(callback_query: types.CallbackQuery, state: FSM
     
     elif search_type == 'by_status':
         # Поиск по статусу
-        keyboard = InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            InlineKeyboardButton('✅ Купленные', callback_data='search_status_bought'),
-            InlineKeyboardButton('📋 Планируемые', callback_data='search_status_planned')
-        )
-        keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_search'))
-        
-        await bot.send_message(user_id, "📋 Выберите статус покупок:", reply_markup=keyboard)
+        await bot.send_message(user_id, "📋 Выберите статус покупок:",
+                              reply_markup=get_purchase_status_keyboard())
     
     await callback_query.answer()
 
@@ -2472,15 +2441,13 @@ async def show_search_results(message_or_chat_id, results, description, trans_ty
     response = f"🔍 <b>Найдено {len(results)} {type_text} {description}:</b>\n\n"
     
     for trans in results:
-        if len(trans) >= 6:
-            trans_id, trans_type_db, amount, category, description_text, trans_date, time = trans[:7]
-            time_str = f" ({time})" if time else ""
-            
-            response += f"💰 <b>{amount:.2f} руб.</b> - {category}\n"
-            response += f"   📅 {trans_date}{time_str}\n"
-            if description_text:
-                response += f"   📝 {html.escape(description_text)}\n"
-            response += f"   🆔 ID: {trans_id}\n\n"
+        time_str = f" ({trans.time})" if trans.time else ""
+        
+        response += f"💰 <b>{format_money(trans.amount, trans.currency)}</b> - {escape_name(trans.category)}\n"
+        response += f"   📅 {trans.date}{time_str}\n"
+        if trans.description:
+            response += f"   📝 {escape_text(trans.description)}\n"
+        response += f"   🆔 ID: {trans.id}\n\n"
     
     if len(response) > 4000:
         # Разделяем на части если сообщение слишком длинное
@@ -2503,17 +2470,7 @@ async def show_plan_search_results(chat_id, results, description):
     response = f"🔍 <b>Найдено {len(results)} планов {description}:</b>\n\n"
     
     for plan in results:
-        if len(plan) >= 7:
-            plan_id, title, description_text, plan_date, time, category, is_shared = plan[:7]
-            time_str = f" в {time}" if time else ""
-            shared_icon = " 👥" if is_shared else ""
-            
-            response += f"📅 <b>{html.escape(title)}</b>{shared_icon}\n"
-            response += f"   📅 Дата: {plan_date}{time_str}\n"
-            response += f"   🏷️ Категория: {html.escape(category)}\n"
-            if description_text:
-                response += f"   📋 Описание: {html.escape(description_text)}\n"
-            response += f"   🆔 ID: {plan_id}\n\n"
+        response += format_plan(plan, include_id=True) + "\n"
     
     if len(response) > 4000:
         parts = [response[i:i+4000] for i in range(0, len(response), 4000)]
@@ -2535,19 +2492,7 @@ async def show_purchase_search_results(chat_id, results, description):
     response = f"🔍 <b>Найдено {len(results)} покупок {description}:</b>\n\n"
     
     for purchase in results:
-        if len(purchase) >= 7:
-            purchase_id, item_name, cost, priority, target_date, notes, status = purchase[:7]
-            emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[priority]
-            date_str = f"до {target_date}" if target_date else ""
-            status_emoji = "✅" if status == 'bought' else "📋"
-            
-            response += f"{emoji} <b>{html.escape(item_name)}</b> {status_emoji}\n"
-            response += f"   💰 Стоимость: {cost:.2f} руб.\n"
-            if date_str:
-                response += f"   📅 {date_str}\n"
-            if notes:
-                response += f"   📝 Заметки: {html.escape(notes)}\n"
-            response += f"   🆔 ID: {purchase_id}\n\n"
+        response += format_purchase(purchase, include_id=True) + "\n"
     
     if len(response) > 4000:
         parts = [response[i:i+4000] for i in range(0, len(response), 4000)]
@@ -2560,6 +2505,36 @@ async def show_purchase_search_results_chat(chat_id, results, description):
     """Алиас для show_purchase_search_results"""
     await show_purchase_search_results(chat_id, results, description)
 
+async def send_edit_result(user_id, title, record):
+    """Запись после правки (строка из update_*) с клавиатурой редактирования"""
+    if record is None:
+        await bot.send_message(user_id, "❌ Запись не найдена или нет доступа", reply_markup=get_main_keyboard())
+        return
+    
+    if isinstance(record, Transaction):
+        details = format_transaction(record, include_id=True)
+        keyboard = get_edit_transaction_keyboard(record.id, record.type)
+    elif isinstance(record, Plan):
+        details = format_plan(record, include_id=True)
+        keyboard = get_edit_plan_keyboard(record.id)
+    else:
+        details = format_purchase(record, include_id=True)
+        keyboard = get_edit_purchase_keyboard(record.id)
+    await bot.send_message(user_id, f"{title}\n\n{details}", parse_mode='HTML', reply_markup=keyboard)
+
+@dp.errors_handler(exception=ConflictError)
+async def edit_conflict(update: types.Update, error: ConflictError):
+    """Запись изменили, пока пользователь вводил новое значение: правка не сохраняется"""
+    user_id = (update.message or update.callback_query).from_user.id
+    await dp.current_state(chat=user_id, user=user_id).finish()
+    
+    getter = {'transactions': get_transaction, 'plans': get_plan, 'planned_purchases': get_purchase}[error.table]
+    await send_edit_result(user_id,
+                           "⚠️ Запись изменили, пока вы ее редактировали - ваша правка не сохранена.\n\n"
+                           "<b>Сейчас:</b>",
+                           getter(error.record_id))
+    return True
+
 # ========== ОБРАБОТЧИКИ СОСТОЯНИЙ РЕДАКТИРОВАНИЯ ==========
 
 # Редактирование расходов
@@ -2573,21 +2548,21 @@ async def edit_expense_amount(message: types.Message, state: FSMContext):
         return
     
     try:
-        amount = float(text.replace(',', '.'))
+        # Без указания валюты у операции остается прежняя
+        amount, currency = parse_amount(text, default=None)
         if amount <= 0:
             await message.answer("❌ Сумма должна быть больше 0")
             return
+        if currency and get_exchange_rate(currency) is None:
+            await message.answer(f"❌ Нет курса для {currency} - укажите сумму в рублях")
+            return
         
         data = await state.get_data()
         trans_id = data.get('trans_id')
         
-        update_transaction(trans_id, amount=amount)
-        
-        transaction = get_transaction(trans_id)
-        await message.answer(f"✅ Сумма расхода обновлена!\n\n"
-                           f"{format_transaction(transaction, include_id=True)}",
-                           parse_mode='HTML',
-                           reply_markup=get_edit_transaction_keyboard(trans_id, 'expense'))
+        transaction = update_transaction(trans_id, amount=amount, currency=currency, expected_version=data.get('version'),
+                                         user_id=message.from_user.id)
+        await send_edit_result(message.from_user.id, "✅ Сумма расхода обновлена!", transaction)
         await state.finish()
     
     except ValueError:
@@ -2601,14 +2576,9 @@ async def edit_expense_category(callback_query: types.CallbackQuery, state: FSMC
     data = await state.get_data()
     trans_id = data.get('trans_id')
     
-    update_transaction(trans_id, category=category)
-    
-    transaction = get_transaction(trans_id)
-    await bot.send_message(callback_query.from_user.id,
-                          f"✅ Категория расхода обновлена!\n\n"
-                          f"{format_transaction(transaction, include_id=True)}",
-                          parse_mode='HTML',
-                          reply_markup=get_edit_transaction_keyboard(trans_id, 'expense'))
+    transaction = update_transaction(trans_id, category=category, expected_version=data.get('version'),
+                                     user_id=callback_query.from_user.id)
+    await send_edit_result(callback_query.from_user.id, "✅ Категория расхода обновлена!", transaction)
     await state.finish()
     await callback_query.answer()
 
@@ -2635,13 +2605,9 @@ async def edit_expense_description(message: types.Message, state: FSMContext):
     trans_id = data.get('trans_id')
     
     description = message.text if message.text != '-' else None
-    update_transaction(trans_id, description=description)
-    
-    transaction = get_transaction(trans_id)
-    await message.answer(f"✅ Описание расхода обновлено!\n\n"
-                       f"{format_transaction(transaction, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_transaction_keyboard(trans_id, 'expense'))
+    transaction = update_transaction(trans_id, description=description, expected_version=data.get('version'),
+                                     user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Описание расхода обновлено!", transaction)
     await state.finish()
 
 # Редактирование доходов
@@ -2655,21 +2621,21 @@ async def edit_income_amount(message: types.Message, state: FSMContext):
         return
     
     try:
-        amount = float(text.replace(',', '.'))
+        # Без указания валюты у операции остается прежняя
+        amount, currency = parse_amount(text, default=None)
         if amount <= 0:
             await message.answer("❌ Сумма должна быть больше 0")
             return
+        if currency and get_exchange_rate(currency) is None:
+            await message.answer(f"❌ Нет курса для {currency} - укажите сумму в рублях")
+            return
         
         data = await state.get_data()
         trans_id = data.get('trans_id')
         
-        update_transaction(trans_id, amount=amount)
-        
-        transaction = get_transaction(trans_id)
-        await message.answer(f"✅ Сумма дохода обновлена!\n\n"
-                           f"{format_transaction(transaction, include_id=True)}",
-                           parse_mode='HTML',
-                           reply_markup=get_edit_transaction_keyboard(trans_id, 'income'))
+        transaction = update_transaction(trans_id, amount=amount, currency=currency, expected_version=data.get('version'),
+                                         user_id=message.from_user.id)
+        await send_edit_result(message.from_user.id, "✅ Сумма дохода обновлена!", transaction)
         await state.finish()
     
     except ValueError:
@@ -2683,14 +2649,9 @@ async def edit_income_category(callback_query: types.CallbackQuery, state: FSMCo
     data = await state.get_data()
     trans_id = data.get('trans_id')
     
-    update_transaction(trans_id, category=category)
-    
-    transaction = get_transaction(trans_id)
-    await bot.send_message(callback_query.from_user.id,
-                          f"✅ Категория дохода обновлена!\n\n"
-                          f"{format_transaction(transaction, include_id=True)}",
-                          parse_mode='HTML',
-                          reply_markup=get_edit_transaction_keyboard(trans_id, 'income'))
+    transaction = update_transaction(trans_id, category=category, expected_version=data.get('version'),
+                                     user_id=callback_query.from_user.id)
+    await send_edit_result(callback_query.from_user.id, "✅ Категория дохода обновлена!", transaction)
     await state.finish()
     await callback_query.answer()
 
@@ -2717,13 +2678,9 @@ async def edit_income_description(message: types.Message, state: FSMContext):
     trans_id = data.get('trans_id')
     
     description = message.text if message.text != '-' else None
-    update_transaction(trans_id, description=description)
-    
-    transaction = get_transaction(trans_id)
-    await message.answer(f"✅ Описание дохода обновлено!\n\n"
-                       f"{format_transaction(transaction, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_transaction_keyboard(trans_id, 'income'))
+    transaction = update_transaction(trans_id, description=description, expected_version=data.get('version'),
+                                     user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Описание дохода обновлено!", transaction)
     await state.finish()
 
 # Редактирование планов
@@ -2739,13 +2696,9 @@ async def edit_plan_title(message: types.Message, state: FSMContext):
     data = await state.get_data()
     plan_id = data.get('plan_id')
     
-    update_plan(plan_id, title=message.text)
-    
-    plan = get_plan(plan_id)
-    await message.answer(f"✅ Название плана обновлено!\n\n"
-                       f"{format_plan(plan, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_plan_keyboard(plan_id))
+    plan = update_plan(plan_id, title=message.text, expected_version=data.get('version'),
+                       user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Название плана обновлено!", plan)
     await state.finish()
 
 @dp.message_handler(state=EditPlan.waiting_for_description)
@@ -2761,13 +2714,9 @@ async def edit_plan_description(message: types.Message, state: FSMContext):
     plan_id = data.get('plan_id')
     
     description = message.text if message.text != '-' else None
-    update_plan(plan_id, description=description)
-    
-    plan = get_plan(plan_id)
-    await message.answer(f"✅ Описание плана обновлено!\n\n"
-                       f"{format_plan(plan, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_plan_keyboard(plan_id))
+    plan = update_plan(plan_id, description=description, expected_version=data.get('version'),
+                       user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Описание плана обновлено!", plan)
     await state.finish()
 
 @dp.message_handler(state=EditPlan.waiting_for_date)
@@ -2796,13 +2745,9 @@ async def edit_plan_date(message: types.Message, state: FSMContext):
             await message.answer("❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД")
             return
     
-    update_plan(plan_id, date=new_date)
-    
-    plan = get_plan(plan_id)
-    await message.answer(f"✅ Дата плана обновлена!\n\n"
-                       f"{format_plan(plan, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_plan_keyboard(plan_id))
+    plan = update_plan(plan_id, date=new_date, expected_version=data.get('version'),
+                       user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Дата плана обновлена!", plan)
     await state.finish()
 
 @dp.message_handler(state=EditPlan.waiting_for_time)
@@ -2826,13 +2771,9 @@ async def edit_plan_time(message: types.Message, state: FSMContext):
             await message.answer("❌ Неверный формат времени. Используйте ЧЧ:ММ")
             return
     
-    update_plan(plan_id, time=time_str)
-    
-    plan = get_plan(plan_id)
-    await message.answer(f"✅ Время плана обновлено!\n\n"
-                       f"{format_plan(plan, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_plan_keyboard(plan_id))
+    plan = update_plan(plan_id, time=time_str, expected_version=data.get('version'),
+                       user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Время плана обновлено!", plan)
     await state.finish()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('plan_cat_'), state=EditPlan.waiting_for_category)
@@ -2843,14 +2784,9 @@ async def edit_plan_category(callback_query: types.CallbackQuery, state: FSMCont
     data = await state.get_data()
     plan_id = data.get('plan_id')
     
-    update_plan(plan_id, category=category)
-    
-    plan = get_plan(plan_id)
-    await bot.send_message(callback_query.from_user.id,
-                          f"✅ Категория плана обновлена!\n\n"
-                          f"{format_plan(plan, include_id=True)}",
-                          parse_mode='HTML',
-                          reply_markup=get_edit_plan_keyboard(plan_id))
+    plan = update_plan(plan_id, category=category, expected_version=data.get('version'),
+                       user_id=callback_query.from_user.id)
+    await send_edit_result(callback_query.from_user.id, "✅ Категория плана обновлена!", plan)
     await state.finish()
     await callback_query.answer()
 
@@ -2877,13 +2813,9 @@ async def edit_purchase_name(message: types.Message, state: FSMContext):
     data = await state.get_data()
     purchase_id = data.get('purchase_id')
     
-    update_purchase(purchase_id, item_name=message.text)
-    
-    purchase = get_purchase(purchase_id)
-    await message.answer(f"✅ Название покупки обновлено!\n\n"
-                       f"{format_purchase(purchase, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_purchase_keyboard(purchase_id))
+    purchase = update_purchase(purchase_id, item_name=message.text, expected_version=data.get('version'),
+                               user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Название покупки обновлено!", purchase)
     await state.finish()
 
 @dp.message_handler(state=EditPurchase.waiting_for_cost)
@@ -2904,13 +2836,9 @@ async def edit_purchase_cost(message: types.Message, state: FSMContext):
         data = await state.get_data()
         purchase_id = data.get('purchase_id')
         
-        update_purchase(purchase_id, estimated_cost=cost)
-        
-        purchase = get_purchase(purchase_id)
-        await message.answer(f"✅ Стоимость покупки обновлена!\n\n"
-                           f"{format_purchase(purchase, include_id=True)}",
-                           parse_mode='HTML',
-                           reply_markup=get_edit_purchase_keyboard(purchase_id))
+        purchase = update_purchase(purchase_id, estimated_cost=cost, expected_version=data.get('version'),
+                                   user_id=message.from_user.id)
+        await send_edit_result(message.from_user.id, "✅ Стоимость покупки обновлена!", purchase)
         await state.finish()
     
     except ValueError:
@@ -2924,14 +2852,9 @@ async def edit_purchase_priority(callback_query: types.CallbackQuery, state: FSM
     data = await state.get_data()
     purchase_id = data.get('purchase_id')
     
-    update_purchase(purchase_id, priority=priority)
-    
-    purchase = get_purchase(purchase_id)
-    await bot.send_message(callback_query.from_user.id,
-                          f"✅ Приоритет покупки обновлен!\n\n"
-                          f"{format_purchase(purchase, include_id=True)}",
-                          parse_mode='HTML',
-                          reply_markup=get_edit_purchase_keyboard(purchase_id))
+    purchase = update_purchase(purchase_id, priority=priority, expected_version=data.get('version'),
+                               user_id=callback_query.from_user.id)
+    await send_edit_result(callback_query.from_user.id, "✅ Приоритет покупки обновлен!", purchase)
     await state.finish()
     await callback_query.answer()
 
@@ -2966,13 +2889,9 @@ async def edit_purchase_date(message: types.Message, state: FSMContext):
             await message.answer("❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД")
             return
     
-    update_purchase(purchase_id, target_date=date_str)
-    
-    purchase = get_purchase(purchase_id)
-    await message.answer(f"✅ Дата покупки обновлена!\n\n"
-                       f"{format_purchase(purchase, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_purchase_keyboard(purchase_id))
+    purchase = update_purchase(purchase_id, target_date=date_str, expected_version=data.get('version'),
+                               user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Дата покупки обновлена!", purchase)
     await state.finish()
 
 @dp.message_handler(state=EditPurchase.waiting_for_notes)
@@ -2988,13 +2907,9 @@ async def edit_purchase_notes(message: types.Message, state: FSMContext):
     purchase_id = data.get('purchase_id')
     
     notes = message.text if message.text != '-' else None
-    update_purchase(purchase_id, notes=notes)
-    
-    purchase = get_purchase(purchase_id)
-    await message.answer(f"✅ Заметки покупки обновлены!\n\n"
-                       f"{format_purchase(purchase, include_id=True)}",
-                       parse_mode='HTML',
-                       reply_markup=get_edit_purchase_keyboard(purchase_id))
+    purchase = update_purchase(purchase_id, notes=notes, expected_version=data.get('version'),
+                               user_id=message.from_user.id)
+    await send_edit_result(message.from_user.id, "✅ Заметки покупки обновлены!", purchase)
     await state.finish()
 
 # ========== ОБРАБОТЧИКИ ОБЩИХ ПЛАНОВ ==========
@@ -3024,27 +2939,19 @@ async def show_all_shared_plans(callback_query: types.CallbackQuery):
     current_date = None
     
     for plan in shared_plans:
-        if len(plan) >= 14:
-            plan_date = plan[4]  # date
-            title = plan[2]      # title
-            description = plan[3] # description
-            time = plan[5]       # time
-            category = plan[6]   # category
-            username = plan[13] or plan[12]  # full_name или username
-            
-            if plan_date != current_date:
-                current_date = plan_date
-                response += f"\n<b>📅 {plan_date}:</b>\n"
-            
-            time_str = f" в {time}" if time else ""
-            response += f"  • <b>{html.escape(title)}</b>{time_str}\n"
-            response += f"    👤 {username} | 🏷️ {html.escape(category)}\n"
-            
-            if description:
-                desc_short = description[:50] + "..." if len(description) > 50 else description
-                response += f"    📝 {html.escape(desc_short)}\n"
-            
-            response += "\n"
+        if plan.date != current_date:
+            current_date = plan.date
+            response += f"\n<b>📅 {current_date}:</b>\n"
+        
+        time_str = f" в {plan.time}" if plan.time else ""
+        response += f"  • <b>{escape_name(plan.title)}</b>{time_str}\n"
+        response += f"    👤 {escape_name(plan.author)} | 🏷️ {escape_name(plan.category)}\n"
+        
+        if plan.description:
+            desc_short = plan.description[:50] + "..." if len(plan.description) > 50 else plan.description
+            response += f"    📝 {escape_text(desc_short)}\n"
+        
+        response += "\n"
     
     await bot.send_message(callback_query.from_user.id, response, parse_mode='HTML')
     await callback_query.answer()
@@ -3077,161 +2984,35 @@ async def show_personal_plans(callback_query: types.CallbackQuery):
     await bot.send_message(callback_query.from_user.id, response, parse_mode='HTML')
     await callback_query.answer()
 
-# ========== ДОПОЛНИТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ ПОИСКА ==========
-
-def search_transactions(user_id, trans_type=None, description=None, category=None, 
-                       min_amount=None, max_amount=None, date_filter=None):
-    """Поиск транзакций по фильтрам"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    query = '''
-        SELECT id, type, amount, category, description, date,
-               strftime('%H:%M', created_at) as time
-        FROM transactions 
-        WHERE user_id = ? AND is_deleted = 0
-    '''
-    params = [user_id]
-    
-    if trans_type:
-        query += " AND type = ?"
-        params.append(trans_type)
-    
-    if description:
-        query += " AND description LIKE ?"
-        params.append(f'%{description}%')
-    
-    if category:
-        query += " AND category = ?"
-        params.append(category)
-    
-    if min_amount is not None:
-        query += " AND amount >= ?"
-        params.append(min_amount)
-    
-    if max_amount is not None:
-        query += " AND amount <= ?"
-        params.append(max_amount)
-    
-    if date_filter:
-        if date_filter == 'сегодня':
-            query += " AND date = DATE('now')"
-        elif date_filter == 'неделя':
-            query += " AND date >= DATE('now', '-7 days')"
-        elif date_filter == 'месяц':
-            query += " AND strftime('%Y-%m', date) = strftime('%Y-%m', 'now')"
-        else:
-            try:
-                datetime.strptime(date_filter, '%Y-%m-%d')
-                query += " AND date = ?"
-                params.append(date_filter)
-            except ValueError:
-                pass
-    
-    query += " ORDER BY date DESC, created_at DESC"
-    
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    conn.close()
-    
-    return results
-
-def search_plans(user_id, search_text=None, category=None, date_from=None, 
-                date_to=None, is_shared=None):
-    """Поиск планов по фильтрам"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    query = '''
-        SELECT id, title, description, date, time, category, is_shared
-        FROM plans 
-        WHERE user_id = ? AND is_deleted = 0
-    '''
-    params = [user_id]
-    
-    if search_text:
-        query += " AND (title LIKE ? OR description LIKE ?)"
-        params.append(f'%{search_text}%')
-        params.append(f'%{search_text}%')
-    
-    if category:
-        query += " AND category = ?"
-        params.append(category)
-    
-    if date_from:
-        query += " AND date >= ?"
-        params.append(date_from)
-    
-    if date_to:
-        query += " AND date <= ?"
-        params.append(date_to)
-    
-    if is_shared is not None:
-        query += " AND is_shared = ?"
-        params.append(int(is_shared))
-    
-    query += " ORDER BY date, time NULLS FIRST"
-    
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    conn.close()
-    
-    return results
+# ========== ЗАПУСК БОТА ==========
 
-def search_purchases(user_id, search_text=None, priority=None, status=None,
-                    min_cost=None, max_cost=None):
-    """Поиск покупок по фильтрам"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    query = '''
-        SELECT id, item_name, estimated_cost, priority, target_date, notes, status
-        FROM planned_purchases 
-        WHERE user_id = ? AND is_deleted = 0
-    '''
-    params = [user_id]
-    
-    if search_text:
-        query += " AND (item_name LIKE ? OR notes LIKE ?)"
-        params.append(f'%{search_text}%')
-        params.append(f'%{search_text}%')
-    
-    if priority:
-        query += " AND priority = ?"
-        params.append(priority)
+async def on_startup(dp):
+    """Действия при запуске бота"""
+    try:
+        logger.info(f"✅ Загружено курсов валют: {load_exchange_rates()}")
+        # Файл с курсами может обновляться внешней выгрузкой - перечитываем его раз в день
+        scheduler.add_job(load_exchange_rates, CronTrigger(hour=6))
+    except Exception as e:
+        logger.error(f"❌ Ошибка при загрузке курсов валют: {e}")
     
-    if status:
-        query += " AND status = ?"
-        params.append(status)
+    # Ночной снимок базы и еженедельный архив; синхронные задания планировщик
+    # выполняет в пуле потоков
+    scheduler.add_job(create_backup, CronTrigger(hour=4))
+    scheduler.add_job(archive_old_rows, CronTrigger(day_of_week='sun', hour=4, minute=30))
     
-    if min_cost is not None:
-        query += " AND estimated_cost >= ?"
-        params.append(min_cost)
-    
-    if max_cost is not None:
-        query += " AND estimated_cost <= ?"
-        params.append(max_cost)
+    # Покупки, отмеченные до появления сверки, связываются с уже записанными расходами
+    try:
+        logger.info(f"✅ Связано покупок с расходами: {reconcile_purchases()}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка при сверке покупок: {e}")
     
-    query += " ORDER BY "
-    query += '''
-        CASE priority 
-            WHEN 'high' THEN 1
-            WHEN 'medium' THEN 2
-            WHEN 'low' THEN 3
-        END,
-        target_date NULLS LAST
-    '''
+    if not OCR_AVAILABLE:
+        logger.warning("⚠️ pytesseract/Pillow не установлены - чеки с фото вводятся вручную")
     
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    conn.close()
+    # Сводки о действиях партнера: раз в минуту отправляются те, у которых закончилось окно
+    if NOTIFY_WINDOW_MINUTES > 0:
+        scheduler.add_job(send_due_digests, IntervalTrigger(minutes=1), args=[bot])
     
-    return results
-
-# ========== ЗАПУСК БОТА ==========
-
-async def on_startup(dp):
-    """Действия при запуске бота"""
     try:
         await schedule_reminders(bot)
         logger.info("✅ Бот запущен!")
@@ -3239,13 +3020,13 @@ async def on_startup(dp):
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске планировщика: {e}")
 
+async def on_shutdown(dp):
+    """Действия при остановке бота"""
+    # Накопленные сводки не ждут конца окна - иначе они пропадут вместе с процессом
+    await send_due_digests(bot, force=True)
+    shutdown_chart_pool()
+    shutdown_receipt_pool()
+
 if __name__ == '__main__':
-    # Запускаем миграцию базы данных
-    try:
-        import migration
-        migration.migrate_database()
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка при миграции базы данных: {e}")
-    
-    # Запускаем бота
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
\ No newline at end of file
+    # Запускаем бота (схема базы уже приведена к текущей версии в init_db)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
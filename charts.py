@@ -0,0 +1,209 @@
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from config import CHART_WORKERS, MY_USER_ID, GIRLFRIEND_USER_ID
+from database import (get_data_version, get_user_names, get_common_categories_statistics,
+                      get_daily_expenses, get_shared_expenses_by_category)
+from planning import get_plan_report
+
+CHART_TITLES = {
+    'pie': '🥧 Расходы по категориям за месяц',
+    'daily': '📈 Расходы по дням за 30 дней',
+    'partners': '👫 Сравнение расходов по категориям',
+    'plan': '🎯 План и факт по покупкам',
+}
+
+CHART_CACHE_SIZE = 64
+
+# ========== ОТРИСОВКА (выполняется в пуле процессов) ==========
+
+def _to_png(fig):
+    """Сохранить фигуру в PNG"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
+
+def render_category_pie(title, labels, values):
+    """Круговая диаграмма расходов по категориям"""
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.pie(values, labels=labels, autopct='%1.0f%%', startangle=90, counterclock=False)
+    ax.set_title(title)
+    ax.axis('equal')
+    return _to_png(fig)
+
+def render_daily_line(title, days, series):
+    """Линейный график расходов по дням для каждого пользователя"""
+    fig, ax = plt.subplots(figsize=(8, 4))
+    positions = list(range(len(days)))
+    for name, values in series.items():
+        ax.plot(positions, values, marker='o', markersize=3, label=name)
+    ax.set_title(title)
+    ax.set_ylabel('руб.')
+    ax.grid(alpha=0.3)
+    ax.legend()
+    ax.set_xticks(positions[::5])
+    ax.set_xticklabels(days[::5])
+    fig.autofmt_xdate()
+    return _to_png(fig)
+
+def render_partner_bars(title, categories, series):
+    """Столбчатая диаграмма: по столбцу каждой серии на категорию"""
+    fig, ax = plt.subplots(figsize=(8, 4.5))
+    width = 0.8 / max(len(series), 1)
+    positions = range(len(categories))
+    for i, (name, values) in enumerate(series.items()):
+        ax.bar([p + i * width for p in positions], values, width, label=name)
+    ax.set_xticks([p + width * (len(series) - 1) / 2 for p in positions])
+    ax.set_xticklabels(categories, rotation=30, ha='right')
+    ax.set_title(title)
+    ax.set_ylabel('руб.')
+    ax.legend()
+    return _to_png(fig)
+
+# ========== ПОДГОТОВКА ДАННЫХ ==========
+
+def _plot_title(kind):
+    """Заголовок для картинки без эмодзи (их нет в шрифтах matplotlib)"""
+    return CHART_TITLES[kind].split(' ', 1)[1]
+
+def _prepare_pie():
+    """Данные для диаграммы категорий"""
+    rows = [(category, expense) for category, expense, count in get_common_categories_statistics()
+            if expense and expense > 0]
+    if not rows:
+        return None
+    labels, values = zip(*rows)
+    return render_category_pie, (_plot_title('pie'), list(labels), list(values))
+
+def _prepare_daily():
+    """Данные для графика по дням"""
+    rows = get_daily_expenses(30)
+    if not rows:
+        return None
+
+    names = get_user_names()
+    today = date.today()
+    days = [(today - timedelta(days=offset)).isoformat() for offset in range(29, -1, -1)]
+    index = {day: i for i, day in enumerate(days)}
+    series = {}
+    for user in (MY_USER_ID, GIRLFRIEND_USER_ID):
+        series[names.get(user, str(user))] = [0] * len(days)
+
+    for day, user, total in rows:
+        if day in index:
+            series[names.get(user, str(user))][index[day]] = total or 0
+
+    labels = [day[5:] for day in days]
+    return render_daily_line, (_plot_title('daily'), labels, series)
+
+def _prepare_partners():
+    """Данные для сравнения партнеров"""
+    rows = [row for row in get_shared_expenses_by_category() if row[3] and row[3] > 0]
+    if not rows:
+        return None
+
+    names = get_user_names()
+    categories = [row[0] for row in rows]
+    series = {
+        names.get(MY_USER_ID, str(MY_USER_ID)): [row[1] or 0 for row in rows],
+        names.get(GIRLFRIEND_USER_ID, str(GIRLFRIEND_USER_ID)): [row[2] or 0 for row in rows],
+    }
+    return render_partner_bars, (_plot_title('partners'), categories, series)
+
+def _prepare_plan():
+    """Данные для плана и факта по месяцам"""
+    report = get_plan_report()
+    if not any(month['planned'] for month in report):
+        return None
+
+    months = [month['month'] for month in report]
+    series = {
+        'План': [month['planned'] for month in report],
+        'Факт': [month['actual'] for month in report],
+    }
+    return render_partner_bars, (_plot_title('plan'), months, series)
+
+_PREPARERS = {
+    'pie': _prepare_pie,
+    'daily': _prepare_daily,
+    'partners': _prepare_partners,
+    'plan': _prepare_plan,
+}
+
+# ========== КЭШ И ПУЛ ПРОЦЕССОВ ==========
+
+class ChartCache:
+    """LRU-кэш картинок по ключу (график, день, версия данных)"""
+
+    def __init__(self, maxsize=CHART_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        png = self._items.get(key)
+        if png is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return png
+
+    def put(self, key, png):
+        self._items[key] = png
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+chart_cache = ChartCache()
+_executor = None
+
+def _get_executor():
+    """Пул процессов создается при первом графике"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+    return _executor
+
+def shutdown_chart_pool():
+    """Остановить пул процессов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def get_chart(kind):
+    """PNG графика из кэша или отрисованный в пуле процессов (None, если данных нет)"""
+    if kind not in _PREPARERS:
+        return None
+
+    # Все диаграммы общие для пары, поэтому пользователь в ключ не входит;
+    # дата нужна, так как графики строятся относительно текущего дня
+    key = (kind, date.today(), get_data_version())
+    png = chart_cache.get(key)
+    if png is not None:
+        return png
+
+    prepared = _PREPARERS[kind]()
+    if prepared is None:
+        return None
+
+    renderer, args = prepared
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_get_executor(), renderer, *args)
+    chart_cache.put(key, png)
+    return png
@@ -6,4 +6,30 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 MY_USER_ID = int(os.getenv('MY_USER_ID'))
 GIRLFRIEND_USER_ID = int(os.getenv('GIRLFRIEND_USER_ID'))
-DB_PATH = 'finance_planner.db'
\ No newline at end of file
+DB_PATH = os.getenv('DB_PATH', 'finance_planner.db')
+
+# Графики рисуются в отдельных процессах, чтобы не блокировать бота
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+
+# Валюта, в которой считается вся статистика, и файл с курсами: строки date,currency,rate,
+# где rate - сколько рублей стоит одна единица currency
+BASE_CURRENCY = 'RUB'
+EXCHANGE_RATES_PATH = os.getenv('EXCHANGE_RATES_PATH', 'exchange_rates.csv')
+
+# Резервные копии базы: каталог и сколько последних снимков хранить
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+
+# Архив: удаленные записи переносятся через столько дней после удаления,
+# а операции - когда их год старше последних ARCHIVE_KEEP_YEARS календарных лет
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', '90'))
+ARCHIVE_KEEP_YEARS = int(os.getenv('ARCHIVE_KEEP_YEARS', '2'))
+
+# Сводки о действиях партнера: события копятся столько минут с первого из них
+# и уходят одним сообщением (0 - не присылать)
+NOTIFY_WINDOW_MINUTES = int(os.getenv('NOTIFY_WINDOW_MINUTES', '10'))
+
+# Чеки с фото распознаются в отдельных процессах (нужны pytesseract, Pillow и tesseract-ocr
+# с языковыми пакетами); без них фото чека предлагает ввести сумму вручную
+RECEIPT_WORKERS = int(os.getenv('RECEIPT_WORKERS', '2'))
+RECEIPT_OCR_LANG = os.getenv('RECEIPT_OCR_LANG', 'rus+eng')
@@ -0,0 +1,54 @@
+import re
+
+from config import BASE_CURRENCY
+
+CURRENCY_SYMBOLS = {
+    'RUB': 'руб.',
+    'USD': '$',
+    'EUR': '€',
+    'KZT': '₸',
+    'GEL': '₾',
+    'TRY': '₺',
+}
+
+BASE_SYMBOL = CURRENCY_SYMBOLS[BASE_CURRENCY]
+
+# Как валюту можно написать после суммы
+CURRENCY_ALIASES = {
+    'руб': 'RUB', 'руб.': 'RUB', 'р': 'RUB', 'р.': 'RUB', '₽': 'RUB', 'rub': 'RUB',
+    '$': 'USD', 'usd': 'USD', 'долл': 'USD',
+    '€': 'EUR', 'eur': 'EUR', 'евро': 'EUR',
+    '₸': 'KZT', 'kzt': 'KZT', 'тенге': 'KZT',
+    '₾': 'GEL', 'gel': 'GEL', 'лари': 'GEL',
+    '₺': 'TRY', 'try': 'TRY', 'лир': 'TRY',
+}
+
+_AMOUNT_RE = re.compile(r'^\s*(\d+(?:[.,]\d{1,2})?)\s*(\S*)\s*$')
+
+def parse_amount(text, default=BASE_CURRENCY):
+    """'1500', '12.5 usd', '20€' -> (сумма, код валюты); ValueError, если не разобрать.
+    
+    Если валюта не указана, возвращается default.
+    """
+    match = _AMOUNT_RE.match(text)
+    if not match:
+        raise ValueError(text)
+
+    amount = float(match.group(1).replace(',', '.'))
+    suffix = match.group(2).lower()
+    if not suffix:
+        return amount, default
+
+    currency = CURRENCY_ALIASES.get(suffix) or (suffix.upper() if suffix.upper() in CURRENCY_SYMBOLS else None)
+    if currency is None:
+        raise ValueError(text)
+    return amount, currency
+
+def format_money(amount, currency=BASE_CURRENCY, base_amount=None):
+    """Сумма с символом валюты: '1500.00 руб.', '12.50 $ (≈ 1125.00 руб.)'"""
+    if currency == BASE_CURRENCY:
+        return f"{amount:.2f} {BASE_SYMBOL}"
+    text = f"{amount:.2f} {CURRENCY_SYMBOLS.get(currency, currency)}"
+    if base_amount is not None:
+        text += f" (≈ {base_amount:.2f} {BASE_SYMBOL})"
+    return text
@@ -1,6 +1,15 @@
+import bisect
+import csv
+import json
+import os
+import re
 import sqlite3
 from datetime import datetime, date, timedelta
-from config import DB_PATH, MY_USER_ID, GIRLFRIEND_USER_ID
+from config import (DB_PATH, MY_USER_ID, GIRLFRIEND_USER_ID, BASE_CURRENCY, EXCHANGE_RATES_PATH,
+                    ARCHIVE_RETENTION_DAYS, ARCHIVE_KEEP_YEARS)
+from migration import ARCHIVED_TABLES, BASE_AMOUNT_SQL, backfill_in_chunks, migrate_database
+from models import (TRANSACTION_COLUMNS, PLAN_COLUMNS, PURCHASE_COLUMNS, JOURNAL_COLUMNS,
+                    TRANSACTION_ROW, PLAN_ROW, PURCHASE_ROW, JOURNAL_ROW)
 
 def init_db():
     """Инициализация базы данных с ВСЕМИ полями"""
@@ -24,12 +33,17 @@ def init_db():
             user_id INTEGER,
             type TEXT CHECK(type IN ('income', 'expense')),
             amount REAL,
+            amount_minor INTEGER,
+            currency TEXT NOT NULL DEFAULT 'RUB',
             category TEXT,
             description TEXT,
             date DATE DEFAULT CURRENT_DATE,
             is_deleted BOOLEAN DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0,
+            split_share INTEGER NOT NULL DEFAULT 0,
+            split_minor INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
@@ -50,6 +64,7 @@ def init_db():
             is_deleted BOOLEAN DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
@@ -61,6 +76,7 @@ def init_db():
             user_id INTEGER,
             item_name TEXT NOT NULL,
             estimated_cost REAL,
+            estimated_cost_minor INTEGER,
             priority TEXT CHECK(priority IN ('low', 'medium', 'high')),
             target_date DATE,
             notes TEXT,
@@ -68,14 +84,319 @@ def init_db():
             is_deleted BOOLEAN DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0,
+            saved_minor INTEGER NOT NULL DEFAULT 0,
+            transaction_id INTEGER,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
     
+    # Курсы валют: сколько базовой валюты стоит единица currency на дату
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            currency TEXT NOT NULL,
+            date DATE NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (currency, date)
+        )
+    ''')
+    
+    # Индекс для ближайших планов на главном экране
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_plans_date
+        ON plans (date, time)
+    ''')
+    
     conn.commit()
     conn.close()
+    
+    # Новые колонки и индексы для уже существующих баз
+    migrate_database()
     print("✅ База данных создана/инициализирована")
 
+# ========== ДЕНЕЖНЫЕ СУММЫ ==========
+
+# Суммы хранятся в копейках (amount_minor, estimated_cost_minor) и складываются
+# как целые числа; REAL-колонки пишутся параллельно для совместимости
+
+MINOR_UNITS = 100
+
+def to_minor(amount):
+    """Рубли -> копейки без Decimal: у суммы с двумя знаками ошибка float много меньше копейки"""
+    return int(round(amount * MINOR_UNITS))
+
+# ========== КУРСЫ ВАЛЮТ ==========
+
+# Курсы загружаются из CSV (date,currency,rate) в таблицу exchange_rates:
+# агрегаты пересчитывают валюты в SQL через представление transactions_base,
+# а для отдельных сумм в Python курсы держатся в памяти
+
+_rate_cache = {}  # валюта -> (отсортированные даты, курсы)
+
+def load_exchange_rates(path=EXCHANGE_RATES_PATH):
+    """Загрузить курсы из CSV-файла; возвращает число загруженных строк"""
+    if not os.path.exists(path):
+        return 0
+    
+    with open(path, newline='', encoding='utf-8') as rates_file:
+        rows = [(row['currency'].strip().upper(), row['date'].strip(), float(row['rate']))
+                for row in csv.DictReader(rates_file)]
+    
+    conn = sqlite3.connect(DB_PATH)
+    # Неизмененные курсы не перезаписываются: триггер открывает закрытые месяцы
+    # заново только при новом или другом курсе
+    conn.executemany('''
+        INSERT INTO exchange_rates (currency, date, rate) VALUES (?, ?, ?)
+        ON CONFLICT (currency, date) DO UPDATE SET rate = excluded.rate WHERE rate != excluded.rate
+    ''', rows)
+    conn.commit()
+    conn.close()
+    
+    _rate_cache.clear()
+    _bump_data_version()
+    return len(rows)
+
+def _load_rate_cache():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT currency, date, rate FROM exchange_rates ORDER BY currency, date')
+    for currency, rate_date, rate in cursor.fetchall():
+        dates, rates = _rate_cache.setdefault(currency, ([], []))
+        dates.append(rate_date)
+        rates.append(rate)
+    conn.close()
+
+def get_exchange_rate(currency, on_date=None):
+    """Курс валюты к базовой на дату (последний известный до нее) или None"""
+    if currency == BASE_CURRENCY:
+        return 1.0
+    if not _rate_cache:
+        _load_rate_cache()
+    if currency not in _rate_cache:
+        return None
+    
+    dates, rates = _rate_cache[currency]
+    index = bisect.bisect_right(dates, on_date or date.today().isoformat())
+    # Для даты раньше всех курсов - самый ранний курс, как в transactions_base
+    return rates[max(index - 1, 0)]
+
+def convert_to_base(amount, currency, on_date=None):
+    """Сумма в базовой валюте или None, если курса нет"""
+    rate = get_exchange_rate(currency, on_date)
+    return None if rate is None else round(amount * rate, 2)
+
+# ========== ВЕРСИЯ ДАННЫХ ==========
+
+# Счетчик увеличивается при каждой записи; кэши используют его как часть ключа
+_data_version = 0
+
+def get_data_version():
+    """Текущая версия данных"""
+    return _data_version
+
+def _bump_data_version():
+    """Отметить изменение данных"""
+    global _data_version
+    _data_version += 1
+
+# ========== ЖУРНАЛ ИЗМЕНЕНИЙ ==========
+
+# Каждое изменение и удаление записи пишется в change_journal той же транзакцией
+# и тем же подключением, что и сам UPDATE: одна выборка по первичному ключу
+# и одна вставка - на скорость записи это почти не влияет
+
+JOURNAL_DEPTH = 50  # сколько последних записей журнала пользователя доступно для отмены
+
+class ConflictError(Exception):
+    """Запись изменили после того, как ее начали редактировать"""
+    
+    def __init__(self, table, record_id):
+        super().__init__(f"{table} #{record_id} изменена параллельно")
+        self.table = table
+        self.record_id = record_id
+
+def _encode_image(values):
+    """Компактный JSON со значениями колонок"""
+    return json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+
+# Поля строки для ответа прямо из UPDATE ... RETURNING - те же, что у выборок.
+# RETURNING читает саму таблицу, а не transactions_base, поэтому сумма в рублях
+# считается тем же выражением, что и в представлении
+RETURNING_COLUMNS = {
+    'transactions': (TRANSACTION_COLUMNS.replace(
+        'base_minor', f"({BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='transactions')})"), TRANSACTION_ROW),
+    'plans': (PLAN_COLUMNS, PLAN_ROW),
+    'planned_purchases': (PURCHASE_COLUMNS, PURCHASE_ROW),
+}
+
+def _update_with_journal(cursor, table, record_id, changes, action='update', ref_id=None,
+                         expected_version=None, expected=None, user_id=None):
+    """UPDATE записи и запись о нем в журнале; возвращает новую строку (models.*) или None, если записи нет.
+    
+    Каждое изменение увеличивает version записи, а UPDATE применяется, только если
+    версия не сменилась с момента выборки (compare-and-swap без блокировки таблицы).
+    expected_version - версия, с которой пользователь начал правку, expected - значения
+    колонок, которые должны быть у записи сейчас; если запись успели изменить,
+    поднимается ConflictError. С user_id меняется только неудаленная запись
+    этого пользователя - владелец проверяется в том же UPDATE.
+    """
+    columns = list(changes)
+    owner_filter, owner_params = ('AND user_id = ? AND is_deleted = 0', (user_id,)) if user_id is not None else ('', ())
+    cursor.execute(f'SELECT user_id, version, {", ".join(columns)} FROM {table} WHERE id = ? {owner_filter}',
+                   (record_id, *owner_params))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    
+    owner_id, version = row[:2]
+    before = dict(zip(columns, row[2:]))
+    if (expected_version is not None and version != expected_version) or \
+            (expected is not None and before != expected):
+        raise ConflictError(table, record_id)
+    
+    returning, row_type = RETURNING_COLUMNS[table]
+    assignments = ', '.join(f'{column} = ?' for column in columns)
+    cursor.row_factory = row_type
+    cursor.execute(f'''
+        UPDATE {table} SET {assignments}, version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND version = ? {owner_filter}
+        RETURNING {returning}
+    ''', (*changes.values(), record_id, version, *owner_params))
+    updated = cursor.fetchone()
+    cursor.row_factory = None
+    if updated is None:
+        # Между выборкой и UPDATE запись изменило другое подключение
+        raise ConflictError(table, record_id)
+    
+    cursor.execute('''
+        INSERT INTO change_journal (user_id, table_name, record_id, action, before, after, ref_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (owner_id, table, record_id, action, _encode_image(before), _encode_image(changes), ref_id))
+    return updated
+
+def _update_record(table, record_id, changes, action='update', expected_version=None, user_id=None):
+    """Изменить запись с записью в журнал одним подключением; возвращает новую строку или None"""
+    if not changes:
+        # Менять нечего - отвечаем записью как есть
+        record = {'transactions': get_transaction, 'plans': get_plan,
+                  'planned_purchases': get_purchase}[table](record_id)
+        return record if record and (user_id is None or record.user_id == user_id) else None
+    
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        updated = _update_with_journal(conn.cursor(), table, record_id, changes, action,
+                                       expected_version=expected_version, user_id=user_id)
+        conn.commit()
+    finally:
+        conn.close()
+    if updated:
+        _bump_data_version()
+    return updated
+
+def get_record_version(table, record_id):
+    """Текущая версия записи (None, если записи нет) - запоминается в начале правки"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT version FROM {table} WHERE id = ?', (record_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def _undo_stacks(cursor, user_id):
+    """Изменения, которые можно отменить, и отмененные, которые можно вернуть"""
+    cursor.row_factory = JOURNAL_ROW
+    cursor.execute(f'''
+        SELECT {JOURNAL_COLUMNS}
+        FROM change_journal
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (user_id, JOURNAL_DEPTH))
+    entries = cursor.fetchall()
+    cursor.row_factory = None
+    
+    done, undone = [], []
+    for entry in reversed(entries):
+        if entry.action in ('undo', 'redo'):
+            source, target = (done, undone) if entry.action == 'undo' else (undone, done)
+            for index, original in enumerate(source):
+                if original.id == entry.ref_id:
+                    target.append(source.pop(index))
+                    break
+        else:
+            # Новое изменение обрывает цепочку возвратов
+            done.append(entry)
+            undone.clear()
+    return done, undone
+
+def _replay_purchase_expense(cursor, entry, action):
+    """Удалить (undo) или вернуть (redo) расход, записанный при отметке покупки entry"""
+    deleted = int(action == 'undo')
+    try:
+        _update_with_journal(cursor, 'transactions', json.loads(entry.after)['transaction_id'],
+                             {'is_deleted': deleted}, action, entry.id, expected={'is_deleted': 1 - deleted})
+    except ConflictError:
+        # Расход уже удалили (или вернули) вручную
+        pass
+
+def _replay_change(user_id, action):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        done, undone = _undo_stacks(cursor, user_id)
+        stack = done if action == 'undo' else undone
+        applied = None
+        while stack:
+            entry = stack.pop()
+            before, after = json.loads(entry.before), json.loads(entry.after)
+            image, current = (before, after) if action == 'undo' else (after, before)
+            # Запись могла уйти в архив или ее успели изменить после этой правки
+            # (например, партнер) - тогда ее не трогаем и переходим к следующему изменению
+            try:
+                if _update_with_journal(cursor, entry.table_name, entry.record_id, image, action, entry.id,
+                                        expected=current):
+                    applied = entry
+                    break
+            except ConflictError:
+                continue
+        if applied and applied.action == 'buy':
+            _replay_purchase_expense(cursor, applied, action)
+        conn.commit()
+    except Exception:
+        # Блокировка записи снимается сразу, а не когда сборщик мусора закроет подключение
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if applied:
+        _bump_data_version()
+    return applied
+
+def undo_last_change(user_id):
+    """Отменить последнее изменение пользователя; возвращает отмененную запись журнала или None"""
+    return _replay_change(user_id, 'undo')
+
+def redo_last_change(user_id):
+    """Вернуть последнее отмененное изменение; возвращает запись журнала или None"""
+    return _replay_change(user_id, 'redo')
+
+def get_change_history(user_id, limit=10):
+    """Последние записи журнала пользователя, новые первыми"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = JOURNAL_ROW
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {JOURNAL_COLUMNS}
+        FROM change_journal
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (user_id, limit))
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
 # ========== ФУНКЦИИ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ==========
 
 def add_user(user_id, username, full_name):
@@ -89,66 +410,82 @@ def add_user(user_id, username, full_name):
     conn.commit()
     conn.close()
 
+def get_user_names():
+    """Получить имена пользователей {id: имя}"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, full_name, username FROM users')
+    results = {user_id: full_name or username or str(user_id)
+               for user_id, full_name, username in cursor.fetchall()}
+    conn.close()
+    return results
+
 # ========== ФУНКЦИИ ДЛЯ ТРАНЗАКЦИЙ ==========
 
-def add_transaction(user_id, trans_type, amount, category, description=None):
-    """Добавить транзакцию (расход/доход)"""
+def add_transaction(user_id, trans_type, amount, category, description=None, currency=BASE_CURRENCY,
+                    split_share=None, trans_date=None):
+    """Добавить транзакцию (расход/доход).
+    
+    split_share - доля расхода партнера в процентах; по умолчанию берется доля категории.
+    trans_date - дата операции ('ГГГГ-ММ-ДД'), по умолчанию сегодня.
+    """
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO transactions (user_id, type, amount, category, description, date)
-        VALUES (?, ?, ?, ?, ?, DATE('now'))
-    ''', (user_id, trans_type, amount, category, description))
+        INSERT INTO transactions (user_id, type, amount, amount_minor, currency, category, description, date,
+                                  split_share)
+        VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, DATE('now')),
+                CASE WHEN ? = 'expense' THEN COALESCE(?, (SELECT share FROM split_defaults WHERE category = ?), 0)
+                ELSE 0 END)
+    ''', (user_id, trans_type, amount, to_minor(amount), currency, category, description, trans_date,
+          trans_type, split_share, category))
     transaction_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _bump_data_version()
     return transaction_id
 
 def get_transaction(transaction_id):
     """Получить конкретную транзакцию"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = TRANSACTION_ROW
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM transactions WHERE id = ? AND is_deleted = 0', (transaction_id,))
+    cursor.execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions_base WHERE id = ? AND is_deleted = 0', (transaction_id,))
     result = cursor.fetchone()
     conn.close()
     return result
 
-def update_transaction(transaction_id, amount=None, category=None, description=None):
-    """Обновить транзакцию"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def update_transaction(transaction_id, amount=None, category=None, description=None, currency=None,
+                       split_share=None, expected_version=None, user_id=None):
+    """Обновить транзакцию; возвращает ее новую строку или None.
     
-    updates = []
-    params = []
+    При expected_version - только если ее не изменили с этой версии,
+    при user_id - только свою и неудаленную.
+    """
+    changes = {}
     
     if amount is not None:
-        updates.append("amount = ?")
-        params.append(amount)
+        changes['amount'] = amount
+        changes['amount_minor'] = to_minor(amount)
+    
+    if currency is not None:
+        changes['currency'] = currency
     
     if category is not None:
-        updates.append("category = ?")
-        params.append(category)
+        changes['category'] = category
     
     if description is not None:
-        updates.append("description = ?")
-        params.append(description)
+        changes['description'] = description
     
-    if updates:
-        updates.append("updated_at = CURRENT_TIMESTAMP")
-        query = f"UPDATE transactions SET {', '.join(updates)} WHERE id = ?"
-        params.append(transaction_id)
-        cursor.execute(query, params)
+    if split_share is not None:
+        changes['split_share'] = split_share
     
-    conn.commit()
-    conn.close()
+    return _update_record('transactions', transaction_id, changes, expected_version=expected_version,
+                          user_id=user_id)
 
-def delete_transaction(transaction_id):
-    """Удалить транзакцию"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE transactions SET is_deleted = 1 WHERE id = ?', (transaction_id,))
-    conn.commit()
-    conn.close()
+def delete_transaction(transaction_id, user_id=None):
+    """Удалить транзакцию (при user_id - только свою); возвращает удаленную строку или None"""
+    return _update_record('transactions', transaction_id, {'is_deleted': 1}, action='delete', user_id=user_id)
 
 def soft_delete_transaction(transaction_id):
     """Мягкое удаление транзакции (алиас для delete_transaction)"""
@@ -157,14 +494,14 @@ def soft_delete_transaction(transaction_id):
 def get_recent_transactions(user_id, limit=5, trans_type=None):
     """Получить последние транзакции"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = TRANSACTION_ROW
     cursor = conn.cursor()
     
     type_filter = f"AND type = '{trans_type}'" if trans_type else ""
     
     cursor.execute(f'''
-        SELECT id, type, amount, category, description, date,
-               strftime('%H:%M', created_at) as time
-        FROM transactions 
+        SELECT {TRANSACTION_COLUMNS}
+        FROM transactions_base 
         WHERE user_id = ? AND is_deleted = 0 {type_filter}
         ORDER BY created_at DESC
         LIMIT ?
@@ -177,33 +514,40 @@ def get_recent_transactions(user_id, limit=5, trans_type=None):
 def get_user_transactions(user_id, period='month', trans_type=None):
     """Получить транзакции пользователя за период"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = TRANSACTION_ROW
     cursor = conn.cursor()
     
     type_filter = f"AND type = '{trans_type}'" if trans_type else ""
     
     if period == 'today':
         cursor.execute(f'''
-            SELECT id, type, amount, category, description,
-                   strftime('%H:%M', created_at) as time
-            FROM transactions 
+            SELECT {TRANSACTION_COLUMNS}
+            FROM transactions_base 
             WHERE user_id = ? AND date = DATE('now') 
             AND is_deleted = 0 {type_filter}
             ORDER BY created_at DESC
         ''', (user_id,))
     elif period == 'month':
         cursor.execute(f'''
-            SELECT id, type, amount, category, description, date,
-                   strftime('%H:%M', created_at) as time
-            FROM transactions 
+            SELECT {TRANSACTION_COLUMNS}
+            FROM transactions_base 
             WHERE user_id = ? AND strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
             AND is_deleted = 0 {type_filter}
             ORDER BY date DESC, created_at DESC
         ''', (user_id,))
+    elif period == 'week':
+        cursor.execute(f'''
+            SELECT {TRANSACTION_COLUMNS}
+            FROM transactions_base 
+            WHERE user_id = ? AND date >= DATE('now', '-7 days')
+            AND is_deleted = 0 {type_filter}
+            ORDER BY date DESC, created_at DESC
+        ''', (user_id,))
     else:
+        # За все время - вместе с архивом
         cursor.execute(f'''
-            SELECT id, type, amount, category, description, date,
-                   strftime('%Y-%m-%d %H:%M', created_at) as datetime
-            FROM transactions 
+            SELECT {TRANSACTION_COLUMNS}
+            FROM transactions_history 
             WHERE user_id = ? AND is_deleted = 0 {type_filter}
             ORDER BY date DESC, created_at DESC
             LIMIT 50
@@ -226,87 +570,110 @@ def add_plan(user_id, title, description, plan_date, time=None, category='лич
     plan_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _bump_data_version()
     return plan_id
 
 def get_plan(plan_id):
     """Получить конкретный план"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PLAN_ROW
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM plans WHERE id = ? AND is_deleted = 0', (plan_id,))
+    cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans WHERE id = ? AND is_deleted = 0', (plan_id,))
     result = cursor.fetchone()
     conn.close()
     return result
 
-def update_plan(plan_id, title=None, description=None, date=None, time=None, category=None, is_shared=None):
-    """Обновить план"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def update_plan(plan_id, title=None, description=None, date=None, time=None, category=None, is_shared=None,
+                expected_version=None, user_id=None):
+    """Обновить план; возвращает его новую строку или None.
     
-    updates = []
-    params = []
+    При expected_version - только если его не изменили с этой версии,
+    при user_id - только свой и неудаленный.
+    """
+    changes = {}
     
     if title is not None:
-        updates.append("title = ?")
-        params.append(title)
+        changes['title'] = title
     
     if description is not None:
-        updates.append("description = ?")
-        params.append(description)
+        changes['description'] = description
     
     if date is not None:
-        updates.append("date = ?")
-        params.append(date)
+        changes['date'] = date
     
     if time is not None:
-        updates.append("time = ?")
-        params.append(time)
+        changes['time'] = time
     
     if category is not None:
-        updates.append("category = ?")
-        params.append(category)
+        changes['category'] = category
     
     if is_shared is not None:
-        updates.append("is_shared = ?")
-        params.append(int(is_shared))
+        changes['is_shared'] = int(is_shared)
     
-    if updates:
-        updates.append("updated_at = CURRENT_TIMESTAMP")
-        query = f"UPDATE plans SET {', '.join(updates)} WHERE id = ?"
-        params.append(plan_id)
-        cursor.execute(query, params)
-    
-    conn.commit()
-    conn.close()
+    return _update_record('plans', plan_id, changes, expected_version=expected_version, user_id=user_id)
 
-def delete_plan(plan_id):
-    """Удалить план"""
+def delete_plan(plan_id, user_id=None):
+    """Удалить план (при user_id - только свой); возвращает удаленную строку или None"""
+    return _update_record('plans', plan_id, {'is_deleted': 1}, action='delete', user_id=user_id)
+
+def toggle_plan_shared(plan_id, user_id):
+    """Переключить общий статус своего плана; возвращает новую строку плана или None"""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute('UPDATE plans SET is_deleted = 1 WHERE id = ?', (plan_id,))
-    conn.commit()
-    conn.close()
+    # Текущее значение и UPDATE - в одной транзакции записи, чтобы второе
+    # переключение не прочитало тот же статус
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('SELECT is_shared FROM plans WHERE id = ? AND user_id = ? AND is_deleted = 0',
+                       (plan_id, user_id))
+        row = cursor.fetchone()
+        plan = row and _update_with_journal(cursor, 'plans', plan_id, {'is_shared': int(not row[0])},
+                                            user_id=user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if plan:
+        _bump_data_version()
+    return plan
+
+# Планы, которые видит пользователь: свои и общие планы партнера. UNION ALL двух
+# выборок по частичным индексам читает только нужные строки, а "(user_id = ? OR
+# is_shared = 1)" идет по idx_plans_date и отбрасывает личные планы партнера на эти
+# даты. Окно в день-неделю - десятки строк, так что разница заметна только на сотнях
+# тысяч планов (bench_plans.py). Свои общие планы попадают только в первую часть
+VISIBLE_PLANS_SQL = f'''
+    SELECT {PLAN_COLUMNS}
+    FROM plans
+    WHERE user_id = :user_id AND date BETWEEN :date_from AND :date_to AND is_deleted = 0
+    UNION ALL
+    SELECT {PLAN_COLUMNS}
+    FROM plans
+    WHERE date BETWEEN :date_from AND :date_to AND is_shared = 1 AND is_deleted = 0
+    AND user_id != :user_id
+    ORDER BY date, time NULLS FIRST, id
+    LIMIT :limit
+'''
 
-def get_user_plans(user_id, target_date=None):
-    """Получить планы пользователя"""
+def get_visible_plans(user_id, date_from, date_to=None, limit=None):
+    """Свои и общие планы пользователя с date_from по date_to включительно (без date_to - все следующие)"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PLAN_ROW
     cursor = conn.cursor()
-    
-    if not target_date:
-        target_date = date.today().isoformat()
-    
-    cursor.execute('''
-        SELECT id, title, description, date, time, category, is_shared
-        FROM plans 
-        WHERE (user_id = ? OR is_shared = 1)
-        AND date = ? 
-        AND is_deleted = 0
-        ORDER BY time NULLS FIRST, created_at
-    ''', (user_id, target_date))
-    
+    cursor.execute(VISIBLE_PLANS_SQL, {'user_id': user_id, 'date_from': date_from,
+                                       'date_to': date_to or '9999-12-31', 'limit': limit or -1})
     results = cursor.fetchall()
     conn.close()
     return results
 
+def get_user_plans(user_id, target_date=None, limit=None):
+    """Получить планы пользователя на дату (по умолчанию - сегодня)"""
+    if not target_date:
+        target_date = date.today().isoformat()
+    return get_visible_plans(user_id, target_date, target_date, limit)
+
 def get_recent_plans(user_id, limit=5):
     """Получить последние планы"""
     conn = sqlite3.connect(DB_PATH)
@@ -324,20 +691,21 @@ def get_recent_plans(user_id, limit=5):
     conn.close()
     return results
 
-def get_shared_plans():
-    """Получить общие планы"""
+SHARED_PLANS_LIMIT = 30  # столько общих планов помещается в одно сообщение
+
+def get_shared_plans(date_from=None, date_to=None, limit=SHARED_PLANS_LIMIT):
+    """Получить ближайшие общие планы (по умолчанию - начиная с сегодняшнего дня)"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PLAN_ROW
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT p.*, u.username, u.full_name 
-        FROM plans p
-        JOIN users u ON p.user_id = u.id
-        WHERE p.is_shared = 1
-        AND p.is_deleted = 0
-        AND p.date >= DATE('now')
-        ORDER BY p.date, p.time NULLS FIRST
-    ''')
+    cursor.execute(f'''
+        SELECT {PLAN_COLUMNS}
+        FROM plans
+        WHERE date BETWEEN ? AND ? AND is_shared = 1 AND is_deleted = 0
+        ORDER BY date, time NULLS FIRST
+        LIMIT ?
+    ''', (date_from or date.today().isoformat(), date_to or '9999-12-31', limit or -1))
     
     results = cursor.fetchall()
     conn.close()
@@ -350,91 +718,82 @@ def add_planned_purchase(user_id, item_name, estimated_cost, priority, target_da
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO planned_purchases (user_id, item_name, estimated_cost, priority, target_date, notes)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, item_name, estimated_cost, priority, target_date, notes))
+        INSERT INTO planned_purchases (user_id, item_name, estimated_cost, estimated_cost_minor,
+                                       priority, target_date, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, item_name, estimated_cost, to_minor(estimated_cost), priority, target_date, notes))
     purchase_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _bump_data_version()
     return purchase_id
 
 def get_purchase(purchase_id):
     """Получить конкретную покупку"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PURCHASE_ROW
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM planned_purchases WHERE id = ? AND is_deleted = 0', (purchase_id,))
+    cursor.execute(f'SELECT {PURCHASE_COLUMNS} FROM planned_purchases WHERE id = ? AND is_deleted = 0', (purchase_id,))
     result = cursor.fetchone()
     conn.close()
     return result
 
 def update_purchase(purchase_id, item_name=None, estimated_cost=None, priority=None, 
-                   target_date=None, notes=None, status=None):
-    """Обновить покупку"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+                   target_date=None, notes=None, status=None, expected_version=None, user_id=None):
+    """Обновить покупку; возвращает ее новую строку или None.
     
-    updates = []
-    params = []
+    При expected_version - только если ее не изменили с этой версии,
+    при user_id - только свою и неудаленную.
+    """
+    changes = {}
     
     if item_name is not None:
-        updates.append("item_name = ?")
-        params.append(item_name)
+        changes['item_name'] = item_name
     
     if estimated_cost is not None:
-        updates.append("estimated_cost = ?")
-        params.append(estimated_cost)
+        changes['estimated_cost'] = estimated_cost
+        changes['estimated_cost_minor'] = to_minor(estimated_cost)
     
     if priority is not None:
-        updates.append("priority = ?")
-        params.append(priority)
+        changes['priority'] = priority
     
     if target_date is not None:
-        updates.append("target_date = ?")
-        params.append(target_date)
+        changes['target_date'] = target_date
     
     if notes is not None:
-        updates.append("notes = ?")
-        params.append(notes)
+        changes['notes'] = notes
     
     if status is not None:
-        updates.append("status = ?")
-        params.append(status)
+        changes['status'] = status
     
-    if updates:
-        updates.append("updated_at = CURRENT_TIMESTAMP")
-        query = f"UPDATE planned_purchases SET {', '.join(updates)} WHERE id = ?"
-        params.append(purchase_id)
-        cursor.execute(query, params)
-    
-    conn.commit()
-    conn.close()
+    return _update_record('planned_purchases', purchase_id, changes, expected_version=expected_version,
+                          user_id=user_id)
 
-def delete_purchase(purchase_id):
-    """Удалить покупку"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE planned_purchases SET is_deleted = 1 WHERE id = ?', (purchase_id,))
-    conn.commit()
-    conn.close()
+def delete_purchase(purchase_id, user_id=None):
+    """Удалить покупку (при user_id - только свою); возвращает удаленную строку или None"""
+    return _update_record('planned_purchases', purchase_id, {'is_deleted': 1}, action='delete',
+                          user_id=user_id)
+
+# Порядок экрана покупок: по приоритету, затем по сроку
+USER_PURCHASES_SQL = f'''
+    SELECT {PURCHASE_COLUMNS}
+    FROM planned_purchases 
+    WHERE user_id = ? AND status = ? AND is_deleted = 0
+    ORDER BY 
+        CASE priority 
+            WHEN 'high' THEN 1
+            WHEN 'medium' THEN 2
+            WHEN 'low' THEN 3
+        END,
+        target_date NULLS LAST
+'''
 
 def get_user_purchases(user_id, status='planned'):
     """Получить покупки пользователя"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PURCHASE_ROW
     cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, item_name, estimated_cost, priority, target_date, notes, status
-        FROM planned_purchases 
-        WHERE user_id = ? AND status = ? AND is_deleted = 0
-        ORDER BY 
-            CASE priority 
-                WHEN 'high' THEN 1
-                WHEN 'medium' THEN 2
-                WHEN 'low' THEN 3
-            END,
-            target_date NULLS LAST
-    ''', (user_id, status))
-    
+    cursor.execute(USER_PURCHASES_SQL, (user_id, status))
     results = cursor.fetchall()
     conn.close()
     return results
@@ -445,7 +804,7 @@ def get_recent_purchases(user_id, limit=5):
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT id, item_name, estimated_cost, priority, target_date, notes
+        SELECT id, item_name, estimated_cost_minor / 100.0 AS estimated_cost, priority, target_date, notes
         FROM planned_purchases 
         WHERE user_id = ? AND is_deleted = 0
         ORDER BY created_at DESC
@@ -456,18 +815,349 @@ def get_recent_purchases(user_id, limit=5):
     conn.close()
     return results
 
+# ========== НАКОПЛЕНИЯ ==========
+
+NET_FLOW_MONTHS = 3  # за сколько закрытых месяцев усредняется свободный поток
+
+_CONTRIBUTION_BASE_SQL = BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='c')
+
+def add_savings_contribution(user_id, purchase_id, amount, currency=BASE_CURRENCY):
+    """Отложить деньги на свою планируемую покупку; возвращает (новая строка покупки, id взноса) или None.
+    
+    Взнос - не расход: отложенные деньги остаются у пары, поэтому он пишется в
+    savings_contributions и в статистику расходов не попадает. Сумма в базовой
+    валюте фиксируется при записи, накопленное покупки обновляет триггер.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        INSERT INTO savings_contributions (purchase_id, user_id, amount_minor, currency, base_minor, date)
+        SELECT p.id, p.user_id, c.amount_minor, c.currency, COALESCE(({_CONTRIBUTION_BASE_SQL}), 0), c.date
+        FROM (SELECT ? AS amount_minor, ? AS currency, DATE('now') AS date) c, planned_purchases p
+        WHERE p.id = ? AND p.user_id = ? AND p.status = 'planned' AND p.is_deleted = 0
+    ''', (to_minor(amount), currency, purchase_id, user_id))
+    if cursor.rowcount == 0:
+        conn.close()
+        return None
+    contribution_id = cursor.lastrowid
+
+    conn.row_factory = PURCHASE_ROW
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {PURCHASE_COLUMNS} FROM planned_purchases WHERE id = ?', (purchase_id,))
+    purchase = cursor.fetchone()
+    conn.commit()
+    conn.close()
+    _bump_data_version()
+    return purchase, contribution_id
+
+def remove_savings_contribution(contribution_id, user_id):
+    """Отменить свой взнос на еще не купленную покупку; возвращает новую строку покупки или None"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM savings_contributions
+        WHERE id = ? AND user_id = ?
+          AND purchase_id IN (SELECT id FROM planned_purchases WHERE status = 'planned' AND is_deleted = 0)
+        RETURNING purchase_id
+    ''', (contribution_id, user_id))
+    row = cursor.fetchone()
+    if row is None:
+        conn.close()
+        return None
+
+    conn.row_factory = PURCHASE_ROW
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {PURCHASE_COLUMNS} FROM planned_purchases WHERE id = ?', row)
+    purchase = cursor.fetchone()
+    conn.commit()
+    conn.close()
+    _bump_data_version()
+    return purchase
+
+def get_savings_goals(user_id, months=NET_FLOW_MONTHS):
+    """Планируемые покупки пользователя и его средний свободный поток в месяц.
+    
+    Поток - доходы минус расходы за months последних закрытых месяцев.
+    Накопленное и поток поддерживаются триггерами, поэтому здесь только чтение по индексам.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COALESCE(SUM(income_minor - expense_minor), 0) / 100.0 / ?
+        FROM monthly_cash_flow
+        WHERE user_id = ?
+          AND month >= strftime('%Y-%m', 'now', 'start of month', ?)
+          AND month < strftime('%Y-%m', 'now')
+    ''', (months, user_id, f'-{months} months'))
+    monthly_net = cursor.fetchone()[0]
+
+    conn.row_factory = PURCHASE_ROW
+    cursor = conn.cursor()
+    cursor.execute(USER_PURCHASES_SQL, (user_id, 'planned'))
+    purchases = cursor.fetchall()
+    conn.close()
+    return purchases, monthly_net
+
+# ========== РАЗДЕЛ РАСХОДОВ ==========
+
+SPLIT_STEPS = (0, 50, 100)  # доли партнера, по которым переключается кнопка "👫 Разделить"
+
+def cycle_transaction_split(transaction_id, user_id):
+    """Следующая доля партнера (по SPLIT_STEPS) для своего расхода; возвращает новую строку или None"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    # Как у toggle_plan_shared: чтение доли и UPDATE в одной транзакции записи,
+    # поэтому два нажатия подряд не прочитают одну и ту же долю
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT split_share FROM transactions
+            WHERE id = ? AND user_id = ? AND type = 'expense' AND is_deleted = 0
+        ''', (transaction_id, user_id))
+        row = cursor.fetchone()
+        if row:
+            share = next((step for step in SPLIT_STEPS if step > row[0]), SPLIT_STEPS[0])
+        transaction = row and _update_with_journal(cursor, 'transactions', transaction_id, {'split_share': share},
+                                                   user_id=user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if transaction:
+        _bump_data_version()
+    return transaction
+
+def get_split_defaults():
+    """Доли партнера по умолчанию: {категория: процент}"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT category, share FROM split_defaults ORDER BY category')
+    defaults = dict(cursor.fetchall())
+    conn.close()
+    return defaults
+
+def set_split_default(category, share):
+    """Задать долю партнера для новых расходов категории (0 - не делить)"""
+    conn = sqlite3.connect(DB_PATH)
+    if share:
+        conn.execute('''
+            INSERT INTO split_defaults (category, share) VALUES (?, ?)
+            ON CONFLICT (category) DO UPDATE SET share = excluded.share
+        ''', (category, share))
+    else:
+        conn.execute('DELETE FROM split_defaults WHERE category = ?', (category,))
+    conn.commit()
+    conn.close()
+
+def get_settle_balance(user_id, partner_id):
+    """Сколько партнер должен пользователю (отрицательное - пользователь партнеру).
+    
+    Баланс ведут триггеры на transactions и settlements, поэтому это чтение двух строк.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COALESCE(SUM(CASE WHEN user_id = ? THEN credit_minor ELSE -credit_minor END), 0) / 100.0
+        FROM split_ledger WHERE user_id IN (?, ?)
+    ''', (user_id, user_id, partner_id))
+    balance = cursor.fetchone()[0]
+    conn.close()
+    return balance
+
+def get_split_flows():
+    """Потоки по разделенным расходам: [(user_id, заплачено за других, переведено в расчет)] в копейках.
+    
+    Один агрегат по операциям (и архиву), переводам и списку пользователей: каждый
+    участник домохозяйства попадает в выборку, даже если еще ничего не делил.
+    Разделенные расходы читаются по частичным индексам idx_*_split.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT user_id, SUM(paid), SUM(transferred)
+        FROM (
+            SELECT user_id, split_minor AS paid, 0 AS transferred
+            FROM transactions WHERE is_deleted = 0 AND split_minor != 0
+            UNION ALL
+            SELECT user_id, split_minor, 0
+            FROM transactions_archive WHERE is_deleted = 0 AND split_minor != 0
+            UNION ALL
+            SELECT from_user, 0, amount_minor FROM settlements
+            UNION ALL
+            SELECT to_user, 0, -amount_minor FROM settlements
+            UNION ALL
+            SELECT id, 0, 0 FROM users
+        )
+        GROUP BY user_id
+    ''')
+    flows = cursor.fetchall()
+    conn.close()
+    return flows
+
+def record_settlements(transfers):
+    """Записать переводы расчета [(кто платит, кому, сумма)] одной транзакцией; возвращает их число"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    # Весь план - одна транзакция записи: сбой посреди плана не оставит долг закрытым
+    # наполовину, а версия данных меняется один раз
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.executemany('INSERT INTO settlements (from_user, to_user, amount_minor) VALUES (?, ?, ?)',
+                           [(from_user, to_user, to_minor(amount)) for from_user, to_user, amount in transfers])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if transfers:
+        _bump_data_version()
+    return len(transfers)
+
+# ========== СВЕРКА ПОКУПОК ==========
+
+PURCHASE_MATCH_DAYS = 14          # на сколько дней расход может отстоять от отметки о покупке
+PURCHASE_MATCH_TOLERANCE = 0.15   # отличие суммы от стоимости для расхода с названием покупки
+PURCHASE_MATCH_EXACT = 0.01       # ... и для расхода без него
+PURCHASE_CATEGORY = 'Другое'      # категория расхода, записанного при отметке о покупке
+
+_MATCH_BASE_SQL = BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='t')
+
+def _name_tokens(text):
+    return set(re.findall(r'\w{3,}', (text or '').lower()))
+
+def _find_purchase_match(cursor, user_id, item_name, cost_minor, bought_on):
+    """id расхода, которым, видимо, оплачена покупка, или None.
+    
+    Кандидаты - еще не связанные расходы пользователя в окне дат вокруг покупки:
+    выборка идет по покрывающему индексу (user_id, type, date, ..., amount_minor).
+    Расход с названием покупки в описании подходит при сумме в пределах
+    PURCHASE_MATCH_TOLERANCE, без него - только почти точная сумма. Из подходящих
+    берется расход с названием, затем с ближайшей суммой и датой.
+    """
+    if not cost_minor:
+        return None
+    window = f'{PURCHASE_MATCH_DAYS} days'
+    low, high = cost_minor * (1 - PURCHASE_MATCH_TOLERANCE), cost_minor * (1 + PURCHASE_MATCH_TOLERANCE)
+    # Рублевые суммы отсекаются по amount_minor прямо в индексе, курс
+    # считается только для валютных операций из окна
+    cursor.execute(f'''
+        SELECT t.id, t.description, {_MATCH_BASE_SQL}, julianday(t.date) - julianday(?)
+        FROM transactions t
+        WHERE t.user_id = ? AND t.type = 'expense' AND t.is_deleted = 0
+          AND t.date BETWEEN date(?, '-' || ?) AND date(?, '+' || ?)
+          AND (t.currency != ? OR t.amount_minor BETWEEN ? AND ?)
+          AND {_MATCH_BASE_SQL} BETWEEN ? AND ?
+          AND NOT EXISTS (SELECT 1 FROM planned_purchases p WHERE p.transaction_id = t.id)
+    ''', (bought_on, user_id, bought_on, window, bought_on, window, BASE_CURRENCY, low, high, low, high))
+
+    tokens = _name_tokens(item_name)
+    best, best_score = None, None
+    for transaction_id, description, base_minor, days in cursor.fetchall():
+        named = bool(tokens & _name_tokens(description))
+        amount_gap = abs(base_minor - cost_minor) / cost_minor
+        if not named and amount_gap > PURCHASE_MATCH_EXACT:
+            continue
+        score = (not named, amount_gap, abs(days))
+        if best_score is None or score < best_score:
+            best, best_score = transaction_id, score
+    return best
+
+def complete_purchase(purchase_id, user_id):
+    """Отметить свою покупку купленной и связать с расходом.
+    
+    Возвращает (покупка, расход, записан ли расход заново) или None, если покупки нет
+    или она уже куплена. Если подходящего расхода нет, он записывается на плановую
+    стоимость сегодняшним числом с долей партнера категории PURCHASE_CATEGORY. Отложенные на покупку деньги расходами не были
+    (savings_contributions), поэтому они входят в этот расход один раз, а не
+    добавляются к нему. Отмена (/undo) возвращает покупку в план и снимает связь,
+    а расход, записанный при отметке, удаляет тем же шагом.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    # Поиск расхода и связь - в одной транзакции записи: две одновременные
+    # отметки не свяжут один расход с двумя покупками
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT item_name, estimated_cost_minor FROM planned_purchases
+            WHERE id = ? AND user_id = ? AND status = 'planned' AND is_deleted = 0
+        ''', (purchase_id, user_id))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        
+        item_name, cost_minor = row
+        transaction_id = _find_purchase_match(cursor, user_id, item_name, cost_minor, date.today().isoformat())
+        created = transaction_id is None
+        if created:
+            cursor.execute('''
+                INSERT INTO transactions (user_id, type, amount, amount_minor, currency, category, description, date,
+                                          split_share)
+                VALUES (?, 'expense', ?, ?, ?, ?, ?, DATE('now'),
+                        COALESCE((SELECT share FROM split_defaults WHERE category = ?), 0))
+            ''', (user_id, (cost_minor or 0) / MINOR_UNITS, cost_minor or 0, BASE_CURRENCY, PURCHASE_CATEGORY,
+                  item_name, PURCHASE_CATEGORY))
+            transaction_id = cursor.lastrowid
+        
+        # Действие 'buy' говорит отмене, что расход записан вместе с отметкой
+        # и удаляется вместе с ней
+        purchase = _update_with_journal(cursor, 'planned_purchases', purchase_id,
+                                        {'status': 'bought', 'transaction_id': transaction_id},
+                                        action='buy' if created else 'update', user_id=user_id)
+        conn.commit()
+    finally:
+        conn.close()
+    _bump_data_version()
+    return purchase, get_transaction(transaction_id), created
+
+def reconcile_purchases():
+    """Связать с расходами покупки, отмеченные купленными без связи; возвращает число связанных.
+    
+    Датой покупки считается дата последнего изменения записи - обычно это отметка
+    о покупке. Покупки разбираются по порядку отметок, и каждая забирает лучший
+    из еще свободных расходов; для неподходящих расходы не создаются.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT id, user_id, item_name, estimated_cost_minor, date(updated_at) FROM planned_purchases
+            WHERE status = 'bought' AND transaction_id IS NULL AND is_deleted = 0
+            ORDER BY updated_at, id
+        ''')
+        linked = 0
+        for purchase_id, user_id, item_name, cost_minor, bought_on in cursor.fetchall():
+            transaction_id = _find_purchase_match(cursor, user_id, item_name, cost_minor, bought_on)
+            if transaction_id is not None:
+                cursor.execute('''
+                    UPDATE planned_purchases SET transaction_id = ?, version = version + 1 WHERE id = ?
+                ''', (transaction_id, purchase_id))
+                linked += 1
+        conn.commit()
+    finally:
+        conn.close()
+    if linked:
+        _bump_data_version()
+    return linked
+
 # ========== ФУНКЦИИ ПОИСКА ТРАНЗАКЦИЙ ==========
 
 def search_transactions(user_id, trans_type=None, description=None, category=None, 
                        min_amount=None, max_amount=None, date_filter=None):
     """Поиск транзакций по фильтрам"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = TRANSACTION_ROW
     cursor = conn.cursor()
     
-    query = '''
-        SELECT id, type, amount, category, description, date,
-               strftime('%H:%M', created_at) as time
-        FROM transactions 
+    # Поиск за последние дни идет по рабочей таблице, остальной - по всей истории с архивом
+    source = 'transactions_base' if date_filter in ('сегодня', 'неделя', 'месяц') else 'transactions_history'
+    query = f'''
+        SELECT {TRANSACTION_COLUMNS}
+        FROM {source} 
         WHERE user_id = ? AND is_deleted = 0
     '''
     params = [user_id]
@@ -485,12 +1175,12 @@ def search_transactions(user_id, trans_type=None, description=None, category=Non
         params.append(category)
     
     if min_amount is not None:
-        query += " AND amount >= ?"
-        params.append(min_amount)
+        query += " AND amount_minor >= ?"
+        params.append(to_minor(min_amount))
     
     if max_amount is not None:
-        query += " AND amount <= ?"
-        params.append(max_amount)
+        query += " AND amount_minor <= ?"
+        params.append(to_minor(max_amount))
     
     if date_filter:
         if date_filter == 'сегодня':
@@ -521,10 +1211,11 @@ def search_plans(user_id, search_text=None, category=None, date_from=None,
                 date_to=None, is_shared=None):
     """Поиск планов по фильтрам"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PLAN_ROW
     cursor = conn.cursor()
     
-    query = '''
-        SELECT id, title, description, date, time, category, is_shared
+    query = f'''
+        SELECT {PLAN_COLUMNS}
         FROM plans 
         WHERE user_id = ? AND is_deleted = 0
     '''
@@ -565,10 +1256,11 @@ def search_purchases(user_id, search_text=None, priority=None, status=None,
                     min_cost=None, max_cost=None):
     """Поиск покупок по фильтрам"""
     conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = PURCHASE_ROW
     cursor = conn.cursor()
     
-    query = '''
-        SELECT id, item_name, estimated_cost, priority, target_date, notes, status
+    query = f'''
+        SELECT {PURCHASE_COLUMNS}
         FROM planned_purchases 
         WHERE user_id = ? AND is_deleted = 0
     '''
@@ -588,12 +1280,12 @@ def search_purchases(user_id, search_text=None, priority=None, status=None,
         params.append(status)
     
     if min_cost is not None:
-        query += " AND estimated_cost >= ?"
-        params.append(min_cost)
+        query += " AND estimated_cost_minor >= ?"
+        params.append(to_minor(min_cost))
     
     if max_cost is not None:
-        query += " AND estimated_cost <= ?"
-        params.append(max_cost)
+        query += " AND estimated_cost_minor <= ?"
+        params.append(to_minor(max_cost))
     
     query += " ORDER BY "
     query += '''
@@ -612,6 +1304,121 @@ def search_purchases(user_id, search_text=None, priority=None, status=None,
     return results
 
 
+# ========== ГЛАВНЫЙ ЭКРАН ==========
+
+def get_dashboard_snapshot(user_id, limit=3):
+    """Последние расходы и доходы, ближайшие планы и главные покупки за одно подключение"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    # Все выборки читаются в одной транзакции, поэтому видят одно и то же состояние базы
+    cursor.execute('BEGIN')
+    
+    snapshot = {}
+    for trans_type, key in (('expense', 'expenses'), ('income', 'incomes')):
+        cursor.row_factory = TRANSACTION_ROW
+        cursor.execute(f'''
+            SELECT {TRANSACTION_COLUMNS}
+            FROM transactions_base 
+            WHERE user_id = ? AND type = ? AND is_deleted = 0
+            ORDER BY date DESC, created_at DESC, id DESC
+            LIMIT ?
+        ''', (user_id, trans_type, limit))
+        snapshot[key] = cursor.fetchall()
+    
+    cursor.row_factory = PLAN_ROW
+    cursor.execute(VISIBLE_PLANS_SQL, {'user_id': user_id, 'date_from': date.today().isoformat(),
+                                       'date_to': '9999-12-31', 'limit': limit})
+    snapshot['plans'] = cursor.fetchall()
+    
+    cursor.row_factory = PURCHASE_ROW
+    cursor.execute(f'''
+        SELECT {PURCHASE_COLUMNS}
+        FROM planned_purchases 
+        WHERE user_id = ? AND status = 'planned' AND is_deleted = 0
+        ORDER BY 
+            CASE priority 
+                WHEN 'high' THEN 1
+                WHEN 'medium' THEN 2
+                WHEN 'low' THEN 3
+            END,
+            target_date NULLS LAST
+        LIMIT ?
+    ''', (user_id, limit))
+    snapshot['purchases'] = cursor.fetchall()
+    
+    conn.commit()
+    conn.close()
+    return snapshot
+
+# ========== ЗАКРЫТЫЕ ПЕРИОДЫ ==========
+
+# Итоги прошлых месяцев не меняются, пока в них не попадет запись задним числом:
+# они хранятся в period_totals, и запросы "за все время" и тренды читают
+# операции только текущего месяца. Триггеры (migration.migrate_closed_periods)
+# снимают отметку месяца в closed_periods, а читающий пересчитывает его заново
+
+# Замороженные итоги актуальных закрытых месяцев и начало открытого периода
+CLOSED_TOTALS_SQL = 'SELECT * FROM period_totals WHERE month IN (SELECT month FROM closed_periods)'
+OPEN_PERIOD_START = "strftime('%Y-%m-01', 'now')"
+
+def _stale_periods(cursor):
+    """Прошедшие месяцы с операциями, итоги которых не заморожены или устарели"""
+    # Месяцы с операциями известны из monthly_cash_flow, который ведут триггеры
+    cursor.execute('''
+        SELECT DISTINCT f.month FROM monthly_cash_flow f
+        WHERE f.month < strftime('%Y-%m', 'now')
+          AND NOT EXISTS (SELECT 1 FROM closed_periods c WHERE c.month = f.month)
+        ORDER BY f.month
+    ''')
+    return [row[0] for row in cursor.fetchall()]
+
+def _freeze_period(cursor, month):
+    """Пересчитать итоги месяца по рабочей таблице и отметить их актуальными"""
+    cursor.execute('DELETE FROM period_totals WHERE month = ?', (month,))
+    cursor.execute('''
+        INSERT INTO period_totals (month, user_id, type, category, total_minor, count)
+        SELECT ?, user_id, type, COALESCE(category, ''), COALESCE(SUM(base_minor), 0), COUNT(*)
+        FROM transactions_base
+        WHERE user_id IN (SELECT user_id FROM monthly_cash_flow WHERE month = ?)
+          AND type IN ('income', 'expense')
+          AND date BETWEEN ? || '-01' AND ? || '-31' AND is_deleted = 0
+        GROUP BY user_id, type, COALESCE(category, '')
+    ''', (month, month, month, month))
+    cursor.execute('INSERT INTO closed_periods (month) VALUES (?)', (month,))
+
+def _begin_closed_read(conn):
+    """Начать транзакцию, в которой итоги всех закрытых месяцев заморожены; возвращает курсор.
+    
+    Обычно это одно чтение по маленьким таблицам. Если месяцы устарели, транзакция
+    становится пишущей и пересчитывает их, а запрос вызывающего выполняется в той же
+    транзакции - запись задним числом не может вклиниться между пересчетом и чтением.
+    """
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    if _stale_periods(cursor):
+        conn.rollback()
+        cursor.execute('BEGIN IMMEDIATE')
+        for month in _stale_periods(cursor):
+            _freeze_period(cursor, month)
+    return cursor
+
+def get_closed_periods():
+    """Замороженные закрытые месяцы: {месяц: generation}.
+    
+    generation меняется при каждом пересчете месяца - по нему кэши в памяти
+    понимают, что итоги месяца изменились задним числом.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = _begin_closed_read(conn)
+        cursor.execute('SELECT month, generation FROM closed_periods')
+        periods = dict(cursor.fetchall())
+        conn.commit()
+    finally:
+        conn.close()
+    return periods
+
 # ========== СТАТИСТИКА ==========
 
 def get_period_statistics(user_id, period='month'):
@@ -622,41 +1429,63 @@ def get_period_statistics(user_id, period='month'):
     if period == 'today':
         cursor.execute('''
             SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) / 100.0 as total_income,
+                SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0 as total_expense,
                 COUNT(*) as count
-            FROM transactions 
+            FROM transactions_base 
             WHERE user_id = ? AND date = DATE('now') AND is_deleted = 0
         ''', (user_id,))
     elif period == 'week':
         cursor.execute('''
             SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) / 100.0 as total_income,
+                SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0 as total_expense,
                 COUNT(*) as count
-            FROM transactions 
+            FROM transactions_base 
             WHERE user_id = ? AND date >= DATE('now', '-7 days') AND is_deleted = 0
         ''', (user_id,))
     elif period == 'month':
         cursor.execute('''
             SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) / 100.0 as total_income,
+                SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0 as total_expense,
                 COUNT(*) as count
-            FROM transactions 
+            FROM transactions_base 
             WHERE user_id = ? AND strftime('%Y-%m', date) = strftime('%Y-%m', 'now') AND is_deleted = 0
         ''', (user_id,))
     elif period == 'all':
-        cursor.execute('''
-            SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
-                COUNT(*) as count
-            FROM transactions 
-            WHERE user_id = ? AND is_deleted = 0
-        ''', (user_id,))
+        # Операции текущего месяца, замороженные итоги закрытых и итоги перенесенной в архив истории
+        cursor = _begin_closed_read(conn)
+        cursor.execute(f'''
+            SELECT SUM(income) / 100.0 as total_income, SUM(expense) / 100.0 as total_expense,
+                   SUM(count) as count
+            FROM (
+                SELECT 
+                    SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) as income,
+                    SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) as expense,
+                    COUNT(*) as count
+                FROM transactions_base 
+                WHERE user_id = ? AND type IN ('income', 'expense') AND date >= {OPEN_PERIOD_START}
+                AND is_deleted = 0
+                UNION ALL
+                SELECT 
+                    SUM(CASE WHEN type = 'income' THEN total_minor ELSE 0 END),
+                    SUM(CASE WHEN type = 'expense' THEN total_minor ELSE 0 END),
+                    SUM(count)
+                FROM ({CLOSED_TOTALS_SQL})
+                WHERE user_id = ?
+                UNION ALL
+                SELECT 
+                    SUM(CASE WHEN type = 'income' THEN total_minor ELSE 0 END),
+                    SUM(CASE WHEN type = 'expense' THEN total_minor ELSE 0 END),
+                    SUM(count)
+                FROM transaction_rollups 
+                WHERE user_id = ?
+            )
+        ''', (user_id, user_id, user_id))
     
     result = cursor.fetchone()
+    conn.commit()
     conn.close()
     return result
 
@@ -669,9 +1498,9 @@ def get_daily_combined_expenses():
         SELECT 
             u.full_name,
             t.category,
-            t.amount,
+            t.base_minor / 100.0 AS amount,
             t.description
-        FROM transactions t
+        FROM transactions_base t
         JOIN users u ON t.user_id = u.id
         WHERE t.date = DATE('now') 
         AND t.type = 'expense'
@@ -692,9 +1521,9 @@ def get_common_categories_statistics():
     cursor.execute('''
         SELECT 
             category,
-            SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+            SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0 as total_expense,
             COUNT(*) as transaction_count
-        FROM transactions 
+        FROM transactions_base 
         WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
         AND user_id IN (?, ?) AND is_deleted = 0
         GROUP BY category
@@ -714,11 +1543,11 @@ def get_monthly_comparison():
     cursor.execute('''
         SELECT 
             u.full_name,
-            SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END) as total_income,
-            SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END) as total_expense,
-            (SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END) - 
-             SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END)) as balance
-        FROM transactions t
+            SUM(CASE WHEN t.type = 'income' THEN t.base_minor ELSE 0 END) / 100.0 as total_income,
+            SUM(CASE WHEN t.type = 'expense' THEN t.base_minor ELSE 0 END) / 100.0 as total_expense,
+            (SUM(CASE WHEN t.type = 'income' THEN t.base_minor ELSE 0 END) - 
+             SUM(CASE WHEN t.type = 'expense' THEN t.base_minor ELSE 0 END)) / 100.0 as balance
+        FROM transactions_base t
         JOIN users u ON t.user_id = u.id
         WHERE strftime('%Y-%m', t.date) = strftime('%Y-%m', 'now')
         AND t.user_id IN (?, ?) AND t.is_deleted = 0
@@ -737,10 +1566,10 @@ def get_shared_expenses_by_category():
     cursor.execute('''
         SELECT 
             t.category,
-            SUM(CASE WHEN t.user_id = ? THEN t.amount ELSE 0 END) as user1_expenses,
-            SUM(CASE WHEN t.user_id = ? THEN t.amount ELSE 0 END) as user2_expenses,
-            SUM(t.amount) as total
-        FROM transactions t
+            SUM(CASE WHEN t.user_id = ? THEN t.base_minor ELSE 0 END) / 100.0 as user1_expenses,
+            SUM(CASE WHEN t.user_id = ? THEN t.base_minor ELSE 0 END) / 100.0 as user2_expenses,
+            SUM(t.base_minor) / 100.0 as total
+        FROM transactions_base t
         WHERE strftime('%Y-%m', t.date) = strftime('%Y-%m', 'now')
         AND t.type = 'expense' AND t.is_deleted = 0
         GROUP BY t.category
@@ -759,10 +1588,10 @@ def get_combined_statistics(period='month'):
     if period == 'month':
         cursor.execute('''
             SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END) / 100.0 as total_income,
+                SUM(CASE WHEN type = 'expense' THEN base_minor ELSE 0 END) / 100.0 as total_expense,
                 user_id
-            FROM transactions 
+            FROM transactions_base 
             WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now') AND is_deleted = 0
             GROUP BY user_id
         ''')
@@ -776,9 +1605,9 @@ def get_recent_transactions_all(user_id, limit=10):
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT type, amount, category, description, 
+        SELECT type, base_minor / 100.0 AS amount, category, description, 
                strftime('%Y-%m-%d %H:%M', created_at) as datetime
-        FROM transactions 
+        FROM transactions_base 
         WHERE user_id = ? AND is_deleted = 0
         ORDER BY created_at DESC
         LIMIT ?
@@ -797,9 +1626,9 @@ def get_weekly_summary():
         SELECT 
             u.full_name,
             DATE(t.date, 'weekday 0', '-6 days') as week_start,
-            SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END) as weekly_income,
-            SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END) as weekly_expense
-        FROM transactions t
+            SUM(CASE WHEN t.type = 'income' THEN t.base_minor ELSE 0 END) / 100.0 as weekly_income,
+            SUM(CASE WHEN t.type = 'expense' THEN t.base_minor ELSE 0 END) / 100.0 as weekly_expense
+        FROM transactions_base t
         JOIN users u ON t.user_id = u.id
         WHERE t.date >= DATE('now', '-30 days')
         AND u.id IN (?, ?) AND t.is_deleted = 0
@@ -812,6 +1641,159 @@ def get_weekly_summary():
     conn.close()
     return results
 
+def get_daily_expenses(days=30):
+    """Ежедневные расходы обоих пользователей за последние дни"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT date, user_id, SUM(base_minor) / 100.0 as total_expense
+        FROM transactions_base
+        WHERE type = 'expense'
+        AND date >= DATE('now', ?)
+        AND user_id IN (?, ?) AND is_deleted = 0
+        GROUP BY date, user_id
+        ORDER BY date
+    ''', (f'-{days - 1} days', MY_USER_ID, GIRLFRIEND_USER_ID))
+
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+def get_monthly_category_expenses():
+    """Расходы обоих пользователей по месяцам и категориям за всю историю"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = _begin_closed_read(conn)
+
+    # Операциями читается только текущий месяц, закрытые - из замороженных итогов,
+    # архивные годы - из итогов по месяцам
+    cursor.execute(f'''
+        SELECT month, category, SUM(total) / 100.0 as total_expense
+        FROM (
+            SELECT strftime('%Y-%m', date) as month, COALESCE(category, '') as category, SUM(base_minor) as total
+            FROM transactions_base
+            WHERE type = 'expense' AND date >= {OPEN_PERIOD_START}
+            AND user_id IN (?, ?) AND is_deleted = 0
+            GROUP BY month, category
+            UNION ALL
+            SELECT month, category, SUM(total_minor)
+            FROM ({CLOSED_TOTALS_SQL})
+            WHERE type = 'expense' AND user_id IN (?, ?)
+            GROUP BY month, category
+            UNION ALL
+            SELECT month, category, SUM(total_minor)
+            FROM transaction_rollups
+            WHERE type = 'expense' AND user_id IN (?, ?)
+            GROUP BY month, category
+        )
+        GROUP BY month, category
+        ORDER BY month
+    ''', (MY_USER_ID, GIRLFRIEND_USER_ID) * 3)
+
+    results = cursor.fetchall()
+    conn.commit()
+    conn.close()
+    return results
+
+PURCHASE_UNLINKED = 'Без расхода'  # категория купленной покупки, не связанной с расходом
+
+_ARCHIVE_BASE_SQL = BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='a')
+
+def get_planned_vs_actual(date_from, date_to):
+    """План и факт по покупкам пары за период: (месяц, категория, план, факт, покупок, связано).
+    
+    Одна группировка по покупкам, присоединенным к их расходам по первичному ключу;
+    расход, уже перенесенный в архив, ищется там по индексу id. Месяц покупки - дата
+    расхода, без него - срок покупки (купленной без срока - дата отметки); категория -
+    категория расхода, None - покупка еще не куплена.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT strftime('%Y-%m', day) AS month, category,
+               SUM(planned) / 100.0, COALESCE(SUM(actual), 0) / 100.0, COUNT(*), COUNT(transaction_id)
+        FROM (
+            SELECT COALESCE(t.date, a.date, p.target_date,
+                            CASE WHEN p.status = 'bought' THEN date(p.updated_at) END) AS day,
+                   CASE WHEN p.status = 'bought' THEN COALESCE(t.category, a.category, ?) END AS category,
+                   p.estimated_cost_minor AS planned, COALESCE(t.base_minor, {_ARCHIVE_BASE_SQL}) AS actual,
+                   COALESCE(t.id, a.id) AS transaction_id
+            FROM planned_purchases p
+            LEFT JOIN transactions_base t ON t.id = p.transaction_id AND t.is_deleted = 0
+            LEFT JOIN transactions_archive a ON t.id IS NULL AND a.id = p.transaction_id AND a.is_deleted = 0
+            WHERE p.user_id IN (?, ?) AND p.is_deleted = 0
+        )
+        WHERE day BETWEEN ? AND ?
+        GROUP BY month, category
+        ORDER BY month, category IS NULL, category
+    ''', (PURCHASE_UNLINKED, MY_USER_ID, GIRLFRIEND_USER_ID, date_from, date_to))
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+def get_combined_transactions_between(date_from, date_to):
+    """Транзакции обоих пользователей за диапазон дат (включительно)"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT type, COALESCE(category, '') AS category, description, base_minor / 100.0 AS amount, date
+        FROM transactions_base
+        WHERE date BETWEEN ? AND ?
+        AND user_id IN (?, ?) AND is_deleted = 0
+    ''', (date_from, date_to, MY_USER_ID, GIRLFRIEND_USER_ID))
+
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+# ========== АРХИВ ==========
+
+def _move_to_archive(conn, table, condition, rollup=False):
+    """Перенести строки table, подходящие под condition, в архив по кускам id.
+    
+    С rollup=True операции добавляются в итоги transaction_rollups в той же
+    транзакции, что и перенос, поэтому итоги за все время не расходятся.
+    Возвращает число перенесенных строк.
+    """
+    range_condition = f'id BETWEEN ? AND ? AND {condition}'
+    statements = [f'INSERT INTO {table}_archive SELECT * FROM {table} WHERE {range_condition}']
+    if rollup:
+        statements.append(f'''
+            INSERT INTO transaction_rollups (user_id, type, month, category, total_minor, count)
+            SELECT user_id, type, strftime('%Y-%m', date), COALESCE(category, ''), COALESCE(SUM(base_minor), 0), COUNT(*)
+            FROM transactions_base
+            WHERE {range_condition}
+            GROUP BY user_id, type, strftime('%Y-%m', date), COALESCE(category, '')
+            ON CONFLICT (user_id, type, month, category) DO UPDATE SET
+                total_minor = total_minor + excluded.total_minor,
+                count = count + excluded.count
+        ''')
+    statements.append(f'DELETE FROM {table} WHERE {range_condition}')
+    return backfill_in_chunks(conn, table, statements, where=condition)
+
+def archive_old_rows(retention_days=ARCHIVE_RETENTION_DAYS, keep_years=ARCHIVE_KEEP_YEARS):
+    """Перенести в архив давно удаленные записи и операции закрытых лет.
+    
+    Рабочие таблицы остаются маленькими, и запросы с "AND is_deleted = 0" не проходят
+    по мертвым строкам; запросы "за все время" читают архив и итоги по месяцам.
+    Возвращает число перенесенных строк по таблицам.
+    """
+    deleted_before = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    history_before = date(date.today().year - keep_years + 1, 1, 1).isoformat()
+    
+    conn = sqlite3.connect(DB_PATH)
+    moved = {table: _move_to_archive(conn, table, f"is_deleted = 1 AND updated_at < '{deleted_before}'")
+             for table in ARCHIVED_TABLES}
+    # Живые операции закрытых лет уходят в архив вместе с итогами по месяцам
+    moved['transactions'] += _move_to_archive(conn, 'transactions',
+                                              f"is_deleted = 0 AND date < '{history_before}'", rollup=True)
+    conn.close()
+    
+    if any(moved.values()):
+        _bump_data_version()
+    return moved
+
 def get_today_reminders():
     """Получить сегодняшние напоминания"""
     conn = sqlite3.connect(DB_PATH)
@@ -0,0 +1,170 @@
+import calendar
+import math
+from collections import defaultdict
+from datetime import date, timedelta
+from statistics import median
+
+from database import get_data_version, get_combined_transactions_between
+
+HISTORY_DAYS = 90        # по скольким дням оцениваются обычные траты
+RECURRING_MONTHS = 3     # сколько прошлых месяцев просматривается для поиска регулярных платежей
+RECURRING_MIN_MONTHS = 2 # в скольких из них платеж должен встретиться
+RECURRING_SPREAD = 0.2   # допустимый разброс суммы регулярного платежа
+
+# Модель пересчитывается раз в день, итоги месяца - при изменении данных
+_model_cache = {}
+_forecast_cache = {}
+
+# ========== МОДЕЛЬ (раз в день) ==========
+
+def _recurring_key(trans_type, category, description):
+    return (trans_type, category, (description or '').strip().lower())
+
+def _month_start(day, months_back=0):
+    """Первое число месяца, отстоящего на months_back назад"""
+    index = day.year * 12 + day.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+def _find_recurring(rows):
+    """Регулярные платежи: одно описание в нескольких месяцах с близкой суммой"""
+    occurrences = defaultdict(list)
+    for trans_type, category, description, amount, trans_date in rows:
+        if not description:
+            continue
+        occurrences[_recurring_key(trans_type, category, description)].append((trans_date, amount, description))
+
+    recurring = {}
+    for key, items in occurrences.items():
+        months = {trans_date[:7] for trans_date, _, _ in items}
+        if len(months) < RECURRING_MIN_MONTHS:
+            continue
+
+        amounts = [amount for _, amount, _ in items]
+        typical = median(amounts)
+        if typical <= 0 or (max(amounts) - min(amounts)) / typical > RECURRING_SPREAD:
+            continue
+
+        # Несколько платежей в месяц считаем одним средним месячным платежом
+        recurring[key] = {
+            'description': items[-1][2],
+            'amount': sum(amounts) / len(months),
+            'day': int(median(int(trans_date[8:10]) for trans_date, _, _ in items)),
+        }
+    return recurring
+
+def build_model(today):
+    """Дневные ставки трат по категориям и дням недели плюс регулярные платежи"""
+    yesterday = today - timedelta(days=1)
+    history_from = min(today - timedelta(days=HISTORY_DAYS), _month_start(today, RECURRING_MONTHS))
+    rows = get_combined_transactions_between(history_from.isoformat(), yesterday.isoformat())
+
+    recurring_from = _month_start(today, RECURRING_MONTHS).isoformat()
+    month_from = _month_start(today).isoformat()
+    recurring = _find_recurring([row for row in rows if recurring_from <= row[4] < month_from])
+
+    # Сколько раз каждый день недели встретился в окне истории
+    rate_from = today - timedelta(days=HISTORY_DAYS)
+    weekday_counts = [0] * 7
+    for offset in range(HISTORY_DAYS):
+        weekday_counts[(rate_from + timedelta(days=offset)).weekday()] += 1
+
+    rates = defaultdict(lambda: [0.0] * 7)
+    rate_from_str = rate_from.isoformat()
+    for trans_type, category, description, amount, trans_date in rows:
+        if trans_date < rate_from_str or _recurring_key(trans_type, category, description) in recurring:
+            continue
+        weekday = date.fromisoformat(trans_date).weekday()
+        rates[(trans_type, category)][weekday] += amount / weekday_counts[weekday]
+
+    return {'rates': dict(rates), 'recurring': recurring}
+
+def _get_model(today):
+    model = _model_cache.get(today)
+    if model is None:
+        _model_cache.clear()
+        model = _model_cache[today] = build_model(today)
+    return model
+
+# ========== ПРОГНОЗ (при изменении данных) ==========
+
+def compute_forecast(model, month_rows, today):
+    """Прогноз итогов месяца: факт + ожидаемые обычные траты + неоплаченные регулярные платежи"""
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    remaining_weekdays = [date(today.year, today.month, day).weekday()
+                          for day in range(today.day + 1, last_day + 1)]
+
+    actual = defaultdict(float)
+    seen = set()
+    for trans_type, category, description, amount, trans_date in month_rows:
+        actual[(trans_type, category)] += amount
+        seen.add(_recurring_key(trans_type, category, description))
+
+    projected = defaultdict(float)
+    for key, weekday_rates in model['rates'].items():
+        projected[key] += sum(weekday_rates[weekday] for weekday in remaining_weekdays)
+
+    pending = []
+    for key, item in model['recurring'].items():
+        if key not in seen:
+            trans_type, category, _ = key
+            projected[(trans_type, category)] += item['amount']
+            pending.append({'type': trans_type, 'category': category, 'description': item['description'],
+                            'amount': item['amount'], 'day': item['day']})
+
+    categories = []
+    totals = {'income': [0.0, 0.0], 'expense': [0.0, 0.0]}
+    for key in set(actual) | set(projected):
+        trans_type, category = key
+        spent, expected = actual[key], actual[key] + projected[key]
+        totals[trans_type][0] += spent
+        totals[trans_type][1] += expected
+        if trans_type == 'expense':
+            categories.append({'category': category, 'actual': spent, 'forecast': expected})
+
+    categories.sort(key=lambda item: -item['forecast'])
+    pending.sort(key=lambda item: item['day'])
+
+    return {
+        'month': today.strftime('%Y-%m'),
+        'days_left': len(remaining_weekdays),
+        'categories': categories,
+        'pending': pending,
+        'expense_actual': totals['expense'][0],
+        'expense_forecast': totals['expense'][1],
+        'income_actual': totals['income'][0],
+        'income_forecast': totals['income'][1],
+        'balance_forecast': totals['income'][1] - totals['expense'][1],
+    }
+
+def get_month_forecast():
+    """Прогноз расходов и баланса пары на конец текущего месяца"""
+    today = date.today()
+    key = (today, get_data_version())
+    forecast = _forecast_cache.get(key)
+    if forecast is None:
+        model = _get_model(today)
+        month_rows = get_combined_transactions_between(_month_start(today).isoformat(), today.isoformat())
+        _forecast_cache.clear()
+        forecast = _forecast_cache[key] = compute_forecast(model, month_rows, today)
+    return forecast
+
+# ========== НАКОПЛЕНИЯ ==========
+
+def project_affordable(purchases, monthly_net, today=None):
+    """Месяц, к которому хватит денег на каждую покупку (date первого числа или None).
+    
+    Покупки оплачиваются по очереди в порядке списка: каждой достается свободный поток
+    после всех предыдущих. None - если поток не положительный, today - уже накоплено.
+    """
+    today = today or date.today()
+    projection = []
+    needed = 0.0
+    for purchase in purchases:
+        needed += max((purchase.cost or 0) - purchase.saved, 0)
+        if needed <= 0:
+            projection.append(today)
+        elif monthly_net <= 0:
+            projection.append(None)
+        else:
+            projection.append(_month_start(today, -math.ceil(needed / monthly_net)))
+    return projection
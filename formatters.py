@@ -0,0 +1,533 @@
+import html
+import json
+from datetime import date
+from functools import lru_cache
+
+from currency import format_money
+
+ESCAPE_CACHE_SIZE = 1024  # сколько экранированных названий держать в памяти
+
+TRANSACTION_LABELS = {
+    'income': ('💵', 'Доход'),
+    'expense': ('💸', 'Расход'),
+}
+PRIORITY_EMOJI = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}
+WEEKDAY_NAMES = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+
+PROGRESS_CELLS = 10  # длина полоски прогресса накоплений
+
+DIGEST_LINES = 5  # сколько событий каждого вида перечислять в сводке партнера
+
+JOURNAL_TABLES = {'transactions': 'операция', 'plans': 'план', 'planned_purchases': 'покупка'}
+JOURNAL_ACTIONS = {'update': '✏️', 'buy': '🛍️', 'delete': '🗑️', 'undo': '↩️', 'redo': '↪️'}
+JOURNAL_FIELDS = {
+    'amount': 'сумма', 'currency': 'валюта', 'category': 'категория', 'description': 'описание',
+    'title': 'название', 'date': 'дата', 'time': 'время', 'is_shared': 'общий',
+    'item_name': 'название', 'estimated_cost': 'стоимость', 'priority': 'приоритет',
+    'target_date': 'дата', 'notes': 'заметки', 'status': 'статус', 'transaction_id': 'расход',
+    'split_share': 'доля партнера',
+}
+
+# ========== ЭКРАНИРОВАНИЕ ==========
+
+@lru_cache(maxsize=ESCAPE_CACHE_SIZE)
+def escape_name(text):
+    """Экранирование повторяющихся строк: категорий, названий, имен"""
+    return html.escape(text) if text else ""
+
+def escape_text(text):
+    """Экранирование свободного текста (описания, заметки) - без кэша"""
+    return html.escape(text) if text else ""
+
+# ========== ЗАПИСИ ==========
+
+def format_transaction(trans, include_id=False):
+    """Форматирование транзакции (models.Transaction) для отображения"""
+    emoji, type_text = TRANSACTION_LABELS[trans.type]
+    time_str = f" ({trans.time})" if trans.time else ""
+    description_line = f"   📝 Описание: {escape_text(trans.description)}\n" if trans.description else ""
+    split_line = f"   👫 Доля партнера: {trans.split_share}%\n" if trans.split_share else ""
+    id_line = f"   🆔 ID: {trans.id}\n" if include_id else ""
+    return (f"{emoji} <b>{type_text}:</b> {format_money(trans.amount, trans.currency, trans.base_amount)}\n"
+            f"   📂 Категория: {escape_name(trans.category)}\n"
+            f"   📅 Дата: {trans.date}{time_str}\n"
+            f"{description_line}{split_line}{id_line}")
+
+def format_plan(plan, include_id=False):
+    """Форматирование плана (models.Plan) для отображения"""
+    shared_icon = " 👥" if plan.is_shared else ""
+    time_str = f" в {plan.time}" if plan.time else ""
+    description_line = f"   📋 Описание: {escape_text(plan.description)}\n" if plan.description else ""
+    id_line = f"   🆔 ID: {plan.id}\n" if include_id else ""
+    return (f"📅 <b>{escape_name(plan.title)}</b>{shared_icon}\n"
+            f"   📅 Дата: {plan.date}{time_str}\n"
+            f"   🏷️ Категория: {escape_name(plan.category)}\n"
+            f"{description_line}{id_line}")
+
+def format_purchase(purchase, include_id=False):
+    """Форматирование покупки (models.Purchase) для отображения"""
+    status_emoji = "✅" if purchase.status == 'bought' else "📋"
+    date_line = f"   📅 до {purchase.target_date}\n" if purchase.target_date else ""
+    notes_line = f"   📝 Заметки: {escape_text(purchase.notes)}\n" if purchase.notes else ""
+    saved_line = f"   🐷 Отложено: {format_savings_progress(purchase)}\n" if purchase.saved else ""
+    id_line = f"   🆔 ID: {purchase.id}\n" if include_id else ""
+    return (f"{PRIORITY_EMOJI[purchase.priority]} <b>{escape_name(purchase.item_name)}</b> {status_emoji}\n"
+            f"   💰 Стоимость: {purchase.cost:.2f} руб.\n"
+            f"{saved_line}{date_line}{notes_line}{id_line}")
+
+# ========== НАКОПЛЕНИЯ ==========
+
+def format_savings_progress(purchase):
+    """'4500.00 руб. из 10000.00 руб. ▰▰▰▰▱▱▱▱▱▱ 45%'"""
+    cost = purchase.cost or 0
+    share = min(purchase.saved / cost, 1) if cost > 0 else 1
+    filled = round(share * PROGRESS_CELLS)
+    bar = '▰' * filled + '▱' * (PROGRESS_CELLS - filled)
+    return f"{format_money(purchase.saved)} из {format_money(cost)} {bar} {share:.0%}"
+
+def render_purchases(purchases, projection, monthly_net):
+    """Экран планируемых покупок: накопления и месяц, к которому хватит денег"""
+    parts = ["📋 <b>Ваши планируемые покупки:</b>\n\n"]
+    for purchase, ready in zip(purchases, projection):
+        parts.append(format_purchase(purchase, include_id=True))
+        if purchase.saved >= (purchase.cost or 0):
+            parts.append("   ✅ Уже накоплено\n")
+        elif ready is None:
+            parts.append("   ⏳ При текущем потоке не накопить\n")
+        else:
+            parts.append(f"   ⏳ Хватит к {ready:%m.%Y}\n")
+        parts.append("\n")
+
+    total = sum(purchase.cost or 0 for purchase in purchases)
+    saved = sum(purchase.saved for purchase in purchases)
+    parts.append(f"💰 <b>Общая сумма: {format_money(total)}</b>\n"
+                 f"🐷 Отложено: {format_money(saved)}\n"
+                 f"📈 Свободный поток: {format_money(monthly_net)} в месяц")
+    return "".join(parts)
+
+# ========== СТАТИСТИКА ЗА ПЕРИОД ==========
+
+def render_period_statistics(period_text, stats, transactions, group_by_date=True):
+    """Сводка за период и список операций (с группировкой по датам)"""
+    total_income = stats[0] or 0
+    total_expense = stats[1] or 0
+    parts = [f"📊 <b>Статистика за {period_text}:</b>\n\n"
+             f"📈 <b>Доходы:</b> {total_income:.2f} руб.\n"
+             f"📉 <b>Расходы:</b> {total_expense:.2f} руб.\n"
+             f"💰 <b>Баланс:</b> {total_income - total_expense:.2f} руб.\n"
+             f"📋 <b>Количество операций:</b> {stats[2] or 0}\n"]
+
+    if transactions:
+        parts.append("\n\n📝 <b>Детали операций:</b>\n\n")
+
+        if not group_by_date:
+            for trans in transactions:
+                parts.append(format_transaction(trans))
+                parts.append("\n")
+        else:
+            current_date = None
+            for trans in transactions:
+                if trans.date != current_date:
+                    current_date = trans.date
+                    parts.append(f"\n📅 <b>{current_date}:</b>\n")
+                parts.append("  ")
+                parts.append(format_transaction(trans))
+
+    return "".join(parts)
+
+# ========== ГЛАВНЫЙ ЭКРАН ==========
+
+def render_dashboard(snapshot):
+    """Последние записи всех типов по снимку get_dashboard_snapshot"""
+    parts = ["📋 <b>Последние записи:</b>\n\n"]
+
+    for key, title in (('expenses', "💸 <b>Последние расходы:</b>\n"),
+                       ('incomes', "💵 <b>Последние доходы:</b>\n")):
+        if snapshot[key]:
+            parts.append(title)
+            for trans in snapshot[key]:
+                desc = f" - {escape_text(trans.description)}" if trans.description else ""
+                parts.append(f"  • {format_money(trans.amount, trans.currency)} - "
+                             f"{escape_name(trans.category)}{desc} ({trans.date})\n")
+            parts.append("\n")
+
+    if snapshot['plans']:
+        parts.append("📅 <b>Ближайшие планы:</b>\n")
+        for plan in snapshot['plans']:
+            time_str = f" в {plan.time}" if plan.time else ""
+            parts.append(f"  • {escape_name(plan.title)} ({plan.date}{time_str})\n")
+        parts.append("\n")
+
+    if snapshot['purchases']:
+        parts.append("🛍️ <b>Планируемые покупки:</b>\n")
+        for purchase in snapshot['purchases']:
+            parts.append(f"  • {PRIORITY_EMOJI[purchase.priority]} {escape_name(purchase.item_name)} "
+                         f"- {purchase.cost:.2f} руб.\n")
+
+    return "".join(parts)
+
+# ========== ОБЩИЕ ФИНАНСЫ ==========
+
+def render_shared_expenses(rows):
+    """Общие расходы по категориям с итогами по каждому партнеру"""
+    parts = ["📊 <b>Общие расходы по категориям за месяц:</b>\n\n"]
+    total_expenses = user1_total = user2_total = 0
+
+    for category, user1_exp, user2_exp, total in rows:
+        if total > 0:
+            total_expenses += total
+            user1_total += user1_exp or 0
+            user2_total += user2_exp or 0
+            parts.append(f"<b>{escape_name(category)}:</b>\n"
+                         f"  • Ты: {user1_exp:.2f} руб.\n"
+                         f"  • Партнер: {user2_exp:.2f} руб.\n"
+                         f"  • <b>Всего: {total:.2f} руб.</b>\n\n")
+
+    parts.append("<b>Итоги:</b>\n"
+                 f"  • Твои расходы: {user1_total:.2f} руб.\n"
+                 f"  • Расходы партнера: {user2_total:.2f} руб.\n"
+                 f"  • <b>Общие расходы: {total_expenses:.2f} руб.</b>")
+    return "".join(parts)
+
+def render_combined_incomes(combined_stats, user_names, user_ids):
+    """Доходы каждого партнера и общий доход за месяц"""
+    incomes = {user_id: total_income or 0 for total_income, _, user_id in combined_stats}
+    total_combined_income = sum(incomes.values())
+
+    parts = ["💰 <b>Общие доходы за месяц:</b>\n\n"]
+    if all(user_id in user_names for user_id in user_ids):
+        for user_id in user_ids:
+            parts.append(f"<b>{escape_name(user_names[user_id])}:</b> {incomes.get(user_id, 0):.2f} руб.\n")
+        parts.append("\n")
+    parts.append(f"<b>Общие доходы:</b> {total_combined_income:.2f} руб.")
+    return "".join(parts)
+
+def render_category_comparison(rows):
+    """Доли партнеров в расходах по каждой категории"""
+    parts = ["📊 <b>Сравнение расходов по категориям за месяц:</b>\n\n"]
+    for category, user1_exp, user2_exp, total in rows:
+        if total > 0:
+            parts.append(f"<b>{escape_name(category)}</b> - {total:.2f} руб.\n"
+                         f"  • Ты: {user1_exp:.2f} руб. ({user1_exp / total * 100:.1f}%)\n"
+                         f"  • Партнер: {user2_exp:.2f} руб. ({user2_exp / total * 100:.1f}%)\n\n")
+    return "".join(parts)
+
+def render_monthly_comparison(rows, title="📈 <b>Итоги за месяц:</b>"):
+    """Итоги месяца по каждому партнеру и общие итоги"""
+    parts = [f"{title}\n\n"]
+    total_combined_income = total_combined_expense = 0
+
+    for user_data in rows:
+        income = user_data[1] or 0
+        expense = user_data[2] or 0
+        parts.append(f"<b>{escape_name(user_data[0])}:</b>\n"
+                     f"  💵 Доходы: {format_money(income)}\n"
+                     f"  💸 Расходы: {format_money(expense)}\n"
+                     f"  ⚖️ Баланс: {format_money(user_data[3] or 0)}\n\n")
+        total_combined_income += income
+        total_combined_expense += expense
+
+    parts.append("<b>Общие итоги:</b>\n"
+                 f"  📈 Общий доход: {format_money(total_combined_income)}\n"
+                 f"  📉 Общий расход: {format_money(total_combined_expense)}\n"
+                 f"  ⚖️ Общий баланс: {format_money(total_combined_income - total_combined_expense)}")
+    return "".join(parts)
+
+def render_top_categories(rows):
+    """Топ категорий по общим расходам за месяц"""
+    parts = ["📂 <b>Топ категорий по расходам за месяц:</b>\n\n"]
+    total_expenses = 0
+
+    for i, (category, expense, count) in enumerate(rows, 1):
+        if expense > 0:
+            total_expenses += expense
+            parts.append(f"{i}. <b>{escape_name(category)}:</b> {format_money(expense)} ({count} записей)\n")
+
+    parts.append(f"\n💸 <b>Всего расходов:</b> {format_money(total_expenses)}")
+    return "".join(parts)
+
+def render_daily_expenses(rows):
+    """Расходы обоих партнеров за сегодня (строки отсортированы по имени) с итогами"""
+    parts = ["📅 <b>Расходы за сегодня:</b>\n\n"]
+    current_user = None
+    user_total = overall_total = 0
+
+    for username, category, amount, description in rows:
+        if username != current_user:
+            if current_user is not None:
+                parts.append(f"<b>Итого: {format_money(user_total)}</b>\n\n")
+                user_total = 0
+            current_user = username
+            parts.append(f"<b>👤 {escape_name(username)}:</b>\n")
+
+        user_total += amount
+        overall_total += amount
+        desc = f" - {escape_text(description)}" if description else ""
+        parts.append(f"  • {escape_name(category)}: {format_money(amount)}{desc}\n")
+
+    if current_user is not None:
+        parts.append(f"\n<b>Итого: {format_money(user_total)}</b>")
+    parts.append(f"\n\n💰 <b>Общая сумма: {format_money(overall_total)}</b>")
+    return "".join(parts)
+
+def render_plan_report(report):
+    """План и факт по покупкам за несколько месяцев: по категориям и итог месяца"""
+    parts = ["🎯 <b>План и факт по покупкам:</b>\n"]
+    for month in report:
+        if not month['categories']:
+            continue
+        parts.append(f"\n<b>📅 {month['month']}:</b>\n")
+        for item in month['categories']:
+            if item['category'] is None:
+                parts.append(f"  ⏳ Не куплено ({item['count']}): план {format_money(item['planned'])}\n")
+                continue
+            if not item['linked']:
+                parts.append(f"  • {escape_name(item['category'])} ({item['count']}): "
+                             f"план {format_money(item['planned'])}, расход не найден\n")
+                continue
+            diff = item['actual'] - item['planned'] if item['linked'] == item['count'] else None
+            diff_text = f" ({diff:+.2f})" if diff else ""
+            parts.append(f"  • {escape_name(item['category'])} ({item['count']}): "
+                         f"план {format_money(item['planned'])}, факт {format_money(item['actual'])}{diff_text}\n")
+        if month['planned']:
+            parts.append(f"  <b>Итого:</b> план {format_money(month['planned'])}, "
+                         f"факт {format_money(month['actual'])}\n")
+
+    if len(parts) == 1:
+        return "🎯 Нет покупок со сроком или отметкой о покупке за последние месяцы"
+    return "".join(parts)
+
+def render_agenda(title, plans):
+    """Планы за несколько дней (отсортированные по дате) одной строкой на план"""
+    parts = [f"{title}\n"]
+    current_date = None
+    
+    for plan in plans:
+        if plan.date != current_date:
+            current_date = plan.date
+            weekday = WEEKDAY_NAMES[date.fromisoformat(current_date).weekday()]
+            parts.append(f"\n<b>📅 {current_date} ({weekday}):</b>\n")
+        
+        time_str = f"{plan.time} " if plan.time else ""
+        shared_icon = " 👥" if plan.is_shared else ""
+        parts.append(f"  • {time_str}{escape_name(plan.title)}{shared_icon}\n")
+    
+    if current_date is None:
+        parts.append("\n📭 Планов нет")
+    return "".join(parts)
+
+def render_shared_plans(plans):
+    """Совместные планы, сгруппированные по датам"""
+    parts = ["📅 <b>Совместные планы:</b>\n\n"]
+    current_date = None
+
+    for plan in plans:
+        if plan.date != current_date:
+            current_date = plan.date
+            parts.append(f"\n<b>📅 {current_date}:</b>\n")
+
+        time_str = f" в {plan.time}" if plan.time else ""
+        parts.append(f"  • <b>{escape_name(plan.title)}</b>{time_str}\n"
+                     f"    👤 {escape_name(plan.author)} | 🏷️ {escape_name(plan.category)}\n")
+        if plan.description:
+            description = plan.description
+            desc_short = description[:50] + "..." if len(description) > 50 else description
+            parts.append(f"    📝 {escape_text(desc_short)}\n")
+        parts.append("\n")
+
+    return "".join(parts)
+
+# ========== АНАЛИТИКА ==========
+
+def render_trends(report):
+    """Тренды по категориям (analytics.get_trend_report): изменения м/м, г/г и аномалии"""
+    parts = [f"📉 <b>Тренды расходов за {report['month']}:</b>\n\n"]
+    for item in report['items']:
+        anomaly = " ⚠️" if item['anomaly'] else ""
+        parts.append(f"<b>{escape_name(item['category'])}:</b> {format_money(item['total'])}{anomaly}\n")
+
+        details = []
+        if item['mom'] is not None:
+            details.append(f"м/м {item['mom'] * 100:+.1f}%")
+        if item['yoy'] is not None:
+            details.append(f"г/г {item['yoy'] * 100:+.1f}%")
+        if item['rolling'] is not None:
+            details.append(f"ср. 3 мес. {format_money(item['rolling'])}")
+        if details:
+            parts.append(f"  {' | '.join(details)}\n")
+
+    parts.append("\n⚠️ — расход заметно отличается от предыдущих 6 месяцев")
+    return "".join(parts)
+
+def render_forecast(forecast):
+    """Прогноз на конец месяца (forecast.get_month_forecast) по категориям и итогам"""
+    parts = [f"🔮 <b>Прогноз на конец месяца ({forecast['month']}):</b>\n"
+             f"Осталось дней: {forecast['days_left']}\n\n"]
+    for item in forecast['categories']:
+        parts.append(f"• {escape_name(item['category'])}: {format_money(item['forecast'])} "
+                     f"(уже {format_money(item['actual'])})\n")
+
+    if forecast['pending']:
+        parts.append("\n🔁 <b>Ожидаемые регулярные платежи:</b>\n")
+        for item in forecast['pending']:
+            emoji = TRANSACTION_LABELS[item['type']][0]
+            parts.append(f"{emoji} {escape_text(item['description'])} ({escape_name(item['category'])}) "
+                         f"~{format_money(item['amount'])}, обычно {item['day']}-го\n")
+
+    parts.append(f"\n📉 <b>Расходы:</b> {format_money(forecast['expense_forecast'])} "
+                 f"(сейчас {format_money(forecast['expense_actual'])})\n"
+                 f"📈 <b>Доходы:</b> {format_money(forecast['income_forecast'])} "
+                 f"(сейчас {format_money(forecast['income_actual'])})\n"
+                 f"💰 <b>Баланс на конец месяца:</b> {format_money(forecast['balance_forecast'])}")
+    return "".join(parts)
+
+# ========== ДАННЫЕ ПАРТНЕРА ==========
+
+def render_partner_transactions(title, transactions):
+    """Операции партнера за период с итоговой суммой в рублях"""
+    parts = [title]
+    total = 0
+
+    for trans in transactions:
+        total += trans.base_amount or 0
+        time_str = f" ({trans.time})" if trans.time else ""
+        parts.append(f"• {escape_name(trans.category)}: {format_money(trans.amount, trans.currency)} "
+                     f"({trans.date}{time_str})\n")
+        if trans.description:
+            parts.append(f"  {escape_text(trans.description)}\n")
+
+    parts.append(f"\n<b>Всего: {total:.2f} руб.</b>")
+    return "".join(parts)
+
+def render_partner_plans(plans):
+    """Планы партнера на сегодня"""
+    parts = ["📅 <b>Планы партнера на сегодня:</b>\n\n"]
+
+    for plan in plans:
+        time_str = f" в {plan.time}" if plan.time else ""
+        parts.append(f"• <b>{escape_name(plan.title)}</b>{time_str}\n"
+                     f"  🏷️ {escape_name(plan.category)}\n")
+        if plan.description:
+            parts.append(f"  📝 {escape_text(plan.description)}\n")
+        parts.append("\n")
+
+    return "".join(parts)
+
+def render_partner_purchases(purchases):
+    """Планируемые покупки партнера с общей суммой"""
+    parts = ["🛍️ <b>Планируемые покупки партнера:</b>\n\n"]
+    total = 0
+
+    for purchase in purchases:
+        total += purchase.cost
+        date_str = f"до {purchase.target_date}" if purchase.target_date else ""
+        parts.append(f"{PRIORITY_EMOJI[purchase.priority]} <b>{escape_name(purchase.item_name)}</b> "
+                     f"- {purchase.cost:.2f} руб. {date_str}\n")
+        if purchase.notes:
+            parts.append(f"  📝 {escape_text(purchase.notes)}\n")
+        parts.append("\n")
+
+    parts.append(f"<b>Общая сумма: {total:.2f} руб.</b>")
+    return "".join(parts)
+
+def render_partner_stats(stats, recent):
+    """Статистика партнера за месяц и последние операции"""
+    total_income = stats[0] or 0
+    total_expense = stats[1] or 0
+    parts = ["📊 <b>Полная статистика партнера за месяц:</b>\n\n",
+             f"📈 <b>Доходы:</b> {total_income:.2f} руб.\n",
+             f"📉 <b>Расходы:</b> {total_expense:.2f} руб.\n",
+             f"💰 <b>Баланс:</b> {total_income - total_expense:.2f} руб.\n",
+             f"📋 <b>Количество операций:</b> {stats[2] or 0}\n"]
+
+    if recent:
+        parts.append("\n<b>Последние операции:</b>\n")
+        for trans in recent:
+            emoji, type_text = TRANSACTION_LABELS[trans.type]
+            parts.append(f"{emoji} {type_text}: {format_money(trans.amount, trans.currency)} "
+                         f"- {escape_name(trans.category)}\n")
+            if trans.description:
+                parts.append(f"  {escape_text(trans.description)}\n")
+
+    return "".join(parts)
+
+def _digest_section(header, lines):
+    more = f"  ...и еще {len(lines) - DIGEST_LINES}\n" if len(lines) > DIGEST_LINES else ""
+    return f"{header}\n" + "".join(lines[:DIGEST_LINES]) + more + "\n"
+
+def render_partner_digest(author, events):
+    """Сводка действий партнера (notifications.PartnerEvent) одним сообщением"""
+    expenses = [event.record for event in events if event.kind == 'expense']
+    plans = [event.record for event in events if event.kind == 'shared_plan']
+    purchases = [event.record for event in events if event.kind == 'purchase_done']
+    
+    parts = [f"🔔 <b>{escape_name(author)}:</b>\n\n"]
+    if expenses:
+        total = sum(trans.base_amount for trans in expenses)
+        parts.append(_digest_section(
+            f"💸 Новые расходы ({len(expenses)}) на {format_money(total)}:",
+            [f"  • {escape_name(trans.category)}: {format_money(trans.amount, trans.currency, trans.base_amount)}"
+             f"{' - ' + escape_text(trans.description) if trans.description else ''}\n"
+             for trans in expenses]))
+    if plans:
+        parts.append(_digest_section(
+            "👥 Общие планы:",
+            [f"  • {escape_name(plan.title)} - {plan.date}{' в ' + plan.time if plan.time else ''}\n"
+             for plan in plans]))
+    if purchases:
+        parts.append(_digest_section(
+            "🛍️ Куплено:",
+            [f"  • {escape_name(purchase.item_name)}"
+             f"{' - ' + format_money(purchase.cost) if purchase.cost else ''}\n"
+             for purchase in purchases]))
+    return "".join(parts).rstrip("\n")
+
+def format_receipt(receipt):
+    """Предложение расхода по распознанному чеку"""
+    lines = ["🧾 <b>Чек распознан:</b>\n", f"💰 Сумма: {format_money(receipt.total)}"]
+    if receipt.date:
+        lines.append(f"📅 Дата: {receipt.date}")
+    if receipt.merchant:
+        lines.append(f"🏪 Продавец: {escape_text(receipt.merchant)}")
+    lines.append("\nЗаписать расход?")
+    return "\n".join(lines)
+
+def render_settle_balance(balance, partner_name, defaults):
+    """Кто кому должен по разделенным расходам и доли категорий по умолчанию"""
+    if balance > 0:
+        line = f"💰 <b>{escape_name(partner_name)} должен(на) тебе {format_money(balance)}</b>"
+    elif balance < 0:
+        line = f"💸 <b>Ты должен(на) {escape_name(partner_name)} {format_money(-balance)}</b>"
+    else:
+        line = "🤝 <b>Вы в расчете</b>"
+
+    parts = [f"⚖️ <b>Расчеты по общим расходам:</b>\n\n{line}\n"]
+    if defaults:
+        parts.append("\n👫 <b>Доля партнера по умолчанию:</b>\n")
+        parts.extend(f"• {escape_name(category)}: {share}%\n" for category, share in defaults.items())
+    parts.append("\nДолю категории: /split Еда 50, долю расхода - кнопкой 👫 при редактировании")
+    return "".join(parts)
+
+# ========== ЖУРНАЛ ИЗМЕНЕНИЙ ==========
+
+def _journal_value(value):
+    return escape_text(str(value)) if value not in (None, '') else "—"
+
+def describe_change(entry):
+    """Что изменилось в записи журнала (models.JournalEntry)"""
+    before = json.loads(entry.before)
+    after = json.loads(entry.after)
+    if 'is_deleted' in after:
+        details = "удалена" if after['is_deleted'] else "восстановлена"
+    else:
+        details = ", ".join(f"{JOURNAL_FIELDS[column]}: {_journal_value(before[column])} → "
+                            f"{_journal_value(after[column])}"
+                            for column in after if column in JOURNAL_FIELDS)
+    return f"{JOURNAL_TABLES[entry.table_name]} #{entry.record_id} - {details}"
+
+def render_change_history(entries):
+    """Последние изменения пользователя"""
+    parts = ["📜 <b>Последние изменения:</b>\n\n"]
+    for entry in entries:
+        parts.append(f"{JOURNAL_ACTIONS[entry.action]} {entry.created_at}: {describe_change(entry)}\n")
+    return "".join(parts)
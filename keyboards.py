@@ -1,7 +1,41 @@
+import calendar
+from functools import lru_cache, wraps
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils import json
+
+from currency import format_money
+
+KEYBOARD_CACHE_SIZE = 512
+
+# ========== ГОТОВЫЕ КЛАВИАТУРЫ ==========
+# Клавиатуры отдаются уже сериализованными в JSON: строка неизменяема,
+# и aiogram передает ее в API как есть, без сборки объектов на каждый апдейт
+
+def _freeze(keyboard):
+    """Сериализовать клавиатуру так же, как это делает aiogram при отправке"""
+    return json.dumps(keyboard.to_python())
+
+def _static_keyboard(build):
+    """Клавиатура без параметров собирается один раз при импорте"""
+    frozen = _freeze(build())
+
+    @wraps(build)
+    def get_keyboard():
+        return frozen
+    return get_keyboard
+
+def _cached_keyboard(build):
+    """Клавиатура с параметрами хранится в ограниченном LRU-кэше"""
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+    @wraps(build)
+    def get_keyboard(*args):
+        return _freeze(build(*args))
+    return get_keyboard
 
 # ========== ОСНОВНЫЕ КЛАВИАТУРЫ ==========
 
+@_static_keyboard
 def get_main_keyboard():
     """Главное меню"""
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -27,12 +61,14 @@ def get_main_keyboard():
     )
     return keyboard
 
+@_static_keyboard
 def get_cancel_keyboard():
     """Клавиатура с кнопкой отмены"""
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit'))
     return keyboard
 
+@_static_keyboard
 def get_back_keyboard():
     """Клавиатура с кнопкой назад"""
     keyboard = InlineKeyboardMarkup()
@@ -41,6 +77,7 @@ def get_back_keyboard():
 
 # ========== КЛАВИАТУРЫ ДЛЯ КАТЕГОРИЙ ==========
 
+@_static_keyboard
 def get_expense_categories_keyboard():
     """Категории для расходов"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -50,6 +87,7 @@ def get_expense_categories_keyboard():
     keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit'))
     return keyboard
 
+@_static_keyboard
 def get_income_categories_keyboard():
     """Категории для доходов"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -59,6 +97,7 @@ def get_income_categories_keyboard():
     keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit'))
     return keyboard
 
+@_static_keyboard
 def get_plan_categories_keyboard():
     """Категории для планов"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -68,6 +107,7 @@ def get_plan_categories_keyboard():
     keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit'))
     return keyboard
 
+@_static_keyboard
 def get_priority_keyboard():
     """Приоритеты для покупок"""
     keyboard = InlineKeyboardMarkup(row_width=3)
@@ -81,6 +121,7 @@ def get_priority_keyboard():
 
 # ========== КЛАВИАТУРЫ ДЛЯ СТАТИСТИКИ ==========
 
+@_static_keyboard
 def get_statistics_menu_keyboard():
     """Меню статистики"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -96,9 +137,34 @@ def get_statistics_menu_keyboard():
         InlineKeyboardButton('📂 По категориям', callback_data='stats_categories'),
         InlineKeyboardButton('📅 Расходы сегодня', callback_data='stats_today')
     )
+    keyboard.add(
+        InlineKeyboardButton('🖼️ Графики', callback_data='stats_charts'),
+        InlineKeyboardButton('📉 Тренды', callback_data='stats_trends')
+    )
+    keyboard.add(
+        InlineKeyboardButton('🔮 Прогноз на месяц', callback_data='stats_forecast'),
+        InlineKeyboardButton('🎯 План и факт', callback_data='stats_plan')
+    )
+    keyboard.add(InlineKeyboardButton('⚖️ Кто кому должен', callback_data='stats_settle'))
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_main'))
     return keyboard
 
+@_static_keyboard
+def get_charts_keyboard():
+    """Выбор графика"""
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton('🥧 По категориям', callback_data='chart_pie'),
+        InlineKeyboardButton('📈 По дням', callback_data='chart_daily')
+    )
+    keyboard.add(
+        InlineKeyboardButton('👫 Сравнение партнеров', callback_data='chart_partners'),
+        InlineKeyboardButton('🎯 План и факт', callback_data='chart_plan')
+    )
+    keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_stats'))
+    return keyboard
+
+@_static_keyboard
 def get_period_selection_keyboard():
     """Выбор периода для статистики"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -111,6 +177,7 @@ def get_period_selection_keyboard():
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_stats'))
     return keyboard
 
+@_static_keyboard
 def get_partner_view_keyboard():
     """Просмотр данных партнера"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -128,6 +195,7 @@ def get_partner_view_keyboard():
     )
     return keyboard
 
+@_static_keyboard
 def get_combined_stats_keyboard():
     """Общая статистика"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -147,6 +215,7 @@ def get_combined_stats_keyboard():
 
 # ========== КЛАВИАТУРЫ ДЛЯ УПРАВЛЕНИЯ ==========
 
+@_static_keyboard
 def get_management_keyboard():
     """Меню управления записями"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -172,6 +241,7 @@ def get_management_keyboard():
     )
     return keyboard
 
+@_cached_keyboard
 def get_edit_transaction_keyboard(transaction_id, trans_type):
     """Редактирование транзакции"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -183,9 +253,15 @@ def get_edit_transaction_keyboard(transaction_id, trans_type):
         InlineKeyboardButton('📝 Изменить описание', callback_data=f'edit_desc_{trans_type}_{transaction_id}'),
         InlineKeyboardButton('🗑️ Удалить', callback_data=f'delete_confirm_{trans_type}_{transaction_id}')
     )
-    keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit'))
+    if trans_type == 'expense':
+        keyboard.add(InlineKeyboardButton('👫 Разделить с партнером', callback_data=f'split_{transaction_id}'))
+    keyboard.add(
+        InlineKeyboardButton('↩️ Отменить изменение', callback_data='undo_last'),
+        InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit')
+    )
     return keyboard
 
+@_cached_keyboard
 def get_edit_plan_keyboard(plan_id):
     """Редактирование плана"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -205,8 +281,17 @@ def get_edit_plan_keyboard(plan_id):
         InlineKeyboardButton('🗑️ Удалить', callback_data=f'delete_plan_confirm_{plan_id}'),
         InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit')
     )
+    keyboard.add(InlineKeyboardButton('↩️ Отменить изменение', callback_data='undo_last'))
     return keyboard
 
+@_cached_keyboard
+def get_contribution_keyboard(contribution_id):
+    """Отмена только что сделанного взноса на покупку"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton('↩️ Отменить взнос', callback_data=f'unsave_{contribution_id}'))
+    return keyboard
+
+@_cached_keyboard
 def get_edit_purchase_keyboard(purchase_id):
     """Редактирование покупки"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -222,12 +307,15 @@ def get_edit_purchase_keyboard(purchase_id):
         InlineKeyboardButton('📝 Изменить заметки', callback_data=f'edit_purchase_notes_{purchase_id}'),
         InlineKeyboardButton('✅ Отметить купленным', callback_data=f'purchase_done_{purchase_id}')
     )
+    keyboard.add(InlineKeyboardButton('🐷 Отложить деньги', callback_data=f'save_purchase_{purchase_id}'))
     keyboard.add(
         InlineKeyboardButton('🗑️ Удалить', callback_data=f'delete_purchase_confirm_{purchase_id}'),
         InlineKeyboardButton('❌ Отмена', callback_data='cancel_edit')
     )
+    keyboard.add(InlineKeyboardButton('↩️ Отменить изменение', callback_data='undo_last'))
     return keyboard
 
+@_cached_keyboard
 def get_delete_confirmation_keyboard(item_type, item_id):
     """Подтверждение удаления"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -237,8 +325,41 @@ def get_delete_confirmation_keyboard(item_type, item_id):
     )
     return keyboard
 
+@_static_keyboard
+def get_undo_keyboard():
+    """Отмена последнего изменения"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton('↩️ Отменить', callback_data='undo_last'))
+    return keyboard
+
+@_static_keyboard
+def get_receipt_keyboard():
+    """Подтверждение расхода, распознанного с фото чека"""
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton('✅ Выбрать категорию', callback_data='receipt_accept'),
+        InlineKeyboardButton('✏️ Другая сумма', callback_data='receipt_amount')
+    )
+    keyboard.add(InlineKeyboardButton('❌ Отмена', callback_data='receipt_cancel'))
+    return keyboard
+
+@_static_keyboard
+def get_settle_keyboard():
+    """Отметка о расчете по общим расходам"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton('✅ Рассчитались', callback_data='settle_up'))
+    return keyboard
+
+@_static_keyboard
+def get_redo_keyboard():
+    """Возврат отмененного изменения"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton('↪️ Вернуть', callback_data='redo_last'))
+    return keyboard
+
 # ========== КЛАВИАТУРЫ ДЛЯ ОБЩИХ ПЛАНОВ ==========
 
+@_static_keyboard
 def get_shared_plans_keyboard():
     """Общие планы"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -252,8 +373,47 @@ def get_shared_plans_keyboard():
     )
     return keyboard
 
+# ========== КАЛЕНДАРЬ ПЛАНОВ ==========
+
+MONTH_NAMES = ['', 'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+               'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+@_static_keyboard
+def get_agenda_keyboard():
+    """Переход от планов на сегодня к неделе и месяцу"""
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton('📆 Неделя', callback_data='agenda_week'),
+        InlineKeyboardButton('🗓️ Месяц', callback_data='agenda_month')
+    )
+    return keyboard
+
+@_cached_keyboard
+def get_calendar_keyboard(year, month, busy_days=()):
+    """Календарь месяца; дни с планами (busy_days) отмечены точкой"""
+    prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+    
+    keyboard = InlineKeyboardMarkup(row_width=7)
+    keyboard.row(
+        InlineKeyboardButton('◀️', callback_data=f'agenda_month_{prev_year}-{prev_month:02d}'),
+        InlineKeyboardButton(f'{MONTH_NAMES[month]} {year}', callback_data='agenda_ignore'),
+        InlineKeyboardButton('▶️', callback_data=f'agenda_month_{next_year}-{next_month:02d}')
+    )
+    keyboard.row(*[InlineKeyboardButton(name, callback_data='agenda_ignore')
+                   for name in ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')])
+    for week in calendar.monthcalendar(year, month):
+        keyboard.row(*[
+            InlineKeyboardButton(' ', callback_data='agenda_ignore') if day == 0 else
+            InlineKeyboardButton(f'{day}•' if day in busy_days else str(day),
+                                 callback_data=f'agenda_day_{year}-{month:02d}-{day:02d}')
+            for day in week
+        ])
+    return keyboard
+
 # ========== КЛАВИАТУРЫ ДЛЯ ПОИСКА ==========
 
+@_static_keyboard
 def get_search_keyboard():
     """Поиск записей"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -271,6 +431,7 @@ def get_search_keyboard():
     )
     return keyboard
 
+@_cached_keyboard
 def get_search_filters_keyboard(search_type):
     """Фильтры поиска"""
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -308,6 +469,17 @@ def get_search_filters_keyboard(search_type):
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_search'))
     return keyboard
 
+@_static_keyboard
+def get_purchase_status_keyboard():
+    """Выбор статуса покупок для поиска"""
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton('✅ Купленные', callback_data='search_status_bought'),
+        InlineKeyboardButton('📋 Планируемые', callback_data='search_status_planned')
+    )
+    keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_search'))
+    return keyboard
+
 # ========== КЛАВИАТУРЫ ДЛЯ ВЫБОРА ЗАПИСЕЙ ==========
 
 def create_transactions_keyboard(transactions, trans_type):
@@ -315,16 +487,15 @@ def create_transactions_keyboard(transactions, trans_type):
     keyboard = InlineKeyboardMarkup(row_width=1)
     
     for trans in transactions:
-        trans_id, amount, category, description, trans_date, time = trans[:6]
+        description = trans.description
         desc_short = (description[:20] + "...") if description and len(description) > 20 else (description or "")
-        date_str = trans_date if len(trans) > 5 else "сегодня"
-        time_str = f" ({time})" if time else ""
+        time_str = f" ({trans.time})" if trans.time else ""
         
-        text = f"{amount} руб. - {category} - {date_str}{time_str}"
+        text = f"{format_money(trans.amount, trans.currency)} - {trans.category} - {trans.date}{time_str}"
         if desc_short:
             text += f" | {desc_short}"
         
-        callback_data = f'select_{trans_type}_{trans_id}'
+        callback_data = f'select_{trans_type}_{trans.id}'
         keyboard.add(InlineKeyboardButton(text, callback_data=callback_data))
     
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_management'))
@@ -335,16 +506,16 @@ def create_plans_keyboard(plans):
     keyboard = InlineKeyboardMarkup(row_width=1)
     
     for plan in plans:
-        plan_id, title, description, plan_date, time, category, is_shared = plan[:7]
-        shared_icon = " 👥" if is_shared else ""
-        time_str = f" в {time}" if time else ""
+        description = plan.description
+        shared_icon = " 👥" if plan.is_shared else ""
+        time_str = f" в {plan.time}" if plan.time else ""
         desc_short = (description[:20] + "...") if description and len(description) > 20 else (description or "")
         
-        text = f"{title}{shared_icon} - {plan_date}{time_str}"
+        text = f"{plan.title}{shared_icon} - {plan.date}{time_str}"
         if desc_short:
             text += f" | {desc_short}"
         
-        keyboard.add(InlineKeyboardButton(text, callback_data=f'select_plan_{plan_id}'))
+        keyboard.add(InlineKeyboardButton(text, callback_data=f'select_plan_{plan.id}'))
     
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_management'))
     return keyboard
@@ -354,16 +525,16 @@ def create_purchases_keyboard(purchases):
     keyboard = InlineKeyboardMarkup(row_width=1)
     
     for purchase in purchases:
-        purchase_id, item_name, cost, priority, target_date, notes, status = purchase[:7]
-        emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[priority]
-        date_str = f"до {target_date}" if target_date else ""
+        notes = purchase.notes
+        emoji = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}[purchase.priority]
+        date_str = f"до {purchase.target_date}" if purchase.target_date else ""
         notes_short = (notes[:20] + "...") if notes and len(notes) > 20 else (notes or "")
         
-        text = f"{emoji} {item_name} - {cost} руб. {date_str}"
+        text = f"{emoji} {purchase.item_name} - {purchase.cost} руб. {date_str}"
         if notes_short:
             text += f" | {notes_short}"
         
-        keyboard.add(InlineKeyboardButton(text, callback_data=f'select_purchase_{purchase_id}'))
+        keyboard.add(InlineKeyboardButton(text, callback_data=f'select_purchase_{purchase.id}'))
     
     keyboard.add(InlineKeyboardButton('🔙 Назад', callback_data='back_to_management'))
     return keyboard
\ No newline at end of file
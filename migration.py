@@ -0,0 +1,648 @@
+import sqlite3
+import time
+
+from config import DB_PATH, BASE_CURRENCY
+
+BACKFILL_CHUNK = 2000  # строк за одну транзакцию при заполнении
+BACKFILL_PAUSE = 0.01  # пауза между кусками (сек), чтобы бот успевал записывать свое
+
+# Колонки в копейках и REAL-колонки, из которых они заполняются
+MINOR_COLUMNS = [
+    ('transactions', 'amount_minor', 'amount'),
+    ('planned_purchases', 'estimated_cost_minor', 'estimated_cost'),
+]
+
+# Сумма в базовой валюте: по курсу на дату операции (последнему известному до нее),
+# а для операций старше всех курсов - по самому раннему курсу. table - имя или
+# псевдоним таблицы операций в запросе
+BASE_AMOUNT_SQL = '''
+    CASE WHEN {table}.currency = '{base}' THEN {table}.amount_minor
+    ELSE CAST(ROUND({table}.amount_minor * COALESCE(
+        (SELECT r.rate FROM exchange_rates r
+         WHERE r.currency = {table}.currency AND r.date <= {table}.date ORDER BY r.date DESC LIMIT 1),
+        (SELECT r.rate FROM exchange_rates r
+         WHERE r.currency = {table}.currency ORDER BY r.date LIMIT 1))) AS INTEGER)
+    END'''
+
+# Таблицы, у которых есть архивная копия <table>_archive
+ARCHIVED_TABLES = ['transactions', 'plans', 'planned_purchases']
+
+# ========== ЗАПОЛНЕНИЕ ПО КУСКАМ ==========
+
+def backfill_in_chunks(conn, table, statement, where='1', chunk=BACKFILL_CHUNK, pause=BACKFILL_PAUSE):
+    """Выполнить statement по диапазонам id таблицы, фиксируя каждый кусок отдельно.
+
+    statement получает параметры (первый id, последний id) диапазона - это может быть
+    UPDATE новой колонки или INSERT ... SELECT в сводную/FTS-таблицу. Список запросов
+    выполняется в одной транзакции на кусок, число строк берется из первого.
+    where отбирает строки, которые еще не обработаны, поэтому прерванное заполнение
+    при следующем запуске продолжается с места остановки. Блокировка на запись
+    держится только на время одного куска, и бот работает с базой во время миграции.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT MIN(id), MAX(id) FROM {table} WHERE {where}')
+    first_id, last_id = cursor.fetchone()
+    if first_id is None:
+        return 0
+
+    statements = (statement,) if isinstance(statement, str) else statement
+    processed = 0
+    for start in range(first_id, last_id + 1, chunk):
+        for index, sql in enumerate(statements):
+            cursor.execute(sql, (start, start + chunk - 1))
+            if index == 0:
+                processed += cursor.rowcount
+        conn.commit()
+        if pause:
+            time.sleep(pause)
+    return processed
+
+def backfill_minor_units(conn, table, target, source, chunk=BACKFILL_CHUNK, pause=BACKFILL_PAUSE):
+    """Заполнить колонку в копейках из REAL-колонки"""
+    pending = f'{target} IS NULL AND {source} IS NOT NULL'
+    return backfill_in_chunks(conn, table, f'''
+        UPDATE {table}
+        SET {target} = CAST(ROUND({source} * 100) AS INTEGER)
+        WHERE id BETWEEN ? AND ? AND {pending}
+    ''', where=pending, chunk=chunk, pause=pause)
+
+# ========== МИГРАЦИИ ==========
+
+def _column_exists(cursor, table, column):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+def _add_column(conn, table, column, definition):
+    cursor = conn.cursor()
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        conn.commit()
+
+def migrate_minor_units(conn):
+    for table, target, source in MINOR_COLUMNS:
+        _add_column(conn, table, target, 'INTEGER')
+        updated = backfill_minor_units(conn, table, target, source)
+        if updated:
+            print(f"✅ {table}.{target}: заполнено {updated} строк")
+
+def migrate_currency(conn):
+    # Все записи до появления валют были в рублях
+    _add_column(conn, 'transactions', 'currency', "TEXT NOT NULL DEFAULT 'RUB'")
+
+def migrate_user_totals_index(conn):
+    # Покрывающий индекс: статистика пользователя считается по индексу без чтения таблицы,
+    # он же отдает последние транзакции для главного экрана.
+    # SQLite строит индекс одной операцией, поэтому у него отдельная миграция и своя транзакция
+    cursor = conn.cursor()
+    cursor.execute('DROP INDEX IF EXISTS idx_transactions_user_type_date')
+    cursor.execute('DROP INDEX IF EXISTS idx_transactions_user_stats')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_totals
+        ON transactions (user_id, type, date, created_at, is_deleted, amount_minor, currency, category)
+    ''')
+    conn.commit()
+
+def migrate_archive(conn):
+    # Архивные таблицы повторяют колонки рабочих в том же порядке: строки переносятся
+    # через SELECT *, поэтому новые колонки рабочих таблиц нужно добавлять и в архив
+    cursor = conn.cursor()
+    for table in ARCHIVED_TABLES:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table}_archive AS SELECT * FROM {table} WHERE 0')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_archive_user_date
+        ON transactions_archive (user_id, date)
+    ''')
+
+    # Итоги перенесенной в архив истории по месяцам и категориям, в копейках базовой валюты
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            month TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, type, month, category)
+        )
+    ''')
+    conn.commit()
+
+def migrate_change_journal(conn):
+    # Журнал только дописывается: отмена и возврат - тоже записи, ссылающиеся на ref_id.
+    # before/after - JSON с прежними и новыми значениями измененных колонок
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            action TEXT NOT NULL CHECK(action IN ('update', 'delete', 'undo', 'redo')),
+            before TEXT NOT NULL,
+            after TEXT NOT NULL,
+            ref_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_journal_user ON change_journal (user_id, id)')
+    conn.commit()
+
+def migrate_row_versions(conn):
+    # Номер версии записи для оптимистичной блокировки: UPDATE проходит, только если
+    # версия не изменилась с момента чтения. Архив получает ту же колонку, чтобы
+    # порядок колонок совпадал с рабочими таблицами
+    for table in ARCHIVED_TABLES:
+        _add_column(conn, table, 'version', 'INTEGER NOT NULL DEFAULT 0')
+        _add_column(conn, f'{table}_archive', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+def migrate_plan_indexes(conn):
+    # Календарь читается двумя выборками по индексу вместо OR: свои планы по
+    # (user_id, date) и общие по (date). Частичные индексы не содержат удаленных
+    # строк, а индекс общих - и личных планов, поэтому остаются маленькими
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_plans_user_date
+        ON plans (user_id, date, time) WHERE is_deleted = 0
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_plans_shared_date
+        ON plans (date, time) WHERE is_shared = 1 AND is_deleted = 0
+    ''')
+    conn.commit()
+
+# Помесячный денежный поток в копейках базовой валюты: доходы и расходы (отложенное
+# ведут триггеры savings_contributions). row - NEW или OLD в триггере, sign - прибавить
+# строку или вычесть
+CASH_FLOW_UPSERT = '''
+        INSERT INTO monthly_cash_flow (user_id, month, income_minor, expense_minor)
+        SELECT {row}.user_id, strftime('%Y-%m', {row}.date),
+               CASE WHEN {row}.type = 'income' THEN {sign}{amount} ELSE 0 END,
+               CASE WHEN {row}.type = 'expense' THEN {sign}{amount} ELSE 0 END
+        WHERE {row}.is_deleted = 0
+        ON CONFLICT (user_id, month) DO UPDATE SET
+            income_minor = income_minor + excluded.income_minor,
+            expense_minor = expense_minor + excluded.expense_minor;
+'''
+
+# До миграции 13 взносы на покупки были расходами с purchase_id, и триггеры миграции 8
+# относили их к saved_minor потока и покупки. Миграция 15 заменяет их на CASH_FLOW_UPSERT
+_PURCHASE_FLOW_UPSERT = '''
+        INSERT INTO monthly_cash_flow (user_id, month, income_minor, expense_minor, saved_minor)
+        SELECT {row}.user_id, strftime('%Y-%m', {row}.date),
+               CASE WHEN {row}.type = 'income' THEN {sign}{amount} ELSE 0 END,
+               CASE WHEN {row}.type = 'expense' AND {row}.purchase_id IS NULL THEN {sign}{amount} ELSE 0 END,
+               CASE WHEN {row}.type = 'expense' AND {row}.purchase_id IS NOT NULL THEN {sign}{amount} ELSE 0 END
+        WHERE {row}.is_deleted = 0
+        ON CONFLICT (user_id, month) DO UPDATE SET
+            income_minor = income_minor + excluded.income_minor,
+            expense_minor = expense_minor + excluded.expense_minor,
+            saved_minor = saved_minor + excluded.saved_minor;
+        UPDATE planned_purchases SET saved_minor = saved_minor + {sign}{amount}
+        WHERE id = {row}.purchase_id AND {row}.type = 'expense' AND {row}.is_deleted = 0;
+'''
+
+def _cash_flow_change(row, sign, template=CASH_FLOW_UPSERT):
+    amount = f'COALESCE(({BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table=row)}), 0)'
+    return template.format(row=row, sign=sign, amount=amount)
+
+def migrate_savings(conn):
+    # Накопленное (planned_purchases.saved_minor) и денежный поток по месяцам
+    # поддерживаются триггерами при каждой записи, поэтому экран покупок их только читает.
+    # Удаления строк триггер не ловит: из transactions строки удаляет только архивация,
+    # а поток по месяцам хранит и архивную историю. Взносы здесь - еще расходы с
+    # purchase_id; миграция 13 переносит их в savings_contributions, а миграция 15
+    # убирает purchase_id из операций и из этих триггеров
+    for table in ('transactions', 'transactions_archive'):
+        _add_column(conn, table, 'purchase_id', 'INTEGER')
+    for table in ('planned_purchases', 'planned_purchases_archive'):
+        _add_column(conn, table, 'saved_minor', 'INTEGER NOT NULL DEFAULT 0')
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_cash_flow (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            income_minor INTEGER NOT NULL DEFAULT 0,
+            expense_minor INTEGER NOT NULL DEFAULT 0,
+            saved_minor INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchases_user_status
+        ON planned_purchases (user_id, status) WHERE is_deleted = 0
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_flow_insert
+        AFTER INSERT ON transactions
+        BEGIN {_cash_flow_change('NEW', '+', _PURCHASE_FLOW_UPSERT)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_flow_update
+        AFTER UPDATE OF user_id, type, amount_minor, currency, date, is_deleted, purchase_id ON transactions
+        BEGIN {_cash_flow_change('OLD', '-', _PURCHASE_FLOW_UPSERT)}
+              {_cash_flow_change('NEW', '+', _PURCHASE_FLOW_UPSERT)} END
+    ''')
+    conn.commit()
+
+    # Пересчет после создания триггеров и в одной транзакции: записи, попавшие между
+    # ними, пересчитываются заново, а все последующие учтет триггер
+    base = BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='t')
+    history = ' UNION ALL '.join(
+        f'SELECT t.user_id, t.date, t.type, t.purchase_id, COALESCE(({base}), 0) AS base_minor '
+        f'FROM {table} t WHERE t.is_deleted = 0'
+        for table in ('transactions', 'transactions_archive'))
+    cursor.execute('DELETE FROM monthly_cash_flow')
+    cursor.execute(f'''
+        INSERT INTO monthly_cash_flow (user_id, month, income_minor, expense_minor, saved_minor)
+        SELECT user_id, strftime('%Y-%m', date),
+               SUM(CASE WHEN type = 'income' THEN base_minor ELSE 0 END),
+               SUM(CASE WHEN type = 'expense' AND purchase_id IS NULL THEN base_minor ELSE 0 END),
+               SUM(CASE WHEN type = 'expense' AND purchase_id IS NOT NULL THEN base_minor ELSE 0 END)
+        FROM ({history})
+        GROUP BY user_id, strftime('%Y-%m', date)
+    ''')
+    cursor.execute('UPDATE planned_purchases SET saved_minor = 0 WHERE saved_minor != 0')
+    cursor.execute(f'''
+        UPDATE planned_purchases SET saved_minor = h.saved_minor
+        FROM (SELECT purchase_id, SUM(base_minor) AS saved_minor FROM ({history})
+              WHERE type = 'expense' AND purchase_id IS NOT NULL GROUP BY purchase_id) h
+        WHERE planned_purchases.id = h.purchase_id
+    ''')
+    conn.commit()
+
+def migrate_purchase_links(conn):
+    # Купленная покупка ссылается на расход, которым она оплачена. Уникальный индекс
+    # не дает связать один расход с двумя покупками и отвечает на "связан ли расход"
+    for table in ('planned_purchases', 'planned_purchases_archive'):
+        _add_column(conn, table, 'transaction_id', 'INTEGER')
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_purchases_transaction
+        ON planned_purchases (transaction_id) WHERE transaction_id IS NOT NULL
+    ''')
+    conn.commit()
+
+def migrate_closed_periods(conn):
+    # Итоги закрытых месяцев замораживаются в period_totals, а отметка в closed_periods
+    # говорит, что они актуальны. Запись операции, покупки или курса за прошлый месяц
+    # снимает отметку этого месяца, и при следующем чтении он пересчитывается.
+    # generation не повторяется, поэтому по нему можно проверять кэши в памяти
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS closed_periods (
+            generation INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT NOT NULL UNIQUE,
+            closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS period_totals (
+            month TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month, user_id, type, category)
+        ) WITHOUT ROWID
+    ''')
+
+    reopen = 'DELETE FROM closed_periods WHERE month IN ({});'
+    month_of = "strftime('%Y-%m', {})"
+    triggers = {
+        'trg_transactions_period_insert': ('AFTER INSERT ON transactions', [month_of.format('NEW.date')]),
+        'trg_transactions_period_update': (
+            'AFTER UPDATE OF user_id, type, amount_minor, currency, category, date, is_deleted ON transactions',
+            [month_of.format('OLD.date'), month_of.format('NEW.date')]),
+        # Архивация удаляет строки из рабочей таблицы, а их суммы уходят в transaction_rollups
+        'trg_transactions_period_delete': ('AFTER DELETE ON transactions', [month_of.format('OLD.date')]),
+        'trg_purchases_period_insert': ('AFTER INSERT ON planned_purchases', [month_of.format('NEW.target_date')]),
+        # Взносы меняют только saved_minor - на закрытые месяцы они не влияют
+        'trg_purchases_period_update': (
+            'AFTER UPDATE ON planned_purchases WHEN NEW.saved_minor = OLD.saved_minor',
+            [month_of.format(f'{row}.{column}') for row in ('OLD', 'NEW')
+             for column in ('target_date', 'updated_at')] +
+            [f"(SELECT {month_of.format('t.date')} FROM transactions t WHERE t.id = {row}.transaction_id)"
+             for row in ('OLD', 'NEW')]),
+    }
+    for name, (event, months) in triggers.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {reopen.format(", ".join(months))} END')
+
+    # Новый или измененный курс меняет суммы в рублях с его даты, а самый ранний курс
+    # валюты - и для всех более старых операций
+    for event in ('INSERT', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_exchange_rates_period_{event.lower()}
+            AFTER {event} ON exchange_rates
+            BEGIN
+                DELETE FROM closed_periods
+                WHERE month >= strftime('%Y-%m', NEW.date)
+                   OR NOT EXISTS (SELECT 1 FROM exchange_rates r WHERE r.currency = NEW.currency AND r.date < NEW.date);
+            END
+        ''')
+    conn.commit()
+
+def migrate_expense_split(conn):
+    # split_share - доля расхода (в процентах), которую должен партнер, split_minor - она же
+    # в копейках базовой валюты по курсу на момент записи. split_ledger хранит, сколько
+    # каждый заплатил за другого (доли в расходах и переводы в расчет); разница двух
+    # строк - кто кому должен. Триггеры ведут обе величины при каждой записи, а
+    # баланс меняется ровно на разницу сохраненных split_minor, поэтому не расходится
+    # с операциями даже после смены курсов
+    for table in ('transactions', 'transactions_archive'):
+        _add_column(conn, table, 'split_share', 'INTEGER NOT NULL DEFAULT 0')
+        _add_column(conn, table, 'split_minor', 'INTEGER NOT NULL DEFAULT 0')
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS split_defaults (
+            category TEXT PRIMARY KEY,
+            share INTEGER NOT NULL CHECK(share BETWEEN 0 AND 100)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS split_ledger (
+            user_id INTEGER PRIMARY KEY,
+            credit_minor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settlements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user INTEGER NOT NULL,
+            to_user INTEGER NOT NULL,
+            amount_minor INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Доля в копейках пересчитывается из суммы, валюты, даты и процента. Триггер меняет
+    # только split_minor, а на это изменение отвечает триггер баланса ниже
+    split_minor = (f"CASE WHEN NEW.type = 'expense' THEN CAST(ROUND(COALESCE(("
+                   f"{BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='NEW')}), 0) * NEW.split_share / 100.0) "
+                   f"AS INTEGER) ELSE 0 END")
+    for name, event in (('insert', 'AFTER INSERT ON transactions WHEN NEW.split_share != 0'),
+                        ('update', 'AFTER UPDATE OF type, amount_minor, currency, date, split_share ON transactions '
+                                   'WHEN NEW.split_share != 0 OR NEW.split_minor != 0')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_split_{name} {event}
+            BEGIN UPDATE transactions SET split_minor = {split_minor} WHERE id = NEW.id; END
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_split_ledger
+        AFTER UPDATE OF split_minor, is_deleted, user_id ON transactions
+        BEGIN
+            INSERT INTO split_ledger (user_id, credit_minor)
+            SELECT OLD.user_id, -OLD.split_minor WHERE OLD.is_deleted = 0 AND OLD.split_minor != 0
+            ON CONFLICT (user_id) DO UPDATE SET credit_minor = credit_minor + excluded.credit_minor;
+            INSERT INTO split_ledger (user_id, credit_minor)
+            SELECT NEW.user_id, NEW.split_minor WHERE NEW.is_deleted = 0 AND NEW.split_minor != 0
+            ON CONFLICT (user_id) DO UPDATE SET credit_minor = credit_minor + excluded.credit_minor;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_settlements_ledger
+        AFTER INSERT ON settlements
+        BEGIN
+            INSERT INTO split_ledger (user_id, credit_minor) VALUES (NEW.from_user, NEW.amount_minor)
+            ON CONFLICT (user_id) DO UPDATE SET credit_minor = credit_minor + excluded.credit_minor;
+        END
+    ''')
+    conn.commit()
+
+def migrate_split_index(conn):
+    # Частичные индексы только по разделенным расходам: сводка долгов домохозяйства
+    # читает их, не просматривая остальную историю
+    cursor = conn.cursor()
+    for table in ('transactions', 'transactions_archive'):
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table}_split
+            ON {table} (user_id, split_minor) WHERE is_deleted = 0 AND split_minor != 0
+        ''')
+    conn.commit()
+
+def migrate_savings_contributions(conn):
+    # Взносы на покупки хранились расходами с purchase_id и попадали во все суммы
+    # расходов, хотя отложенные деньги остаются у пары. Теперь это отдельная таблица:
+    # base_minor фиксируется при записи, триггеры ведут planned_purchases.saved_minor
+    # и monthly_cash_flow.saved_minor. Старые взносы переносятся из операций и архива
+    # (с вычетом из итогов по месяцам), накопленное пересчитывается заново
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS savings_contributions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            purchase_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount_minor INTEGER NOT NULL,
+            currency TEXT NOT NULL DEFAULT 'RUB',
+            base_minor INTEGER NOT NULL,
+            date DATE DEFAULT CURRENT_DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (purchase_id) REFERENCES planned_purchases (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_savings_contributions_purchase
+        ON savings_contributions (purchase_id)
+    ''')
+    for name, row, sign in (('insert', 'NEW', '+'), ('delete', 'OLD', '-')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_savings_contributions_{name}
+            AFTER {name.upper()} ON savings_contributions
+            BEGIN
+                UPDATE planned_purchases SET saved_minor = saved_minor {sign} {row}.base_minor
+                WHERE id = {row}.purchase_id;
+                INSERT INTO monthly_cash_flow (user_id, month, saved_minor)
+                VALUES ({row}.user_id, strftime('%Y-%m', {row}.date), {sign}{row}.base_minor)
+                ON CONFLICT (user_id, month) DO UPDATE SET saved_minor = saved_minor + excluded.saved_minor;
+            END
+        ''')
+    conn.commit()
+
+    # Перенос и пересчет - одной транзакцией: прерванная миграция откатывается целиком
+    base = BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='t')
+    for table in ('transactions', 'transactions_archive'):
+        cursor.execute(f'''
+            INSERT INTO savings_contributions (purchase_id, user_id, amount_minor, currency, base_minor, date,
+                                               created_at)
+            SELECT t.purchase_id, t.user_id, t.amount_minor, t.currency, COALESCE(({base}), 0), t.date, t.created_at
+            FROM {table} t WHERE t.purchase_id IS NOT NULL AND t.is_deleted = 0
+        ''')
+    # Архивные взносы уже вошли в итоги по месяцам - вычитаем их
+    cursor.execute(f'''
+        UPDATE transaction_rollups
+        SET total_minor = transaction_rollups.total_minor - a.total_minor, count = transaction_rollups.count - a.count
+        FROM (SELECT t.user_id, t.type, strftime('%Y-%m', t.date) AS month, COALESCE(t.category, '') AS category,
+                     SUM(COALESCE(({base}), 0)) AS total_minor, COUNT(*) AS count
+              FROM transactions_archive t WHERE t.purchase_id IS NOT NULL AND t.is_deleted = 0
+              GROUP BY 1, 2, 3, 4) a
+        WHERE transaction_rollups.user_id = a.user_id AND transaction_rollups.type = a.type
+          AND transaction_rollups.month = a.month AND transaction_rollups.category = a.category
+    ''')
+    cursor.execute('DELETE FROM transaction_rollups WHERE count <= 0')
+    # Доля партнера во взносе снимается с баланса триггером раздела расходов
+    cursor.execute('UPDATE transactions SET split_share = 0 WHERE purchase_id IS NOT NULL AND split_share != 0')
+    moved = sum(cursor.execute(f'DELETE FROM {table} WHERE purchase_id IS NOT NULL').rowcount
+                for table in ('transactions', 'transactions_archive'))
+    if moved:
+        # Замороженные итоги архивных месяцев тоже содержали взносы
+        cursor.execute('DELETE FROM closed_periods')
+
+    for table in ('planned_purchases', 'planned_purchases_archive'):
+        cursor.execute(f'''
+            UPDATE {table} SET saved_minor = COALESCE(
+                (SELECT SUM(c.base_minor) FROM savings_contributions c WHERE c.purchase_id = {table}.id), 0)
+        ''')
+    cursor.execute('''
+        UPDATE monthly_cash_flow SET saved_minor = COALESCE(
+            (SELECT SUM(c.base_minor) FROM savings_contributions c
+             WHERE c.user_id = monthly_cash_flow.user_id AND strftime('%Y-%m', c.date) = monthly_cash_flow.month), 0)
+    ''')
+    conn.commit()
+
+def migrate_journal_buy_action(conn):
+    # Отметка покупки, при которой бот сам записал расход, пишется в журнал действием
+    # 'buy': отмена тогда удаляет и этот расход. CHECK в SQLite не меняется на месте,
+    # поэтому журнал пересобирается (один раз - новая схема уже допускает 'buy')
+    cursor = conn.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_journal'")
+    if "'buy'" in cursor.fetchone()[0]:
+        return
+    cursor.execute('DROP TABLE IF EXISTS change_journal_new')
+    cursor.execute('''
+        CREATE TABLE change_journal_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            action TEXT NOT NULL CHECK(action IN ('update', 'buy', 'delete', 'undo', 'redo')),
+            before TEXT NOT NULL,
+            after TEXT NOT NULL,
+            ref_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('INSERT INTO change_journal_new SELECT * FROM change_journal')
+    cursor.execute('DROP TABLE change_journal')
+    cursor.execute('ALTER TABLE change_journal_new RENAME TO change_journal')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_journal_user ON change_journal (user_id, id)')
+    conn.commit()
+
+def migrate_cash_flow_triggers(conn):
+    # После миграции 13 взносов среди операций нет: триггеры потока считают только доходы
+    # и расходы, а всегда пустая колонка purchase_id удаляется из операций и архива.
+    # Замена триггеров - одной транзакцией, чтобы запись между DROP и CREATE не потерялась
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_transactions_flow_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_transactions_flow_update')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_transactions_flow_insert
+        AFTER INSERT ON transactions
+        BEGIN {_cash_flow_change('NEW', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_transactions_flow_update
+        AFTER UPDATE OF user_id, type, amount_minor, currency, date, is_deleted ON transactions
+        BEGIN {_cash_flow_change('OLD', '-')} {_cash_flow_change('NEW', '+')} END
+    ''')
+    # Представления читают t.* и пересоздаются после миграций (_refresh_views); пока
+    # колонка удалена только из одной таблицы, UNION ALL в transactions_history не сходится
+    cursor.execute('DROP VIEW IF EXISTS transactions_history')
+    cursor.execute('DROP VIEW IF EXISTS transactions_base')
+    for table in ('transactions', 'transactions_archive'):
+        if _column_exists(cursor, table, 'purchase_id'):
+            cursor.execute(f'ALTER TABLE {table} DROP COLUMN purchase_id')
+    conn.commit()
+
+def migrate_archive_id_index(conn):
+    # Архив создан через CREATE TABLE AS и первичного ключа не имеет; покупка находит
+    # свой перенесенный в архив расход по этому индексу, не просматривая весь архив
+    cursor = conn.cursor()
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_archive_id ON transactions_archive (id)')
+    conn.commit()
+
+# Версия схемы - номер последней примененной миграции. Новые миграции добавляются
+# только в конец списка; каждая должна быть идемпотентной, так как прерванная
+# миграция при следующем запуске выполняется заново
+MIGRATIONS = [
+    (1, 'суммы в копейках', migrate_minor_units),
+    (2, 'валюта транзакций', migrate_currency),
+    (3, 'покрывающий индекс статистики', migrate_user_totals_index),
+    (4, 'архив и итоги по месяцам', migrate_archive),
+    (5, 'журнал изменений', migrate_change_journal),
+    (6, 'версии записей', migrate_row_versions),
+    (7, 'индексы календаря планов', migrate_plan_indexes),
+    (8, 'цели накоплений', migrate_savings),
+    (9, 'связь покупок с расходами', migrate_purchase_links),
+    (10, 'закрытые периоды', migrate_closed_periods),
+    (11, 'раздел расходов', migrate_expense_split),
+    (12, 'индекс разделенных расходов', migrate_split_index),
+    (13, 'взносы отдельно от расходов', migrate_savings_contributions),
+    (14, 'отметка покупки в журнале', migrate_journal_buy_action),
+    (15, 'поток без взносов среди операций', migrate_cash_flow_triggers),
+    (16, 'индекс архива операций по id', migrate_archive_id_index),
+]
+
+def _refresh_views(cursor):
+    # Базовая валюта берется из настроек, поэтому представление пересоздается при каждом запуске
+    cursor.execute('DROP VIEW IF EXISTS transactions_base')
+    cursor.execute(f'''
+        CREATE VIEW transactions_base AS
+        SELECT t.*, {BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='t')} AS base_minor
+        FROM transactions t
+    ''')
+    # Вся история: рабочая таблица и архив - для запросов "за все время"
+    cursor.execute('DROP VIEW IF EXISTS transactions_history')
+    cursor.execute(f'''
+        CREATE VIEW transactions_history AS
+        SELECT * FROM transactions_base
+        UNION ALL
+        SELECT t.*, {BASE_AMOUNT_SQL.format(base=BASE_CURRENCY, table='t')} AS base_minor
+        FROM transactions_archive t
+    ''')
+
+def get_schema_version(cursor):
+    """Номер последней примененной миграции (0 для новой базы)"""
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+def migrate_database():
+    """Применить к базе миграции, которых в ней еще нет; возвращает версию схемы"""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    # WAL: чтение не ждет записи, а запись бота встает между кусками заполнения,
+    # а не ждет, пока освободится весь файл базы. Режим сохраняется в самом файле
+    cursor.execute('PRAGMA journal_mode=WAL')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    version = get_schema_version(cursor)
+    if version > MIGRATIONS[-1][0]:
+        print(f"⚠️ Версия схемы базы ({version}) новее кода ({MIGRATIONS[-1][0]})")
+
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        migrate(conn)
+        cursor.execute('INSERT OR IGNORE INTO schema_version (version, name) VALUES (?, ?)', (number, name))
+        conn.commit()
+        version = number
+        print(f"✅ Миграция {number}: {name}")
+
+    _refresh_views(cursor)
+    conn.commit()
+    conn.close()
+    return version
+
+if __name__ == '__main__':
+    print(f"Версия схемы: {migrate_database()}")
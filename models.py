@@ -0,0 +1,31 @@
+from collections import namedtuple
+
+# Строки из базы - именованные кортежи: по памяти это обычный tuple,
+# но поля читаются по имени, а форма записи видна из определения
+
+Transaction = namedtuple('Transaction', 'id user_id type amount category description date time currency base_amount split_share')
+Plan = namedtuple('Plan', 'id user_id title description date time category is_shared author')
+Purchase = namedtuple('Purchase', 'id user_id item_name cost priority target_date notes status saved transaction_id')
+JournalEntry = namedtuple('JournalEntry', 'id table_name record_id action before after ref_id created_at')
+
+# Колонки SELECT в порядке полей соответствующего типа
+# (TRANSACTION_COLUMNS читаются из представления transactions_base)
+TRANSACTION_COLUMNS = '''id, user_id, type, amount_minor / 100.0 AS amount, category, description, date,
+               strftime('%H:%M', created_at) AS time, currency, base_minor / 100.0 AS base_amount,
+               split_share'''
+PLAN_COLUMNS = '''id, user_id, title, description, date, time, category, is_shared,
+               (SELECT COALESCE(full_name, username) FROM users WHERE users.id = plans.user_id) AS author'''
+PURCHASE_COLUMNS = '''id, user_id, item_name, estimated_cost_minor / 100.0 AS cost, priority, target_date,
+               notes, status, saved_minor / 100.0 AS saved, transaction_id'''
+JOURNAL_COLUMNS = '''id, table_name, record_id, action, before, after, ref_id,
+               strftime('%Y-%m-%d %H:%M', created_at) AS created_at'''
+
+def row_factory(row_type):
+    """Фабрика строк для sqlite3: кортеж из курсора сразу становится row_type"""
+    # tuple.__new__ и тип связаны через аргументы по умолчанию - это быстрее замыкания
+    return lambda cursor, row, new=tuple.__new__, cls=row_type: new(cls, row)
+
+TRANSACTION_ROW = row_factory(Transaction)
+PLAN_ROW = row_factory(Plan)
+PURCHASE_ROW = row_factory(Purchase)
+JOURNAL_ROW = row_factory(JournalEntry)
@@ -0,0 +1,46 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from config import MY_USER_ID, GIRLFRIEND_USER_ID, NOTIFY_WINDOW_MINUTES
+from database import get_user_names
+from formatters import render_partner_digest
+
+# Событие партнера: kind - 'expense', 'shared_plan' или 'purchase_done',
+# record - строка из базы на момент события (models.Transaction/Plan/Purchase)
+PartnerEvent = namedtuple('PartnerEvent', 'kind record')
+
+# События копятся в памяти по получателям. Окно открывается первым событием
+# и закрывается через NOTIFY_WINDOW_MINUTES: все, что пришло за это время,
+# уходит одним сообщением. При остановке бота накопленное отправляется сразу
+_pending = defaultdict(list)  # получатель -> события
+_window_start = {}  # получатель -> время первого события в окне
+
+def get_partner_id(user_id):
+    """Второй участник пары"""
+    return GIRLFRIEND_USER_ID if user_id == MY_USER_ID else MY_USER_ID
+
+def queue_partner_event(user_id, kind, record):
+    """Добавить действие user_id в сводку для партнера"""
+    if NOTIFY_WINDOW_MINUTES <= 0 or record is None:
+        return
+    recipient = get_partner_id(user_id)
+    _window_start.setdefault(recipient, datetime.now())
+    _pending[recipient].append(PartnerEvent(kind, record))
+
+async def send_due_digests(bot, force=False):
+    """Отправить сводки, у которых закончилось окно (force - все накопленные)"""
+    deadline = datetime.now() - timedelta(minutes=NOTIFY_WINDOW_MINUTES)
+    due = [recipient for recipient, started in _window_start.items() if force or started <= deadline]
+    if not due:
+        return 0
+    
+    names = get_user_names()
+    for recipient in due:
+        del _window_start[recipient]
+        events = _pending.pop(recipient)
+        author = names.get(get_partner_id(recipient), "Партнер")
+        try:
+            await bot.send_message(recipient, render_partner_digest(author, events), parse_mode='HTML')
+        except Exception as e:
+            print(f"Ошибка отправки сводки пользователю {recipient}: {e}")
+    return len(due)
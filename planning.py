@@ -0,0 +1,68 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+
+from database import get_closed_periods, get_data_version, get_planned_vs_actual
+
+REPORT_MONTHS = 6  # сколько месяцев, включая текущий, показывает отчет
+
+# Итоги закрытого месяца хранятся, пока не сменится его generation в closed_periods
+# (запись задним числом); месяцы без отметки и текущий пересчитываются при
+# изменении данных
+_closed_months = {}
+_open_month = {}
+
+# ========== РАСЧЕТ ==========
+
+def _month_name(index):
+    """Порядковый номер месяца -> 'ГГГГ-ММ'"""
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def _month_bounds(first, last):
+    """Первый день месяца first и последний день месяца last ('ГГГГ-ММ')"""
+    year, month = map(int, last.split('-'))
+    return f"{first}-01", f"{last}-{calendar.monthrange(year, month)[1]:02d}"
+
+def build_months(rows, months):
+    """Строки get_planned_vs_actual -> итоги по каждому из months (пустые месяцы тоже)"""
+    grouped = defaultdict(list)
+    for month, category, planned, actual, count, linked in rows:
+        grouped[month].append({'category': category, 'planned': planned or 0, 'actual': actual,
+                               'count': count, 'linked': linked})
+
+    report = {}
+    for month in months:
+        categories = grouped.get(month, [])
+        report[month] = {
+            'month': month,
+            'categories': categories,
+            # Факт сравнивается с планом только для покупок, которые уже сделаны
+            'planned': sum(item['planned'] for item in categories if item['category'] is not None),
+            'pending': sum(item['planned'] for item in categories if item['category'] is None),
+            'actual': sum(item['actual'] for item in categories),
+        }
+    return report
+
+def get_plan_report(months=REPORT_MONTHS, today=None):
+    """План и факт по покупкам пары за последние months месяцев, от старых к новым"""
+    today = today or date.today()
+    current = today.year * 12 + today.month - 1
+    names = [_month_name(index) for index in range(current - months + 1, current + 1)]
+    closed, open_month = names[:-1], names[-1]
+
+    version = get_data_version()
+    periods = get_closed_periods()
+    keys = {month: (periods[month], None) if month in periods else (None, version) for month in closed}
+    key = (open_month, version)
+    missing = [month for month in closed if _closed_months.get(month, (None,))[0] != keys[month]]
+    if missing or key not in _open_month:
+        # Одна выборка от первого недостающего месяца до текущего
+        first = missing[0] if missing else open_month
+        report = build_months(get_planned_vs_actual(*_month_bounds(first, open_month)),
+                              names[names.index(first):])
+        for month in missing:
+            _closed_months[month] = (keys[month], report[month])
+        _open_month.clear()
+        _open_month[key] = report[open_month]
+
+    return [_closed_months[month][1] for month in closed] + [_open_month[key]]
@@ -0,0 +1,115 @@
+import asyncio
+import io
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from config import RECEIPT_OCR_LANG, RECEIPT_WORKERS
+
+# Распознавание необязательно: без pytesseract/Pillow бот просит ввести сумму чека вручную
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+OCR_AVAILABLE = pytesseract is not None
+
+RECEIPT_MAX_SIDE = 2000  # фото крупнее уменьшаются: точности хватает, а распознавание быстрее
+
+Receipt = namedtuple('Receipt', 'total date merchant')
+
+# ========== РАЗБОР ТЕКСТА ЧЕКА ==========
+
+_AMOUNT_RE = re.compile(r'(?<![\d.,])(\d{1,3}(?:\s\d{3})+|\d+)[.,](\d{2})(?!\d)')
+_DATE_RE = re.compile(r'(?<!\d)(?:(\d{2})[./-](\d{2})[./-](\d{4}|\d{2})|(\d{4})-(\d{2})-(\d{2}))(?!\d)')
+_TOTAL_WORDS = ('итог', 'к оплате', 'всего', 'total')
+_SKIP_WORDS = ('ндс', 'скидк', 'сдача', 'наличн', 'получено')
+_MERCHANT_FORMS = re.compile(r'^(ооо|оао|пао|зао|ао|ип|llc|ltd)\b', re.I)
+_HEADER_WORDS = ('кассовый чек', 'приход', 'добро пожаловать', 'чек', 'фискальный', 'смена')
+
+def _amounts(line):
+    return [float(''.join(whole.split()) + '.' + cents) for whole, cents in _AMOUNT_RE.findall(line)]
+
+def _find_total(lines):
+    """Сумма из строки ИТОГ/К ОПЛАТЕ, иначе наибольшая сумма чека"""
+    totals, others = [], []
+    for line in lines:
+        lowered = line.lower()
+        if any(word in lowered for word in _SKIP_WORDS):
+            continue
+        amounts = _amounts(line)
+        (totals if any(word in lowered for word in _TOTAL_WORDS) else others).extend(amounts)
+    candidates = totals or others
+    return max(candidates) if candidates else None
+
+def _find_date(text, today):
+    """Первая настоящая дата не позже сегодняшней ('ГГГГ-ММ-ДД')"""
+    for match in _DATE_RE.finditer(text):
+        day, month, year, iso_year, iso_month, iso_day = match.groups()
+        if iso_year:
+            year, month, day = iso_year, iso_month, iso_day
+        elif len(year) == 2:
+            year = f'20{year}'
+        try:
+            found = date(int(year), int(month), int(day))
+        except ValueError:
+            continue
+        if found <= today:
+            return found.isoformat()
+    return None
+
+def _find_merchant(lines):
+    """Продавец: строка с ООО/ИП в шапке чека, иначе первая строка со словами"""
+    # Строки с суммами и датами - уже тело чека, а не название
+    header = [line.strip(' *=-') for line in lines[:6] if not _AMOUNT_RE.search(line) and not _DATE_RE.search(line)]
+    named = [line for line in header if len(re.findall(r'[^\W\d_]', line)) >= 3
+             and not any(word in line.lower() for word in _HEADER_WORDS)]
+    for line in header:
+        if _MERCHANT_FORMS.match(line):
+            return line[:60]
+    return named[0][:60] if named else None
+
+def parse_receipt(text, today=None):
+    """Текст чека -> Receipt(сумма или None, дата или None, продавец или None)"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return Receipt(_find_total(lines), _find_date(text, today or date.today()), _find_merchant(lines))
+
+# ========== РАСПОЗНАВАНИЕ (выполняется в пуле процессов) ==========
+
+def prepare_image(data):
+    """Байты фото -> изображение в оттенках серого не больше RECEIPT_MAX_SIDE"""
+    image = Image.open(io.BytesIO(data)).convert('L')
+    image.thumbnail((RECEIPT_MAX_SIDE, RECEIPT_MAX_SIDE))
+    return image
+
+def recognize_receipt(data):
+    """Байты фото чека -> Receipt"""
+    text = pytesseract.image_to_string(prepare_image(data), lang=RECEIPT_OCR_LANG)
+    return parse_receipt(text)
+
+# ========== ОЧЕРЕДЬ ЧЕКОВ ==========
+
+_executor = None
+
+def _get_executor():
+    """Пул процессов создается при первом чеке; чеки сверх числа процессов ждут в его очереди"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=RECEIPT_WORKERS)
+    return _executor
+
+def shutdown_receipt_pool():
+    """Остановить пул процессов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def read_receipt(data):
+    """Распознать чек, не блокируя цикл событий (None, если распознавание недоступно)"""
+    if not OCR_AVAILABLE:
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), recognize_receipt, data)
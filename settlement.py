@@ -0,0 +1,71 @@
+import heapq
+
+from database import get_data_version, get_split_flows
+
+# Долю партнера (split_share) в расходе участник домохозяйства платит за остальных:
+# она делится между ними поровну. Переводы в расчет уменьшают долг отправителя.
+# План расчета пересчитывается при изменении данных
+_plan_cache = {}
+
+# ========== БАЛАНСЫ ==========
+
+def net_balances(flows, members=()):
+    """Чистый баланс каждого участника в копейках: > 0 - ему должны, < 0 - он должен.
+
+    flows - строки get_split_flows, members - участники, которых может не быть в
+    данных. Доли делятся на n - 1 человек нацело: остаток раздается по копейке
+    участникам с наибольшими дробными частями, поэтому сумма балансов ровно 0.
+    """
+    paid = {user_id: 0 for user_id in members}
+    transferred = dict(paid)
+    for user_id, user_paid, user_transferred in flows:
+        paid[user_id] = paid.get(user_id, 0) + user_paid
+        transferred[user_id] = transferred.get(user_id, 0) + user_transferred
+    if len(paid) < 2:
+        return {user_id: 0 for user_id in paid}
+
+    # Баланс, умноженный на n - 1: заплаченное за других минус свои доли в чужих
+    # расходах (total - paid) плюс переводы - суммы целые и в сумме дают 0
+    others = len(paid) - 1
+    total = sum(paid.values())
+    scaled = {user_id: paid[user_id] * len(paid) - total + transferred[user_id] * others for user_id in paid}
+
+    balances = {user_id: value // others for user_id, value in scaled.items()}
+    leftover = -sum(balances.values())
+    for user_id in sorted(scaled, key=lambda user_id: scaled[user_id] % others, reverse=True)[:leftover]:
+        balances[user_id] += 1
+    return balances
+
+def simplify_debts(balances):
+    """Минимум переводов, закрывающих балансы: [(кто платит, кому, копейки)].
+
+    Жадно: крупнейший должник платит крупнейшему кредитору, пока кто-то из них не
+    выйдет в ноль. Каждый шаг закрывает хотя бы один баланс, так что переводов не
+    больше n - 1 вместо перевода по каждой паре.
+    """
+    creditors = [(-amount, user_id) for user_id, amount in balances.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if credit + amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if debt + amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+def get_settle_plan(members=()):
+    """Переводы, после которых домохозяйство в расчете: [(кто платит, кому, сумма)]"""
+    key = (get_data_version(), tuple(members))
+    if key not in _plan_cache:
+        _plan_cache.clear()
+        balances = net_balances(get_split_flows(), members)
+        _plan_cache[key] = [(debtor, creditor, amount / 100)
+                            for debtor, creditor, amount in simplify_debts(balances)]
+    return _plan_cache[key]
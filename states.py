@@ -27,6 +27,12 @@ class AddPurchase(StatesGroup):
     waiting_for_date = State()
     waiting_for_notes = State()
 
+class SavePurchase(StatesGroup):
+    waiting_for_amount = State()
+
+class ReceiptExpense(StatesGroup):
+    waiting_for_confirmation = State()
+
 # ========== СОСТОЯНИЯ ДЛЯ РЕДАКТИРОВАНИЯ ==========
 
 class EditExpense(StatesGroup):